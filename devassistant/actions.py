@@ -12,13 +12,12 @@ except ImportError:
 
 from devassistant import argument
 from devassistant import bin
-from devassistant import dapi
+from devassistant import completion
 from devassistant import exceptions
 from devassistant import lang
 from devassistant import settings
 from devassistant import utils
 from devassistant.assistant_base import AssistantBase
-from devassistant.dapi import dapicli
 from devassistant.logger import logger
 
 actions = {}
@@ -88,15 +87,34 @@ class Action(object):
         raise NotImplementedError()
 
 
+class _InstalledDaps(object):
+    """Sorted names of installed DAPs to be used as argument choices. They're looked up
+    only when needed, so that dapicli doesn't have to be imported on every start."""
+
+    def _get(self):
+        from devassistant.dapi import dapicli
+        return sorted(dapicli.get_installed_daps())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __contains__(self, item):
+        return item in self._get()
+
+    def __len__(self):
+        return len(self._get())
+
+
 @register_action
 class DocAction(Action):
     name = 'doc'
     description = 'Display documentation for a DAP package.'
-    args = [argument.Argument('dap', 'dap', choices=sorted(dapicli.get_installed_daps()),
+    args = [argument.Argument('dap', 'dap', choices=_InstalledDaps(),
                               help='Packages to get documentation for'),
             argument.Argument('doc', 'doc', nargs='?', help='Document to display')]
 
     def run(self):
+        from devassistant.dapi import dapicli
         dap = self.kwargs['dap']
         doc = self.kwargs.get('doc', None)
         docdir = utils.find_file_in_load_dirs(os.path.join('doc', dap))
@@ -285,6 +303,7 @@ class PkgInstallAction(Action):
     ]
 
     def run(self):
+        from devassistant.dapi import dapicli
         exs = []
         for pkg in self.kwargs['package']:
             logger.info('Installing DAP {pkg} ...'.format(pkg=pkg))
@@ -317,6 +336,7 @@ class PkgUninstallAction(Action):
     ]
 
     def run(self):
+        from devassistant.dapi import dapicli
         exs = []
         uninstalled = []
         for pkg in self.kwargs['package']:
@@ -361,6 +381,7 @@ class PkgUpdateAction(Action):
     ]
 
     def run(self):
+        from devassistant.dapi import dapicli
         pkgs = exs = []
         try:
             pkgs = self.kwargs['package']
@@ -404,6 +425,7 @@ class PkgListAction(Action):
     ]
 
     def run(self):
+        from devassistant.dapi import dapicli
         if [self.kwargs[k] for k in ['installed', 'remote', 'available']].count(True) > 1:
             logger.error('Only one of --installed, --remote or --available '
                          'can be used simultaneously')
@@ -440,6 +462,7 @@ class PkgSearchAction(Action):
     ]
 
     def run(self):
+        from devassistant.dapi import dapicli
         newargs = {}
         newargs['q'] = ' '.join(self.kwargs['query'])
         newargs['noassistants'] = self.kwargs['noassistants']
@@ -448,7 +471,7 @@ class PkgSearchAction(Action):
         newargs['minimal_rank'] = self.kwargs['minrank']
         newargs['minimal_rank_count'] = self.kwargs['mincount']
         if not self.kwargs['allplatforms']:
-            newargs['platform'] = utils.get_distro_name()
+            newargs['platform'] = utils.get_system_facts().distro_name
 
         try:
             logger.infolines(dapicli.format_search(**newargs))
@@ -468,6 +491,8 @@ class PkgInfoAction(Action):
                               required=False, action='store_true')]
 
     def run(self):
+        from devassistant import dapi
+        from devassistant.dapi import dapicli
         if os.path.isfile(self.kwargs['package']):
             old_level = logger.getEffectiveLevel()
             logger.setLevel(logging.ERROR)
@@ -511,6 +536,7 @@ class PkgLintAction(Action):
     ]
 
     def run(self):
+        from devassistant import dapi
         error = False
         old_level = logger.getEffectiveLevel()
         for pkg in self.kwargs['package']:
@@ -568,7 +594,7 @@ class AutoCompleteAction(Action):
     hidden = True
 
     _assistant_names = ['create', 'tweak', 'prepare', 'extra']
-    _special_tokens = ['--debug']
+    _special_tokens = completion.SPECIAL_TOKENS
 
     def __init__(self, **kwargs):
         self.kwargs = kwargs
@@ -576,84 +602,44 @@ class AutoCompleteAction(Action):
         self._actions = [action for action in actions if not action.hidden]
 
     def run(self):
+        index = self.get_index()
+        # store the index, so that next time CliRunner can answer it without loading
+        #  assistants and actions
+        completion.write_index(index)
+        print(' '.join(completion.complete(index, self.kwargs.get('path', '').split())))
+
+    def get_index(self):
+        """Returns completion index - a dict with "root" (list of strings completed when
+        no path is given) and "elems" (list of nodes for roles and non-hidden actions, see
+        _get_index_node)."""
         # Assistant names are hardcoded here because on the root level, we only
         # want to show these nice long forms. All forms incl. old aliases are
         # autocompleted, of course.
-        flags = self._get_flags_for_path(self.kwargs.get('path', '').split())
-        print(' '.join(flags))
-
-    def _get_flags_for_path(self, path):
-        '''For a given path, separated by spaces, return a list of completable paths.
-        Commencing dashes in flags are expected to be replaced with underscores
-        (to fool argparse into not parsing those)'''
-        path = [tok[:2].replace('_', '-') + tok[2:] for tok in path]
-
-        # No path specified
-        if not path or (len(path) == 1 and path[0] in self._special_tokens):
-            flags = self._assistant_names + [a.name for a in self._actions] + \
-                    self._special_tokens + ['--help']
-
-        else:
-            elem = self._get_elem_for_path(path)
-            if elem:
-                flags = self._get_flags(elem, long_only=True) + \
-                        [a.name for a in self._get_descendants(elem)] + \
-                        ['--help']
-
-                #TODO Fix so that it honors nargs
-                # Last argument in flags or there are positional arguments
-                if path[-1] in self._get_flags(elem, dashed_only=True, attributes_only=True) \
-                    or self._get_positional_args(elem):
-                    flags.append('_FILENAMES')
-            else:
-                flags = []
-
-        return sorted(flags)
+        root = self._assistant_names + [a.name for a in self._actions] + \
+            self._special_tokens + ['--help']
+        return {'root': root,
+                'elems': [self._get_index_node(e) for e in self._assistants + self._actions]}
 
-    def _get_elem_for_path(self, path):
-        '''Get element (Assistant or Action) specified by given path'''
-        skipping = False
-        result = None
-        current = self._assistants + self._actions
-        for token in path:
-            found = False if not skipping else True
-
-            if token in self._special_tokens:
-                continue
-
-            # If result has positional arguments or token is a flag, it's safe
-            # to skip until next valid token is found
-            if result and \
-                    (self._get_positional_args(result) \
-                    or token in self._get_flags(result, dashed_only=True)):
-                skipping = True
-                found = True
-                continue
-
-            # Searching descendants
-            for elem in current:
-                try:
-                    aliases = elem.aliases
-                except AttributeError:
-                    aliases = []
-                if token == elem.name or token in aliases:
-                    found = True
-                    skipping = False
-                    current = self._get_descendants(elem)
-                    result = elem
-                    break
-
-            if found or skipping:
-                continue
-            else:
-                break
-
-        return result if found or skipping else None
+    @classmethod
+    def _get_index_node(cls, elem):
+        """Returns completion index node for given element (Assistant or Action), which
+        holds everything completion.complete needs to know about it and its descendants"""
+        return {'name': elem.name,
+                'aliases': list(getattr(elem, 'aliases', [])),
+                'flags': cls._get_flags(elem),
+                'attr_flags': cls._get_flags(elem, dashed_only=True, attributes_only=True),
+                'positional': bool(cls._get_positional_args(elem)),
+                'children': [cls._get_index_node(d) for d in cls._get_descendants(elem)]}
 
     @classmethod
     def _get_descendants(cls, elem):
         '''Get descendants for and Assistant or Action (or anything possessing
         the method get_subactions() or get_subassistants())'''
+        # assistants of roles are only loaded from cache (if possible)
+        try:
+            return elem.get_cli_subassistants()
+        except AttributeError:
+            pass
         try:
             return elem.get_subassistants()
         except AttributeError:
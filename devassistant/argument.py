@@ -1,3 +1,4 @@
+import copy
 import getpass
 import os
 import re
@@ -118,9 +119,10 @@ class Argument(object):
             try:
                 problem = None
                 snippet = yaml_snippet_loader.YamlSnippetLoader.get_snippet_by_name(use_snippet)
-                # this works much like snippet.args.pop(arg_name).update(arg_params),
-                # but unlike it, this actually returns the updated dict
-                params = dict(snippet.args.pop(name), **params)
+                # this works much like snippet.args[arg_name].update(arg_params),
+                # but unlike it, this actually returns the updated dict (snippet args
+                # are frozen, so we need to copy them)
+                params = dict(copy.deepcopy(snippet.args[name]), **params)
                 # if there is SnippetNotFoundException, just let it be raised
             except KeyError:  # snippet doesn't have the requested argument
                 problem = 'Couldn\'t find arg {arg} in snippet {snip}.'.\
@@ -48,6 +48,17 @@ class AssistantBase(object):
                     self._subassistants.append(a())
         return self._subassistants
 
+    def get_cli_subassistants(self):
+        """Return list of subassistants to construct commandline interface from.
+
+        By default, these are the same as get_subassistants returns; override this in
+        subclasses that can provide lighter substitutes that are quicker to load.
+
+        Returns:
+            list of instantiated subassistants (or their substitutes)
+        """
+        return self.get_subassistants()
+
     def get_subassistant_tree(self):
         """Returns a tree-like structure representing the assistant hierarchy going down
         from this assistant to leaf assistants.
@@ -68,6 +79,29 @@ class AssistantBase(object):
             self._tree = (self, subassistant_tree)
         return self._tree
 
+    def get_partial_subassistant_tree(self, names):
+        """Returns a tree-like structure just like get_subassistant_tree, but only subassistants
+        of this assistant and of those subassistants (recursively) that have their name
+        or alias in given names are loaded. Other subassistants are in the tree with None
+        instead of list of their subassistants, e.g. (<Subassistant 2>, None).
+
+        This is used to construct only the part of argument parser that gets actually used,
+        so the subassistants are obtained by get_cli_subassistants.
+
+        Args:
+            names: set of names of assistants to load subassistants for (e.g. set of
+                commandline arguments)
+        Returns:
+            a partial tree-like structure (see above)
+        """
+        subassistant_tree = []
+        for subassistant in self.get_cli_subassistants():
+            if names & set([subassistant.name] + getattr(subassistant, 'aliases', [])):
+                subassistant_tree.append(subassistant.get_partial_subassistant_tree(names))
+            else:
+                subassistant_tree.append((subassistant, None))
+        return (self, subassistant_tree)
+
     def get_selected_subassistant_path(self, **kwargs):
         """Recursively searches self._tree - has format of (Assistant: [list_of_subassistants]) -
         for specific path from first to last selected subassistants.
@@ -79,24 +113,21 @@ class AssistantBase(object):
             list of subassistants objects from tree sorted from first to last
         """
         path = [self]
-        previous_subas_list = None
-        currently_searching = self.get_subassistant_tree()[1]
+        # only subassistants along the path are loaded, not the whole tree
+        currently_searching = self.get_subassistants()
 
         # len(path) - 1 always points to next subassistant_N, so we can use it to control iteration
         while settings.SUBASSISTANT_N_STRING.format(len(path) - 1) in kwargs and \
                 kwargs[settings.SUBASSISTANT_N_STRING.format(len(path) - 1)]:
-            for sa, subas_list in currently_searching:
-                if sa.name == kwargs[settings.SUBASSISTANT_N_STRING.format(len(path) - 1)]:
-                    currently_searching = subas_list
+            name = kwargs[settings.SUBASSISTANT_N_STRING.format(len(path) - 1)]
+            for sa in currently_searching:
+                if sa.name == name:
+                    currently_searching = sa.get_subassistants()
                     path.append(sa)
-                    break  # sorry if you shed a tear ;)
-
-            if subas_list == previous_subas_list:
+                    break
+            else:
                 raise exceptions.AssistantNotFoundException(
-                    'No assistant {n} after path {p}.'.format(
-                        n=kwargs[settings.SUBASSISTANT_N_STRING.format(len(path) - 1)],
-                        p=path))
-            previous_subas_list = subas_list
+                    'No assistant {n} after path {p}.'.format(n=name, p=path))
 
         return path
 
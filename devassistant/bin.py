@@ -15,6 +15,11 @@ class ExecutableAssistant(assistant_base.AssistantBase):
     def get_all_names(self):
         return [self.name] + self.aliases
 
+    def get_cli_subassistants(self):
+        # use CLI schema from cache, so that no assistants are loaded before one is selected
+        sa = yaml_assistant_loader.YamlAssistantLoader.get_cli_schema_assistants(self)
+        return self.get_subassistants() if sa is None else sa
+
 
 class CreatorAssistant(ExecutableAssistant):
     def get_subassistants(self):
@@ -1,5 +1,8 @@
 import os
+import sys
+import tempfile
 
+from six.moves import cPickle as pickle
 import yaml
 try:
     from yaml import CDumper as Dumper
@@ -8,16 +11,108 @@ except ImportError:
 
 import devassistant
 
+from devassistant import completion
+from devassistant.logger import logger
 from devassistant import settings
 from devassistant import yaml_checker
 from devassistant import yaml_loader
 from devassistant import yaml_snippet_loader
 
+# header of binary cache files; if anything in it differs from what is expected, the cache
+#  file is considered invalid - this means that it gets recreated when DevAssistant is upgraded,
+#  the format of cache changes or the cache was created by different Python version (the pickle
+#  protocol and representation of strings differs across Python versions)
+BINARY_CACHE_FORMAT_VERSION = 1
+BINARY_CACHE_HEADER = 'DACACHE {fmt} {py} {da}\n'.format(
+    fmt=BINARY_CACHE_FORMAT_VERSION,
+    py='.'.join(map(str, sys.version_info[:2])),
+    da=devassistant.__version__).encode('ascii')
+BINARY_CACHE_MAGIC = b'DACACHE '
+
+
+def binary_cache_file(cache_file):
+    """Returns path of the binary cache file corresponding to given yaml cache file."""
+    return os.path.splitext(cache_file)[0] + '.bin'
+
+
+def load_cache_file(path):
+    """Loads cache file in either binary or yaml format.
+
+    Args:
+        path: path to the cache file
+    Returns:
+        loaded cache structure; empty dict if the file is a binary cache file with
+        a different header or a broken (e.g. truncated) one (and therefore unusable)
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        if header == BINARY_CACHE_HEADER:
+            try:
+                return pickle.load(f)
+            except Exception as e:  # broken pickle may raise almost anything
+                logger.debug('Ignoring broken cache file {0}: {1!r}'.format(path, e))
+                return {}
+        elif header.startswith(BINARY_CACHE_MAGIC):
+            return {}
+    return yaml_loader.YamlLoader.load_yaml_by_path(path) or {}
+
+
+def dump_cache_file(path, cache, binary=True):
+    """Atomically writes given cache structure into given path (the structure is written to
+    a temporary file in the same directory first, which is then renamed to path). This
+    makes sure that concurrently running DevAssistant processes never see a partially
+    written cache file.
+
+    Args:
+        path: path to write the cache file to
+        cache: cache structure to write
+        binary: if True, the binary format is used, otherwise yaml is used
+    """
+    fd, tmppath = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        if binary:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(BINARY_CACHE_HEADER)
+                pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        else:
+            with os.fdopen(fd, 'w') as f:
+                yaml.dump(cache, f, Dumper=Dumper)
+        # os.rename can't overwrite existing files on Windows, os.replace is Python 3 only
+        getattr(os, 'replace', os.rename)(tmppath, path)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+
+
+def cli_schema(hierarchy):
+    """Returns CLI schema of assistants in given cache hierarchy (see Cache), which contains
+    everything needed to construct commandline interface for them, e.g.:
+
+    {'c': {'description': 'C Language Tool description...',
+           # args as pairs of name and params (as used by Argument.construct_arg)
+           'args': [['foo', {'flags': ['-f', '--foo'], 'help': 'Help for foo parameter.'}]],
+           'subassistants': {'d': {...}}}}
+
+    Args:
+        hierarchy: cache hierarchy of assistants of one role
+    Returns:
+        CLI schema as described above
+    """
+    schema = {}
+    for name, cached_ass in hierarchy.items():
+        attrs = cached_ass['attrs']
+        schema[name] = {'description': attrs.get('description') or '',
+                        'args': [[n, p] for n, p in (attrs.get('args') or {}).items()],
+                        'subassistants': cli_schema(cached_ass['subhierarchy'])}
+    return schema
+
 
 class Cache(object):
     """Representation of DevAssistant cache file.
-    Cache is stored in yaml file between devassistant invocations. Once it is loaded,
-    it has following structure:
+    Cache is stored in binary (pickle with a versioned header, see BINARY_CACHE_HEADER) or yaml
+    files between devassistant invocations, assistants of every role in a separate file.
+    Once it is loaded, it has following structure:
 
     # type of assistants
     {'crt':
@@ -31,10 +126,11 @@ class Cache(object):
                              'help': 'Help for foo parameter.'}},
                  'description': 'C Language Tool description...',
                  'fullname': 'C Language Tool'},
-            # snippets that this assistant depends on with their last seen ctimes
-            'snippets': {'somesnip': 11111111111},
-            # last seen ctime of this assistant
-            'ctime': 111111111111,
+            # snippets that this assistant depends on with their last seen fingerprints
+            #  (see devassistant.yaml_loader.stat_fingerprint)
+            'snippets': {'somesnip': [1400000000123456789, 2048, 123456]},
+            # last seen fingerprint of this assistant
+            'fingerprint': [1400000000123456789, 1024, 123457],
             # source file of this assistant
             'source': '/foo/bar/assistants/crt/c.yaml',
             # hierarchy of subassistants of this assistant
@@ -44,52 +140,162 @@ class Cache(object):
      'extra': {...},
      # version of devassistant that cache has been created with
      'version': devassistant.__version__}
+
+    Segment file of every role also contains CLI schema of its assistants (see cli_schema),
+    so it's always written and invalidated together with the cached assistants.
     """
 
-    def __init__(self, cache_file=settings.CACHE_FILE):
+    # Cache instances shared in one DevAssistant process, see get_instance
+    _instances = {}
+
+    def __init__(self, cache_file=None, cache_format=None):
         """Inits a cache objects with given cache_file. Creates the cache file if
         it doesn't exist. If cache_file exists, but was created with different
         DevAssistant version, it gets deleted.
 
+        The cache file itself only contains the version of DevAssistant, assistants of each
+        role are stored in a separate segment file (see segment_file), which is only loaded
+        when the role is refreshed and only rewritten when an assistant of that role changes.
+
         Args:
-            cache_file: cache file to use
+            cache_file: yaml cache file to use, defaults to settings.CACHE_FILE
+            cache_format: "binary" or "yaml", defaults to settings.CACHE_FORMAT; if "binary"
+                is used, the cache is stored in a file with ".bin" extension next to
+                cache_file and cache_file itself is only read if the binary one doesn't exist
         """
-        self.cache_file = cache_file
-        # snippets are shared across many assistants, so we remember their ctimes
-        # here, because doing it again for each assistant would be very costly
-        self.snip_ctimes = {}
+        yaml_cache_file = cache_file or settings.CACHE_FILE
+        self.binary = (cache_format or settings.CACHE_FORMAT) == 'binary'
+        if self.binary:
+            self.cache_file = binary_cache_file(yaml_cache_file)
+        else:
+            self.cache_file = yaml_cache_file
+        # fingerprints of yaml files found during current refresh, see _get_fingerprint
+        self.fingerprints = {}
+        self._scanned_dirs = set()
+        # assistant files loaded in parallel during current refresh, see refresh_role
+        self._loaded_yamls = {}
+        # CLI schemas of loaded roles, see get_cli_schema
+        self.cli_schemas = {}
         reset_cache = False
         if os.path.exists(self.cache_file):
-            self.cache = yaml_loader.YamlLoader.load_yaml_by_path(cache_file) or {}
+            self.cache = load_cache_file(self.cache_file)
             if self.cache.get('version', '0.0.0') != devassistant.__version__:
                 reset_cache = True
+            elif self._roles_in_cache():
+                # cache with all roles in one file, as written by older DevAssistant
+                self._write_all()
+        elif self.binary and os.path.exists(yaml_cache_file):
+            # convert the yaml cache file created by older DevAssistant or by using yaml format
+            self.cache = load_cache_file(yaml_cache_file)
+            if self.cache.get('version', '0.0.0') != devassistant.__version__:
+                reset_cache = True
+            else:
+                self._write_all()
         else:
-            if not os.path.exists(os.path.dirname(cache_file)):
-                os.makedirs(os.path.dirname(cache_file))
+            if not os.path.exists(os.path.dirname(self.cache_file)):
+                os.makedirs(os.path.dirname(self.cache_file))
             reset_cache = True
 
         # if writing the file raises, YamlAssistantLoader catches the exception
         #  and doesn't use cache at all
         if reset_cache:
-            f = open(cache_file, 'w')
+            # segment files are versioned too, so they don't need to be deleted
             self.cache = {'version': devassistant.__version__}
-            f.close()
+            self._write_all()
+
+    @classmethod
+    def get_instance(cls, cache_file=None, cache_format=None):
+        """Returns Cache instance for given arguments that is shared in this process, so that
+        the cache is only loaded once, no matter how many roles get refreshed. A new instance
+        is created if the cache file has been removed since the instance was created.
+
+        Args:
+            see __init__
+        """
+        key = (cache_file or settings.CACHE_FILE, cache_format or settings.CACHE_FORMAT)
+        cch = cls._instances.get(key)
+        if cch is None or not os.path.exists(cch.cache_file):
+            cch = cls._instances[key] = cls(*key)
+        return cch
+
+    def segment_file(self, role):
+        """Returns path of the segment file that stores assistants of given role."""
+        base, ext = os.path.splitext(self.cache_file)
+        return '{base}.{role}{ext}'.format(base=base, role=role, ext=ext)
+
+    def _roles_in_cache(self):
+        return [k for k in self.cache.keys() if k != 'version']
+
+    def _load_role(self, role):
+        """Loads assistants of given role from the segment file into self.cache.
+
+        Returns:
+            True if the segment file exists and has been written by the same DevAssistant
+            version, False otherwise
+        """
+        segment = {}
+        if os.path.exists(self.segment_file(role)):
+            segment = load_cache_file(self.segment_file(role))
+        valid = segment.get('version', '0.0.0') == devassistant.__version__ and role in segment
+        self.cache[role] = segment[role] if valid else {}
+        if valid and 'cli' in segment:
+            self.cli_schemas[role] = segment['cli']
+        return valid
+
+    def _write_role(self, role):
+        self.cli_schemas[role] = cli_schema(self.cache[role])
+        dump_cache_file(self.segment_file(role),
+                        {'version': self.cache['version'],
+                         role: self.cache[role],
+                         'cli': self.cli_schemas[role]},
+                        binary=self.binary)
+        # assistants of the role changed, completion index must be regenerated
+        completion.remove_index()
+
+    def get_cli_schema(self, role):
+        """Returns CLI schema (see cli_schema) of assistants of given role. The role must
+        have been refreshed first (see refresh_role)."""
+        if role not in self.cli_schemas:
+            # segment file written by DevAssistant that didn't store schemas
+            self._write_role(role)
+        return self.cli_schemas[role]
+
+    def _write_all(self):
+        for role in self._roles_in_cache():
+            self._write_role(role)
+        dump_cache_file(self.cache_file, {'version': self.cache['version']}, binary=self.binary)
 
     def refresh_role(self, role, file_hierarchy):
-        """Checks and refreshes (if needed) all assistants with given role.
+        """Checks and refreshes (if needed) all assistants with given role. Only the segment
+        file of this role is rewritten if there was a change.
 
         Args:
             role: role of assistants to refresh
             file_hierarchy: hierarchy as returned by devassistant.yaml_assistant_loader.\
                             YamlAssistantLoader.get_assistants_file_hierarchy
         """
+        # forget fingerprints from previous refresh, files could've changed since then
+        self.fingerprints = {}
+        self._scanned_dirs = set()
+        was_change = False
         if role not in self.cache:
-            self.cache[role] = {}
-        was_change = self._refresh_hierarchy_recursive(self.cache[role], file_hierarchy)
+            was_change = not self._load_role(role)
+        if was_change and settings.YAML_LOADING_PROCESSES > 1:
+            # cold cache => all assistants will have to be loaded, do it in parallel
+            from devassistant.yaml_assistant_loader import YamlAssistantLoader
+            self._loaded_yamls = yaml_loader.YamlLoader.load_yamls_by_paths(
+                YamlAssistantLoader.get_file_hierarchy_sources(file_hierarchy), log_debug=True)
+        try:
+            was_change |= self._refresh_hierarchy_recursive(self.cache[role], file_hierarchy)
+        except BaseException:
+            # the role may be refreshed only partially, make sure it gets reloaded next time
+            del self.cache[role]
+            self.cli_schemas.pop(role, None)
+            raise
+        finally:
+            self._loaded_yamls = {}
         if was_change:
-            cf = open(self.cache_file, 'w')
-            yaml.dump(self.cache, cf, Dumper=Dumper)
-            cf.close()
+            self._write_role(role)
 
     def _refresh_hierarchy_recursive(self, cached_hierarchy, file_hierarchy):
         """Recursively goes through given corresponding hierarchies from cache and filesystem
@@ -143,10 +349,10 @@ class Cache(object):
 
         Assistant needs refresh iff any of following conditions is True:
         - stored source file is different than given source file
-        - stored assistant ctime is lower than current source file ctime
+        - stored assistant fingerprint is different than current source file fingerprint
         - stored list of subassistants is different than given list of subassistants
-        - stored ctime of any of the snippets that this assistant uses to compose
-          args is lower than current ctime of that snippet
+        - stored fingerprint of any of the snippets that this assistant uses to compose
+          args is different than current fingerprint of that snippet
 
         Args:
             cached_ass: an assistant from cache hierarchy
@@ -156,12 +362,12 @@ class Cache(object):
         """
         if cached_ass['source'] != file_ass['source']:
             return True
-        if os.path.getctime(file_ass['source']) > cached_ass.get('ctime', 0.0):
+        if self._get_fingerprint(file_ass['source']) != cached_ass.get('fingerprint'):
             return True
         if set(cached_ass['subhierarchy'].keys()) != set(set(file_ass['subhierarchy'].keys())):
             return True
-        for snip_name, snip_ctime in cached_ass['snippets'].items():
-            if self._get_snippet_ctime(snip_name) > snip_ctime:
+        for snip_name, snip_fingerprint in cached_ass['snippets'].items():
+            if self._get_snippet_fingerprint(snip_name) != snip_fingerprint:
                 return True
 
         return False
@@ -176,11 +382,15 @@ class Cache(object):
                       (for format see what refresh_role accepts)
         """
         # we need to process assistant in custom way to see unexpanded args, etc.
-        loaded_ass = yaml_loader.YamlLoader.load_yaml_by_path(file_ass['source'], log_debug=True)
+        if file_ass['source'] in self._loaded_yamls:
+            loaded_ass = self._loaded_yamls[file_ass['source']]
+        else:
+            loaded_ass = yaml_loader.YamlLoader.load_yaml_by_path(file_ass['source'],
+                                                                  log_debug=True)
         attrs = loaded_ass
         yaml_checker.check(file_ass['source'], attrs)
         cached_ass['source'] = file_ass['source']
-        cached_ass['ctime'] = os.path.getctime(file_ass['source'])
+        cached_ass['fingerprint'] = self._get_fingerprint(file_ass['source'])
         cached_ass['attrs'] = {}
         cached_ass['snippets'] = {}
         # only cache these attributes if they're actually found in assistant
@@ -198,7 +408,8 @@ class Cache(object):
                 snippet = yaml_snippet_loader.YamlSnippetLoader.get_snippet_by_name(snippet_name)
                 cached_ass['attrs']['args'][argname] = snippet.get_arg_by_name(argname)
                 cached_ass['attrs']['args'][argname].update(argparams)
-                cached_ass['snippets'][snippet.name] = self._get_snippet_ctime(snippet.name)
+                cached_ass['snippets'][snippet.name] = \
+                    self._get_snippet_fingerprint(snippet.name)
             else:
                 cached_ass['attrs']['args'][argname] = argparams
 
@@ -223,19 +434,43 @@ class Cache(object):
 
         return ret_struct
 
-    def _get_snippet_ctime(self, snip_name):
-        """Returns and remembers (during this DevAssistant invocation) last ctime of given
-        snippet.
+    def _scan_dir(self, directory, recursive=False):
+        """Remembers fingerprints of all yaml files in given directory (and its subdirectories
+        if recursive is True) for the rest of current refresh, unless already done."""
+        if directory not in self._scanned_dirs:
+            fingerprints = yaml_loader.YamlLoader.get_yaml_fingerprints(directory,
+                                                                        recursive=recursive)
+            self.fingerprints.update(fingerprints)
+            self._scanned_dirs.add(directory)
+            if recursive:
+                self._scanned_dirs.update(set(map(os.path.dirname, fingerprints)))
+
+    def _get_fingerprint(self, path):
+        """Returns fingerprint (see devassistant.yaml_loader.stat_fingerprint) of given yaml
+        file or None if it doesn't exist.
 
-        Calling ctime costs lost of time and some snippets, like common_args, are used widely,
-        so we don't want to call ctime bazillion times on them during one invocation.
+        Rather than stat-ing each file separately, the whole directory containing the file
+        is scanned once per refresh and fingerprints of all yaml files in it are remembered.
 
         Args:
-            snip_name: name of snippet to get ctime for
-        Returns:
-            ctime of the snippet
+            path: path of the yaml file
+        """
+        self._scan_dir(os.path.dirname(path))
+        return self.fingerprints.get(path)
+
+    def _get_snippet_fingerprint(self, snip_name):
+        """Returns fingerprint of given snippet or None if it doesn't exist.
+
+        The snippet is found the same way YamlSnippetLoader finds it (first snippets dir that
+        contains it wins), but without loading any yaml.
+
+        Args:
+            snip_name: name of snippet to get fingerprint for
         """
-        if snip_name not in self.snip_ctimes:
-            snippet = yaml_snippet_loader.YamlSnippetLoader.get_snippet_by_name(snip_name)
-            self.snip_ctimes[snip_name] = os.path.getctime(snippet.path)
-        return self.snip_ctimes[snip_name]
+        rel_path = snip_name.replace('.', os.path.sep) + '.yaml'
+        for d in yaml_snippet_loader.YamlSnippetLoader.snippets_dirs:
+            self._scan_dir(d, recursive=True)
+            fingerprint = self.fingerprints.get(os.path.join(d, rel_path))
+            if fingerprint is not None:
+                return fingerprint
+        return None
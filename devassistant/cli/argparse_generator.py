@@ -18,6 +18,8 @@ class ArgparseGenerator(object):
         Args:
             tree: assistant tree as returned by
                   devassistant.assistant_base.AssistantBase.get_subassistant_tree
+                  or get_partial_subassistant_tree (assistants without loaded subassistants
+                  only get a parser that lists them among choices)
             actions: dict mapping actions (devassistant.actions.Action subclasses) to their
                      subaction dicts
         Returns:
@@ -71,6 +73,11 @@ class ArgparseGenerator(object):
         p = parser.add_parser(name,
                               description=assistant_tuple[0].description,
                               argument_default=argparse.SUPPRESS)
+        if assistant_tuple[1] is None:
+            # not selected on commandline (see get_partial_subassistant_tree), so this parser
+            #  is never used and there's no need to add arguments or subassistants
+            return
+
         for arg in assistant_tuple[0].args:
             arg.add_argument_to(p)
 
@@ -3,15 +3,10 @@ import os
 import sys
 import six
 
-from devassistant import actions
-from devassistant import bin
-from devassistant.cli import argparse_generator
-from devassistant import exceptions
-from devassistant import logger
-from devassistant import path_runner
+from devassistant import completion
 from devassistant import settings
-from devassistant import sigint_handler
-from devassistant import utils
+# everything else is imported in methods that need it, so that completion answered
+#  from completion index (see CliRunner.run) doesn't have to import it
 
 
 class CliRunner(object):
@@ -20,6 +15,7 @@ class CliRunner(object):
     @classmethod
     def register_console_logging_handler(cls, lgr, level=logging.INFO):
         """Registers console logging handler to given logger."""
+        from devassistant import logger
         console_handler = logger.DevassistantClHandler(sys.stdout)
         if console_handler.stream.isatty():
             console_handler.setFormatter(logger.DevassistantClColorFormatter())
@@ -37,11 +33,24 @@ class CliRunner(object):
     def run(cls):
         """Runs the whole cli:
 
+        0. Answers bash completion from completion index if possible
         1. Registers console logging handler
-        2. Creates argparser from all assistants and actions
+        2. Creates argparser from all actions and assistants (only the assistants named
+           on commandline get their subassistants loaded and arguments added)
         3. Parses args and decides what to run
         4. Runs a proper assistant or action
         """
+        if completion.answer_from_index(sys.argv[1:]):
+            return
+        from devassistant import actions
+        from devassistant import bin
+        from devassistant.cli import argparse_generator
+        from devassistant import exceptions
+        from devassistant import logger
+        from devassistant import path_runner
+        from devassistant import sigint_handler
+        from devassistant import utils
+
         sigint_handler.override()
         # set settings.USE_CACHE before constructing parser, since constructing
         # parser requires loaded assistants
@@ -52,7 +61,7 @@ class CliRunner(object):
             logger.logger.warning("Could not create log file '{0}'.".format(settings.LOG_FILE))
         cls.inform_of_short_bin_name(sys.argv[0])
         top_assistant = bin.TopAssistant()
-        tree = top_assistant.get_subassistant_tree()
+        tree = top_assistant.get_partial_subassistant_tree(set(sys.argv[1:]))
         argparser = argparse_generator.ArgparseGenerator.\
             generate_argument_parser(tree, actions=actions.actions)
         parsed_args = vars(argparser.parse_args())
@@ -85,6 +94,7 @@ class CliRunner(object):
         """Historically, we had "devassistant" binary, but we chose to go with
         shorter "da". We still allow "devassistant", but we recommend using "da".
         """
+        from devassistant import logger
         binary = os.path.splitext(os.path.basename(binary))[0]
         if binary != 'da':
             msg = '"da" is the preffered way of running "{binary}".'.format(binary=binary)
@@ -94,6 +104,7 @@ class CliRunner(object):
 
     @classmethod
     def transform_executable_assistant_alias(cls, parsed_args):
+        from devassistant import bin
         key = settings.SUBASSISTANT_N_STRING.format(0)
         for assistant in [bin.CreatorAssistant, bin.TweakAssistant,
                           bin.PreparerAssistant, bin.ExtrasAssistant]:
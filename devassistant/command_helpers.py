@@ -1,13 +1,19 @@
 from __future__ import print_function
 
 import atexit
+import codecs
+import collections
 import errno
 import getpass
+import itertools
 import logging
 import os
+import select
 import signal
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
 try:
@@ -15,18 +21,99 @@ try:
 except ImportError:
     grp = None
 
+try:
+    import selectors
+except ImportError:  # Python 2
+    selectors = None
+
 import six
 
 from devassistant import exceptions
 from devassistant.logger import logger
+from devassistant import settings
 from devassistant.settings import ROOT_EXECUTABLE
 from devassistant import utils
 
 
+class OutputCapture(object):
+    """Collects output lines of a command. At most max_size characters of the most recent
+    output are held in memory (in a ring buffer of lines); once the output grows bigger,
+    all of it is spooled into a temporary file instead of being held in memory (if spool
+    is True) or the older output is just thrown away (if spool is False)."""
+    def __init__(self, max_size=None, spool=True):
+        self.max_size = max_size
+        self.lines = collections.deque()
+        self.size = 0
+        self.spool = None
+        self.use_spool = spool
+        # True if some output was thrown away (can only happen if spool is False)
+        self.truncated = False
+
+    def add_lines(self, lines):
+        for line in lines:
+            self.lines.append(line)
+            self.size += len(line) + 1
+        # self.size counts a newline after every line, joined lines have one less
+        if self.max_size is None or self.size - 1 <= self.max_size:
+            if self.spool is not None:
+                self._write_to_spool(lines)
+            return
+        if not self.use_spool:
+            pass
+        elif self.spool is None:
+            self.spool = tempfile.TemporaryFile(prefix='da-cl-output-')
+            self._write_to_spool(self.lines)
+        else:
+            self._write_to_spool(lines)
+        while self.size - 1 > self.max_size and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft()) + 1
+            # when spooling, the dropped lines are still in the spool
+            self.truncated = self.truncated or not self.use_spool
+
+    def _write_to_spool(self, lines):
+        self.spool.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def is_spooled(self):
+        return self.spool is not None
+
+    def tail(self):
+        """Returns the output held in memory (that is all of it, if it wasn't spooled
+        or truncated), but at most max_size last characters of it."""
+        tail = '\n'.join(self.lines)
+        if self.max_size is not None and len(tail) > self.max_size:
+            tail = tail[-self.max_size:]
+            self.truncated = self.truncated or not self.use_spool
+        return tail.strip()
+
+    def getvalue(self):
+        """Returns the whole output, reading it from the spool file if needed. Note that
+        this reads the whole spooled output into memory, use tail() for huge output."""
+        if self.spool is None:
+            return self.tail()
+        self.spool.seek(0)
+        return self.spool.read().decode('utf-8').strip()
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
 class ClHelper(object):
     command_processors = {}
     # register all invoked subprocesses
     subprocesses = {}
+    _subprocesses_lock = threading.Lock()
+    # holds command processors of threads that run "parallel" sections
+    _thread_local = threading.local()
+    # commands started by run_command_async that weren't waited for yet,
+    #  in form of {handle: _BackgroundCommand}
+    background_commands = {}
+    _background_lock = threading.Lock()
+    _background_counter = itertools.count(1)
+    _background_reaper_registered = False
+    # size of chunks in which output of commands is read
+    read_chunk_size = 64 * 1024
 
     @classmethod
     def run_command(cls,
@@ -36,7 +123,10 @@ class ClHelper(object):
                     output_callback=None,
                     as_user=None,
                     log_secret=False,
-                    env=None):
+                    env=None,
+                    output_tail_size=None,
+                    started_callback=None,
+                    new_process_group=False):
         """Runs a command from string, e.g. "cp foo bar"
         Args:
             cmd_str: the command to run as string
@@ -49,9 +139,15 @@ class ClHelper(object):
                 "LOGGING PREVENTED FOR SECURITY REASONS", no output will be logged
             env: if not None, pass to subprocess as shell environment; else use
                 original DevAssistant environment
+            output_tail_size: if not None, only this many last characters of output are
+                kept and returned (the whole output is still logged)
+            started_callback: function that gets called with the subprocess.Popen object
+                once the command is started
+            new_process_group: if True, run the command in a new process group, so that
+                it can be killed along with all processes it started
         """
         # run format processors on cmd_str
-        for name, cmd_proc in cls.command_processors.items():
+        for name, cmd_proc in cls.get_command_processors().items():
             cmd_str = cmd_proc(cmd_str)
 
         # TODO: how to do cd with as_user?
@@ -75,6 +171,8 @@ class ClHelper(object):
         stdout_pipe = subprocess.PIPE
         stderr_pipe = subprocess.STDOUT
         preexec_fn = cls.ignore_sigint if ignore_sigint else None
+        if new_process_group:
+            preexec_fn = cls._in_new_process_group(preexec_fn)
         env = os.environ if env is None else env
         proc = subprocess.Popen(cmd_str,
                                 stdin=stdin_pipe,
@@ -84,46 +182,41 @@ class ClHelper(object):
                                 preexec_fn=preexec_fn,
                                 env=env)
         # register process to cls.subprocesses
-        cls.subprocesses[proc.pid] = proc
+        with cls._subprocesses_lock:
+            cls.subprocesses[proc.pid] = proc
+        if started_callback:
+            started_callback(proc)
 
-        stdout = []
-        while proc.poll() is None:
-            try:
-                output = proc.stdout.readline().decode(utils.defenc)
-                if output:
-                    output = output.strip()
-                    stdout.append(output)
-                    cls.log(log_level, output, 'cmd_out', log_secret)
-                if output_callback:
-                    output_callback(output)
-            except IOError as e:
-                if e.errno == errno.EINTR:  # Interrupted system call in Python 2.6
-                    sys.stderr.write('Can\'t interrupt this process!\n')
-                else:
-                    raise e
+        if output_tail_size is None:
+            capture = OutputCapture(settings.CL_OUTPUT_MEMORY_LIMIT)
+        else:
+            capture = OutputCapture(output_tail_size, spool=False)
 
-        # remove process from cls.subprocesses
-        cls.subprocesses.pop(proc.pid)
-
-        # add a newline to the end - if there is more output in output_rest, we'll be appending
-        # it line by line; if there's no more output, we strip anyway
-        stdout = '\n'.join(stdout) + '\n'
-        # there may be some remains not read after exiting the previous loop
-        output_rest = proc.stdout.read().strip().decode(utils.defenc)
-        # we want to log lines separately, not as one big chunk
-        output_rest_lines = output_rest.splitlines()
-        for i, l in enumerate(output_rest_lines):
-            cls.log(log_level, l, 'cmd_out', log_secret)
-            # add newline for every line - for last line, only add it if it was originally present
-            if i != len(output_rest_lines) - 1 or output_rest.endswith('\n'):
-                l += '\n'
-            stdout += l
+        def process_lines(lines):
+            lines = [l.strip() for l in lines]
+            capture.add_lines(lines)
+            for l in lines:
+                cls.log(log_level, l, 'cmd_out', log_secret)
             if output_callback:
-                output_callback(l)
+                for l in lines:
+                    output_callback(l)
+
+        try:
+            cls._pump_output(proc, process_lines)
+            proc.wait()
+            stdout = capture.getvalue() if capture.use_spool else capture.tail()
+            if capture.truncated:
+                cls.log(logging.DEBUG,
+                        'Output truncated to last {0} characters.'.format(output_tail_size),
+                        'cmd_out_truncated', log_secret)
+        finally:
+            capture.close()
+            # remove process from cls.subprocesses
+            with cls._subprocesses_lock:
+                cls.subprocesses.pop(proc.pid, None)
 
         # log return code always on debug level
         cls.log(logging.DEBUG, proc.returncode, 'cmd_retcode', log_secret)
-        stdout = stdout.strip()
 
         if proc.returncode == 0:
             return stdout
@@ -132,6 +225,111 @@ class ClHelper(object):
                                          proc.returncode,
                                          stdout)
 
+    @classmethod
+    def run_command_async(cls, cmd_str, **kwargs):
+        """Starts running a command by run_command (with given keyword arguments) in
+        a background thread and returns a handle (string) to pass to wait_command.
+        Commands that nobody waits for are killed by utils.run_exitfuncs."""
+        bg = _BackgroundCommand(cmd_str, kwargs, dict(cls.get_command_processors()))
+        with cls._background_lock:
+            handle = 'cl_a-{0}'.format(next(cls._background_counter))
+            cls.background_commands[handle] = bg
+            if not cls._background_reaper_registered:
+                utils.atexit(cls.reap_background_commands)
+                cls._background_reaper_registered = True
+        bg.thread.start()
+        return handle
+
+    @classmethod
+    def wait_command(cls, handle):
+        """Waits for command started by run_command_async to finish and returns its output
+        or raises ClException on non-zero return code, just like run_command does."""
+        with cls._background_lock:
+            bg = cls.background_commands.pop(handle, None)
+        if bg is None:
+            raise exceptions.CommandException(
+                'No background command with handle "{0}" to wait for.'.format(handle))
+        bg.thread.join()
+        if bg.exception is not None:
+            raise bg.exception
+        return bg.output
+
+    @classmethod
+    def reap_background_commands(cls):
+        """Kills all commands started by run_command_async that are still running and waits
+        for their threads to finish."""
+        with cls._background_lock:
+            running = list(cls.background_commands.items())
+            cls.background_commands.clear()
+        for handle, bg in running:
+            killed = False
+            while bg.thread.is_alive():
+                if not killed and bg.proc is not None and bg.proc.poll() is None:
+                    logger.info('Killing background command {0} ...'.format(handle))
+                    try:
+                        os.killpg(bg.proc.pid, signal.SIGKILL)
+                    except OSError:  # e.g. command run as another user
+                        pass
+                    killed = True
+                bg.thread.join(0.1)
+            if not killed and bg.exception is not None:
+                logger.debug('Background command {0} failed: {1}'.
+                             format(handle, utils.exc_as_decoded_string(bg.exception)))
+
+    @classmethod
+    def get_command_processors(cls):
+        """Returns command processors to use in current thread. These are the ones set by
+        set_thread_command_processors, if any, else the shared command_processors."""
+        procs = getattr(cls._thread_local, 'command_processors', None)
+        return cls.command_processors if procs is None else procs
+
+    @classmethod
+    def set_thread_command_processors(cls, command_processors):
+        """Sets command processors private to current thread (None to use the shared
+        command_processors again). Sections run in parallel use this to not see command
+        processors pushed and popped by other threads."""
+        cls._thread_local.command_processors = command_processors
+
+    @classmethod
+    def _pump_output(cls, proc, lines_callback):
+        """Reads output of proc until it closes its stdout. The output is read in chunks
+        of up to read_chunk_size bytes (as soon as they're available) and decoded
+        incrementally; lines_callback gets called with list of all lines completed
+        by every chunk."""
+        fd = proc.stdout.fileno()
+        decoder = codecs.getincrementaldecoder(utils.defenc)(errors='replace')
+        if selectors is not None:
+            selector = selectors.DefaultSelector()
+            selector.register(fd, selectors.EVENT_READ)
+            wait = selector.select
+        else:
+            selector = None
+            wait = lambda: select.select([fd], [], [])
+        partial = ''
+        try:
+            while True:
+                try:
+                    wait()
+                    data = os.read(fd, cls.read_chunk_size)
+                except (IOError, OSError, select.error) as e:
+                    if e.args[0] == errno.EINTR:  # Interrupted system call in Python 2
+                        sys.stderr.write('Can\'t interrupt this process!\n')
+                        continue
+                    raise e
+                text = decoder.decode(data, final=not data)
+                if text:
+                    lines = (partial + text).split('\n')
+                    partial = lines.pop()
+                    if lines:
+                        lines_callback(lines)
+                if not data:
+                    break
+            if partial:
+                lines_callback([partial])
+        finally:
+            if selector is not None:
+                selector.close()
+
     @classmethod
     def format_for_another_user(cls, cmd_str, as_user):
         # TODO: implement the best way based on platform/other circumstances
@@ -154,9 +352,19 @@ class ClHelper(object):
     def ignore_sigint(cls):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
 
+    @classmethod
+    def _in_new_process_group(cls, preexec_fn=None):
+        def preexec():
+            os.setpgid(0, 0)
+            if preexec_fn:
+                preexec_fn()
+        return preexec
+
     @classmethod
     def kill_subprocesses(cls):
-        for pid, proc in cls.subprocesses.items():
+        with cls._subprocesses_lock:
+            running = list(cls.subprocesses.items())
+        for pid, proc in running:
             logger.info('Killing still running process {pid} ...'.format(pid=pid))
             proc.kill()
 
@@ -176,6 +384,30 @@ class ClHelper(object):
 atexit.register(ClHelper.kill_subprocesses)
 
 
+class _BackgroundCommand(object):
+    """A command run by ClHelper.run_command in a background thread (see
+    ClHelper.run_command_async). Once the thread finishes, either output or exception
+    is set."""
+    def __init__(self, cmd_str, run_kwargs, command_processors):
+        self.cmd_str = cmd_str
+        self.proc = None
+        self.output = None
+        self.exception = None
+        self.thread = threading.Thread(target=self._run, args=(run_kwargs, command_processors))
+        self.thread.daemon = True
+
+    def _run(self, run_kwargs, command_processors):
+        ClHelper.set_thread_command_processors(command_processors)
+        try:
+            self.output = ClHelper.run_command(self.cmd_str, started_callback=self._started,
+                                               new_process_group=True, **run_kwargs)
+        except (Exception, exceptions.ExecutionException) as e:
+            self.exception = e
+
+    def _started(self, proc):
+        self.proc = proc
+
+
 class PathHelper(object):
     c_cp = 'cp'
     c_mkdir = 'mkdir'
@@ -589,15 +821,12 @@ class GtkDialogHelper(object):
         return inp.get_text() if win.ok else None
 
 class DockerHelper(object):
-
-    try:
-        _docker_module = utils.import_module('docker')
-    except:
-        _docker_module = None
+    # docker-py is optional, it's only imported (and thus probed) when first needed
+    _docker_module = utils.LazyModule('docker')
 
     @classmethod
     def is_available(cls):
-        return cls._docker_module is not None
+        return bool(cls._docker_module)
 
     @property
     def errors(cls):
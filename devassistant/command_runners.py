@@ -11,8 +11,6 @@ import subprocess
 import threading
 import unicodedata
 
-import dapp
-import jinja2
 import six
 import yaml
 
@@ -37,6 +35,12 @@ Lists should be traversed in reversed order, so that dynamically loaded command
 runners can outrun (and hence "override") the default ones.
 """
 command_runners = {}
+# Dispatch table built from command_runners on demand (see get_command_runners):
+#  {(prefix, comm_type): [command runners that may run such command]}
+_dispatch_table = {}
+# command_runners that _dispatch_table was built from (tests replace the whole mapping)
+_dispatch_table_source = None
+_dispatch_table_lock = threading.Lock()
 
 
 def register_command_runner(arg):
@@ -49,11 +53,13 @@ def register_command_runner(arg):
         def inner(command_runner):
             command_runners.setdefault(arg, [])
             command_runners[arg].append(command_runner)
+            _clear_dispatch_table()
             return command_runner
         return inner
     elif issubclass(arg, CommandRunner):
         command_runners.setdefault('', [])
         command_runners[''].append(arg)
+        _clear_dispatch_table()
         return arg
     else:
         msg = 'register_command_runner expects str or CommandRunner as argument, got: {0}'.\
@@ -61,7 +67,38 @@ def register_command_runner(arg):
         raise ValueError(msg)
 
 
+def _clear_dispatch_table():
+    with _dispatch_table_lock:
+        _dispatch_table.clear()
+
+
+def get_command_runners(prefix, comm_type):
+    """Returns list of command runners registered under given prefix that may be able to
+    run command of given type, in the order in which their matches() should be tried.
+
+    Runners are traversed in reversed order of registration, so that dynamically loaded
+    command runners can outrun (and hence "override") the default ones. Runners that
+    declare comm_types/comm_type_prefixes not matching comm_type are left out (see
+    CommandRunner.may_match). The result is cached until a new runner is registered.
+    """
+    global _dispatch_table_source
+    key = (prefix, comm_type)
+    with _dispatch_table_lock:
+        if _dispatch_table_source is not command_runners:
+            _dispatch_table.clear()
+            _dispatch_table_source = command_runners
+        if key not in _dispatch_table:
+            _dispatch_table[key] = [cr for cr in reversed(command_runners.get(prefix, []))
+                                    if cr.may_match(comm_type)]
+        return _dispatch_table[key]
+
+
 class CommandRunner(object):
+    # Command types and prefixes of command types that this runner runs. If a command
+    #  runner declares these, it doesn't have to implement matches(). A command runner that
+    #  only implements matches() is asked about every command.
+    comm_types = []
+    comm_type_prefixes = []
 
     @classmethod
     def matches(cls, c):
@@ -74,7 +111,22 @@ class CommandRunner(object):
         Returns:
             True if this runner can run the command, False otherwise
         """
-        raise NotImplementedError()
+        return c.comm_type in cls.comm_types or \
+            c.comm_type.startswith(tuple(cls.comm_type_prefixes))
+
+    @classmethod
+    def may_match(cls, comm_type):
+        """Returns False if this command runner certainly can't run command of given type,
+        True otherwise (then matches() has to decide)."""
+        for klass in cls.__mro__:
+            attrs = vars(klass)
+            if 'comm_types' in attrs or 'comm_type_prefixes' in attrs:
+                return comm_type in cls.comm_types or \
+                    comm_type.startswith(tuple(cls.comm_type_prefixes))
+            if 'matches' in attrs:
+                # matches() overridden without declaring what it matches
+                return True
+        return True
 
     def __init__(self, c):
         """Initialize with a command c.
@@ -104,9 +156,7 @@ class CommandRunner(object):
 @register_command_runner
 class AtExitCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'atexit'
+    comm_types = ['atexit']
 
     def run(self):
         utils.atexit(lang.run_section, copy.deepcopy(self.c.comm), copy.deepcopy(self.c.kwargs),
@@ -117,9 +167,7 @@ class AtExitCommandRunner(CommandRunner):
 @register_command_runner
 class AskCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('ask_')
+    comm_type_prefixes = ['ask_']
 
     def run(self):
         ui = self.c.kwargs['__ui__']
@@ -141,9 +189,7 @@ class AskCommandRunner(CommandRunner):
 @register_command_runner
 class UseCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'use'
+    comm_types = ['use']
 
     @classmethod
     def is_snippet_call(cls, cmd_call):
@@ -182,25 +228,30 @@ class UseCommandRunner(CommandRunner):
     def _construct_ctxt(self):
         """Construct context from command provided at class instantiation
 
-        If self.c.input_res is string, this just duplicates the whole context
-        (e.g. "use: snippet.run_section"), else else we pass just special
+        If self.c.input_res is string, this creates a context layered on top of the
+        whole current context (e.g. "use: snippet.run_section") - the section sees all
+        variables, but its changes don't propagate back, else we pass just special
         values (__*__) plus the specified values, e.g.:
         - use:
             sect: snippet.run_section
             args:
               foo: $somevar
               spam: $spamspam
+
+        Nothing is deep-copied, only the special values that are modified in place get
+        shallow copies, so the cost doesn't grow with size of the context or nesting depth.
         """
         inp = self.c.input_res
         original_ctxt = self.c.kwargs
 
         if isinstance(inp, dict):
-            new_ctxt = copy.deepcopy(inp['args'])
+            new_ctxt = dict(inp['args'])
             for k, v in original_ctxt.items():
                 if k.startswith('__') and k.endswith('__'):
-                    new_ctxt[k] = copy.deepcopy(v)
+                    new_ctxt[k] = v
+            new_ctxt.update(lang.copy_special_values(original_ctxt))
         else:
-            new_ctxt = copy.deepcopy(original_ctxt)
+            new_ctxt = lang.fork_context(original_ctxt)
 
         return new_ctxt
 
@@ -285,14 +336,13 @@ class UseCommandRunner(CommandRunner):
 @register_command_runner
 class ClCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('cl')
+    comm_type_prefixes = ['cl']
 
     def run(self):
         log_level = logging.DEBUG
         as_user = None
         reraise = True
+        output_tail_size = None
 
         if 'i' in self.c.comm_type:
             log_level = logging.INFO
@@ -303,10 +353,19 @@ class ClCommandRunner(CommandRunner):
             #  but at the same time we need the command output (we could use $(command), but
             #  that doesn't allow logging output at realtime)
             reraise = False
+        if 't' in self.c.comm_type:
+            # the output may be huge, only keep its tail in result (the rest only gets logged)
+            output_tail_size = settings.CL_OUTPUT_TAIL_SIZE
+        if 'a' in self.c.comm_type:
+            # run in background, result is a handle to pass to "wait" command
+            handle = ClHelper.run_command_async(self.c.input_res, log_level=log_level,
+                as_user=as_user, env=self.c.kwargs.get('__env__', None),
+                output_tail_size=output_tail_size)
+            return (True, handle)
 
         try:
             result = ClHelper.run_command(self.c.input_res, log_level, as_user=as_user,
-                env=self.c.kwargs.get('__env__', None))
+                env=self.c.kwargs.get('__env__', None), output_tail_size=output_tail_size)
         except exceptions.ClException as e:
             if reraise:
                 raise
@@ -316,12 +375,39 @@ class ClCommandRunner(CommandRunner):
         return (True, result)
 
 
+@register_command_runner
+class WaitCommandRunner(CommandRunner):
+
+    comm_types = ['wait', 'wait_p']
+
+    def run(self):
+        handles = self.c.input_res
+        one_handle = isinstance(handles, six.string_types)
+        if one_handle:
+            handles = [handles]
+        elif not isinstance(handles, list):
+            msg = 'Wait needs a handle or a list of handles, got {v}.'.format(v=handles)
+            raise exceptions.CommandException(msg)
+
+        # always wait for all the commands, even if some of them failed
+        outputs = []
+        error = None
+        for handle in handles:
+            try:
+                outputs.append(ClHelper.wait_command(handle))
+            except exceptions.ClException as e:
+                outputs.append(e.output)
+                error = error or e
+
+        if error is not None and self.c.comm_type == 'wait':
+            raise error
+        return (error is None, outputs[0] if one_handle else outputs)
+
+
 @register_command_runner
 class DependenciesCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('dependencies')
+    comm_type_prefixes = ['dependencies']
 
     def run(self):
         if not isinstance(self.c.input_res, list):
@@ -338,9 +424,7 @@ class DependenciesCommandRunner(CommandRunner):
 @register_command_runner
 class DotDevassistantCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('dda_')
+    comm_type_prefixes = ['dda_']
 
     def run(self):
         self.check_args(self.c)
@@ -474,6 +558,7 @@ class DotDevassistantCommandRunner(CommandRunner):
 
 @register_command_runner
 class GitHubCommandRunner(CommandRunner):
+    comm_types = ['github']
     _required_yaml_args = {'default': ['login', 'reponame'],
                            'create_repo': ['login', 'reponame', 'private'],
                            'create_and_push': ['login', 'reponame', 'private'],
@@ -481,19 +566,12 @@ class GitHubCommandRunner(CommandRunner):
                            'create_fork': ['login', 'repo_url'],
                            'push': []}
 
-    try:
-        _gh_module = utils.import_module('github')
-    except:
-        _gh_module = None
+    _gh_module = utils.LazyModule('github')
 
     def __init__(self, c):
         self.c = c
         self._user = None
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'github'
-
     def run(self):
         """Arguments given to 'github' command may be:
         - Just a string (action) - only for 'push'
@@ -733,9 +811,7 @@ class GitHubCommandRunner(CommandRunner):
 @register_command_runner
 class LogCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('log_')
+    comm_type_prefixes = ['log_']
 
     def run(self):
         if self.c.comm_type in map(lambda x: 'log_{0}'.format(x), settings.LOG_LEVELS_MAP):
@@ -754,9 +830,7 @@ class LogCommandRunner(CommandRunner):
 @register_command_runner
 class SCLCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('scl ')
+    comm_type_prefixes = ['scl ']
 
     @classmethod
     def _get_scl_command_processor(cls, scl_call):
@@ -780,11 +854,13 @@ class SCLCommandRunner(CommandRunner):
         self.c.kwargs.setdefault('__assistant__', None)
         # a unique name for command processor
         comproc_name = self.c.comm_type
+        # command processors of current thread (sections run in parallel have their own)
+        command_processors = ClHelper.get_command_processors()
         # if such a command processor is already there, don't re-push/re-pop
-        pushpop = comproc_name not in ClHelper.command_processors
+        pushpop = comproc_name not in command_processors
 
         if pushpop:
-            ClHelper.command_processors[comproc_name] =\
+            command_processors[comproc_name] =\
                 self._get_scl_command_processor(self.c.comm_type.split()[1:])
 
         # use "self.c.comm", not "self.c.input_res" - we need unformatted input here
@@ -793,15 +869,13 @@ class SCLCommandRunner(CommandRunner):
                                   runner=self.c.kwargs['__assistant__'])
 
         if pushpop:
-            ClHelper.command_processors.pop(comproc_name)
+            command_processors.pop(comproc_name)
         return retval
 
 
 @register_command_runner
 class Jinja2Runner(CommandRunner):
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type in ['jinja_render', 'jinja_render_dir']
+    comm_types = ['jinja_render', 'jinja_render_dir']
 
     @classmethod
     def _make_output_file_name(cls, outdir, template, output_override=None):
@@ -868,6 +942,8 @@ class Jinja2Runner(CommandRunner):
         return (template, destination, data, overwrite)
 
     def run(self):
+        # jinja2 is only imported when a template is rendered, it's slow to import
+        import jinja2
         # Transform list of dicts (where keys are unique) into a single dict
         args = self.c.input_res
         logger.debug('Jinja2Runner args={0}'.format(repr(args)))
@@ -893,6 +969,7 @@ class Jinja2Runner(CommandRunner):
 
     @classmethod
     def _render_one_template(cls, env, template, result_filename, data, overwrite):
+        import jinja2
         # Get a template instance
         tpl = None
         try:
@@ -949,9 +1026,7 @@ class Jinja2Runner(CommandRunner):
 @register_command_runner
 class AsUserCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('as ')
+    comm_type_prefixes = ['as ']
 
     @classmethod
     def get_user_from_command(cls, comm_type):
@@ -980,15 +1055,12 @@ class AsUserCommandRunner(CommandRunner):
 
 @register_command_runner
 class DockerCommandRunner(CommandRunner):
+    comm_type_prefixes = ['docker_']
 
     def __init__(self, c):
         self.c = c
         self._client = DockerHelper.get_client()
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type.startswith('docker_')
-
     def run(self):
         # this will raise if something is inproperly set
         self._docker_check_setup()
@@ -1265,9 +1337,7 @@ class DockerCommandRunner(CommandRunner):
 @register_command_runner
 class VagrantDockerCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'vagrant_docker'
+    comm_types = ['vagrant_docker']
 
     def run(self):
         prev_env_vdp = self.c.kwargs['__env__'].get('VAGRANT_DEFAULT_PROVIDER', None)
@@ -1315,9 +1385,7 @@ class VagrantDockerCommandRunner(CommandRunner):
 @register_command_runner
 class NormalizeCommandRunner(CommandRunner):
 
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'normalize'
+    comm_types = ['normalize']
 
     @classmethod
     def _get_args(cls, inp):
@@ -1360,9 +1428,7 @@ class NormalizeCommandRunner(CommandRunner):
 
 @register_command_runner
 class SetupProjectDirCommandRunner(CommandRunner):
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'setup_project_dir'
+    comm_types = ['setup_project_dir']
 
     @classmethod
     def _get_args(cls, inp, ctxt):
@@ -1440,9 +1506,7 @@ class SetupProjectDirCommandRunner(CommandRunner):
 
 @register_command_runner
 class PingPongCommandRunner(CommandRunner):
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'pingpong'
+    comm_types = ['pingpong']
 
     def run(self):
         run = self.c.input_res
@@ -1468,6 +1532,7 @@ class PingPongCommandRunner(CommandRunner):
                     logger.debug('Killed.')
                 else:
                     logger.debug('Process terminated OK.')
+        import dapp
         server = dapp.DAPPServer(proc, logger=logger)
         return self._play_pingpong(server, self.c.kwargs)
 
@@ -1478,6 +1543,7 @@ class PingPongCommandRunner(CommandRunner):
         #  are done on the same object and therefore available for subsequent Yaml commands
         # 1) send "run" message
         # 2) recieve first message from the subprocess
+        import dapp
         try:
             server.send_msg_run(ctxt)
             msg = server.recv_msg()
@@ -1524,9 +1590,7 @@ class PingPongCommandRunner(CommandRunner):
 
 @register_command_runner
 class LoadCmdCommandRunner(CommandRunner):
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type == 'load_cmd'
+    comm_types = ['load_cmd']
 
     def _get_args(self):
         load_only = []
@@ -1593,9 +1657,7 @@ class LoadCmdCommandRunner(CommandRunner):
 
 @register_command_runner
 class EnvCommandRunner(CommandRunner):
-    @classmethod
-    def matches(cls, c):
-        return c.comm_type in ['env_set', 'env_unset']
+    comm_types = ['env_set', 'env_unset']
 
     def run(self):
         self.c.kwargs.setdefault('__env__', {})
@@ -0,0 +1,190 @@
+"""Fast answers for bash completion ("da autocomplete").
+
+Bash completion runs "da autocomplete <path>" on every TAB press, so it must not import
+and load the whole DevAssistant. The full autocomplete action (see
+actions.AutoCompleteAction) stores everything needed to answer completions in a
+completion index file; this module only uses the standard library to read that index and
+answer from it, as long as the index is fresh. Nothing heavier than settings may be
+imported here.
+"""
+import json
+import os
+import tempfile
+
+from devassistant import __version__
+from devassistant import settings
+
+# bump this when the structure of the index changes
+INDEX_FORMAT = 2
+
+SPECIAL_TOKENS = ['--debug']
+
+
+def _dir_fingerprint(path):
+    """Returns [mtime_ns, inode] of given directory or None if it doesn't exist. Adding,
+    removing or renaming a file in a directory (which is also how most editors save files)
+    changes its mtime."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [mtime_ns, st.st_ino]
+
+
+def _top_dirs():
+    return [os.path.join(d, subdir) for d in settings.DATA_DIRECTORIES
+            for subdir in ['assistants', 'snippets']]
+
+
+def _data_dir_fingerprints():
+    """Returns dict {path: fingerprint} of "assistants" and "snippets" subdirectories of
+    all data directories and all directories under them. Only used when writing the index,
+    load_index only stats the directories stored in it."""
+    fingerprints = {}
+    for top in _top_dirs():
+        fingerprints[top] = _dir_fingerprint(top)
+        if fingerprints[top] is not None:
+            for dirpath, dirnames, filenames in os.walk(top):
+                fingerprints[dirpath] = _dir_fingerprint(dirpath)
+    return fingerprints
+
+
+def write_index(index):
+    """Stores given completion index (see actions.AutoCompleteAction.get_index) in
+    settings.COMPLETION_INDEX_FILE together with information needed to find out whether
+    it's still fresh. The file is replaced atomically, so that completion running at the same
+    time never reads a partially written index. Failure to write the index is silently
+    ignored."""
+    if not settings.COMPLETION_INDEX_FILE:
+        return
+    index = dict(index, version=__version__, format=INDEX_FORMAT,
+                 dirs=_data_dir_fingerprints())
+    path = settings.COMPLETION_INDEX_FILE
+    try:
+        fd, tmppath = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(path))
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        getattr(os, 'replace', os.rename)(tmppath, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmppath)
+        except OSError:
+            pass
+
+
+def load_index():
+    """Returns completion index stored in settings.COMPLETION_INDEX_FILE or None if it
+    doesn't exist, can't be read or is stale (written by different DevAssistant version
+    or a file was added to or removed from assistant or snippet directories since it was
+    written).
+
+    Only directories are checked, so that completion doesn't have to stat every assistant;
+    changes of existing files are noticed by cache, which removes the index when it rewrites
+    a role (see devassistant.cache.Cache._write_role)."""
+    if not settings.COMPLETION_INDEX_FILE:
+        return None
+    try:
+        with open(settings.COMPLETION_INDEX_FILE) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get('version') != __version__ or \
+            index.get('format') != INDEX_FORMAT or not isinstance(index.get('dirs'), dict):
+        return None
+    if not set(_top_dirs()) <= set(index['dirs']):
+        return None
+    for path, fingerprint in index['dirs'].items():
+        if _dir_fingerprint(path) != fingerprint:
+            return None
+    return index
+
+
+def remove_index():
+    """Removes completion index (if it exists), so that it gets regenerated next time."""
+    if settings.COMPLETION_INDEX_FILE and os.path.exists(settings.COMPLETION_INDEX_FILE):
+        try:
+            os.remove(settings.COMPLETION_INDEX_FILE)
+        except OSError:
+            pass
+
+
+def complete(index, path):
+    """For a given path (list of tokens), return a sorted list of completable strings.
+    Commencing dashes in flags are expected to be replaced with underscores
+    (to fool argparse into not parsing those)."""
+    path = [tok[:2].replace('_', '-') + tok[2:] for tok in path]
+
+    # No path specified
+    if not path or (len(path) == 1 and path[0] in SPECIAL_TOKENS):
+        flags = list(index['root'])
+    else:
+        elem = _get_elem_for_path(index['elems'], path)
+        if elem:
+            flags = [f for f in elem['flags'] if f.startswith('--')] + \
+                    [child['name'] for child in elem['children']] + \
+                    ['--help']
+
+            #TODO Fix so that it honors nargs
+            # Last argument in flags or there are positional arguments
+            if path[-1] in elem['attr_flags'] or elem['positional']:
+                flags.append('_FILENAMES')
+        else:
+            flags = []
+
+    return sorted(flags)
+
+
+def _get_elem_for_path(elems, path):
+    """Get element (index node of Assistant or Action) specified by given path"""
+    skipping = False
+    found = False
+    result = None
+    current = elems
+    for token in path:
+        found = skipping
+
+        if token in SPECIAL_TOKENS:
+            continue
+
+        # If result has positional arguments or token is a flag, it's safe
+        # to skip until next valid token is found
+        if result and (result['positional'] or
+                       token in [f for f in result['flags'] if f.startswith('-')]):
+            skipping = True
+            found = True
+            continue
+
+        # Searching descendants
+        for elem in current:
+            if token == elem['name'] or token in elem['aliases']:
+                found = True
+                skipping = False
+                current = elem['children']
+                result = elem
+                break
+
+        if not (found or skipping):
+            break
+
+    return result if found or skipping else None
+
+
+def answer_from_index(args):
+    """If args (commandline arguments without program name) are a completion request
+    ("autocomplete [path]") and the completion index is fresh, prints the completion and
+    returns True. Returns False otherwise, the request must then be handled by CliRunner
+    (which regenerates the index)."""
+    if len(args) not in [1, 2] or args[0] != 'autocomplete':
+        return False
+    index = load_index()
+    if index is None:
+        return False
+    path = args[1] if len(args) == 2 else ''
+    print(' '.join(complete(index, path.split())))
+    return True
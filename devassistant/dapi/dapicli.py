@@ -1,7 +1,6 @@
 from __future__ import print_function
 
 import errno
-import requests
 import yaml
 import os
 import glob
@@ -62,6 +61,8 @@ def _process_req(req):
 
 def _get_from_dapi_or_mirror(link):
     '''Tries to get the link form DAPI or the mirror'''
+    # requests are slow to import and not needed unless we talk to DAPI
+    import requests
     exception = False
     try:
         req = requests.get(_api_url() + link, timeout=5)
@@ -604,7 +605,7 @@ def _is_supported_here(dap_api_data):
     if not supported:
         # assume all platforms are supported
         return True
-    return utils.get_distro_name() in supported
+    return utils.get_system_facts().distro_name in supported
 
 
 def _get_dependencies_of(name, location=None):
@@ -684,5 +685,6 @@ def install_dap(name, version='', update=False, update_allpaths=False, first=Tru
 
 def get_dependency_metadata():
     '''Returns list of strings with dependency metadata from Dapi'''
+    import requests
     link = os.path.join(_api_url(), 'meta.txt')
     return _process_req_txt(requests.get(link)).split('\n')
@@ -1,21 +1,111 @@
 """This module contains functions that execute assistants' dependencies and run
 sections. These functions usually assume that their input has been previously
 checked by `devassistant.yaml_checker.check`."""
+import collections
+import copy
 import os
 import re
 import shlex
 import string
 import sys
+import threading
+from multiprocessing.pool import ThreadPool
 
 import six
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
 
 from devassistant import exceptions
+from devassistant.command_helpers import ClHelper
 from devassistant.logger import logger
 from devassistant import package_managers
 from devassistant import settings
 from devassistant import utils
 
 
+class ChainedContext(MutableMapping):
+    """A context (mapping of variable names to values) layered on top of another context.
+
+    Reads fall through to the parent context, writes and deletions are recorded locally,
+    so creating a child context is O(1) regardless of the size of the parent and the parent
+    never sees any changes done in the child. Note that values themselves are shared with the
+    parent, so a child must get its own copies of values that get modified in place
+    (see fork_context).
+
+    copy.deepcopy() of a ChainedContext returns a plain dict with all visible variables.
+    """
+    def __init__(self, parent, local=None):
+        self.parent = parent
+        self.local = local or {}
+        # names of parent variables deleted in this context
+        self.deleted = set()
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        if key in self.deleted:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.local.pop(key, None)
+        if key in self.parent:
+            self.deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+        return key not in self.deleted and key in self.parent
+
+    def __iter__(self):
+        for key in self.local:
+            yield key
+        for key in self.parent:
+            if key not in self.local and key not in self.deleted:
+                yield key
+
+    def __len__(self):
+        return sum(1 for k in self)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, dict(self.items()))
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self.items()), memo)
+
+
+# special values that are modified in place when running sections, so every forked
+#  context must get its own copy of them, in form of {name: function making the copy}
+_ctxt_copied_values = {'__env__': dict,
+                       '__files__': list,
+                       '__files_dir__': list,
+                       '__sourcefiles__': list}
+
+
+def copy_special_values(kwargs):
+    """Returns dict with shallow copies of those special values (__*__) from given
+    context that get modified in place when running sections."""
+    copied = {}
+    for k, copy_type in _ctxt_copied_values.items():
+        if k in kwargs:
+            copied[k] = copy_type(kwargs[k])
+    return copied
+
+
+def fork_context(kwargs):
+    """Returns a new context that sees all variables from given context, but whose changes
+    don't propagate back to it."""
+    return ChainedContext(kwargs, copy_special_values(kwargs))
+
+
 class Command(object):
     """A class that represents a Yaml command. It has these members:
 
@@ -51,13 +141,12 @@ class Command(object):
         self.kwargs = kwargs
 
     def run(self):
-        for crs_prefix, crs in type(self).load_command_runners().command_runners.items():
-            if self.prefix == crs_prefix:
-                # traverse in reversed order, so that dynamically loaded user command runners
-                #  can outrun (=> override) the builtin ones
-                for cr in reversed(crs):
-                    if cr.matches(self):
-                        return cr(self).run()
+        # command runners come in reversed order, so that dynamically loaded user command
+        #  runners can outrun (=> override) the builtin ones
+        crs = type(self).load_command_runners().get_command_runners(self.prefix, self.comm_type)
+        for cr in crs:
+            if cr.matches(self):
+                return cr(self).run()
 
         prefix_with_colon = self.prefix + '.' if self.prefix else self.prefix
         raise exceptions.CommandException(
@@ -198,6 +287,8 @@ def eval_exec_section(section, kwargs, runner=None):
                     kwargs[was_exc_var] = True
                     kwargs[exc_var] = utils.exc_as_decoded_string(ex)
                 retval = kwargs[was_exc_var], kwargs[exc_var]
+            elif comm_type == 'parallel':
+                retval = run_parallel_section(comm, kwargs, runner=runner)
             else:
                 retval = Command(comm_type, comm, kwargs=kwargs).run()
 
@@ -359,6 +450,120 @@ def get_catch_vars(catch):
     return get_var_name(res.group(1)), get_var_name(res.group(2))
 
 
+def get_parallel_args(parallel, kwargs):
+    """Returns 4-tuple with arguments of "parallel" command - list of sections to run,
+    maximum number of sections to run at the same time, list of names of result variables
+    and whether to collect errors of all sections instead of failing on the first one.
+
+    Args:
+        parallel: input of "parallel" command - either a list of sections or a mapping
+            with "sections" and optionally "max_workers", "results" and "collect_errors"
+        kwargs: context to evaluate "max_workers" in
+
+    Returns:
+        4-tuple as described above
+
+    Raises:
+        exceptions.YamlSyntaxError if the input is malformed
+    """
+    if isinstance(parallel, list):
+        parallel = {'sections': parallel}
+    if not isinstance(parallel, dict) or not isinstance(parallel.get('sections'), list):
+        err = '"parallel" needs a list of sections or a mapping with "sections", got "{0}"'.\
+            format(parallel)
+        raise exceptions.YamlSyntaxError(err)
+
+    max_workers = parallel.get('max_workers', settings.PARALLEL_MAX_WORKERS)
+    max_workers = eval_literal_section(max_workers, kwargs)[1]
+    try:
+        max_workers = int(max_workers)
+    except (TypeError, ValueError):
+        max_workers = 0
+    if max_workers < 1:
+        err = '"max_workers" of "parallel" must be a positive number, got "{0}"'.\
+            format(parallel['max_workers'])
+        raise exceptions.YamlSyntaxError(err)
+
+    results = [get_var_name(r) for r in parallel.get('results', [])]
+    return parallel['sections'], max_workers, results, bool(parallel.get('collect_errors'))
+
+
+class _ParallelSectionRunner(object):
+    """Wraps runner of "parallel" command for sections run by it, so that they stop
+    (before running their next command) when the runner stops or when another
+    section fails."""
+    def __init__(self, runner, failed):
+        self._runner = runner
+        self._failed = failed
+
+    @property
+    def stop_flag(self):
+        return self._failed.is_set() or getattr(self._runner, 'stop_flag', False)
+
+    def __getattr__(self, name):
+        return getattr(self._runner, name)
+
+
+def run_parallel_section(parallel, kwargs, runner=None):
+    """Runs sections given to "parallel" command concurrently in a pool of threads.
+
+    Every section runs in its own forked context (see fork_context), so variables set by
+    one section are visible neither to other sections nor to the caller - except for
+    the declared result variables, which are copied to kwargs (in order of sections, so if
+    more sections set the same variable, the last one wins). Each thread also gets its own
+    copy of current command processors.
+
+    By default, the first failure stops sections that haven't started yet and is reraised
+    once the running sections finish; with "collect_errors", all sections are run and
+    a RunException describing all failures is raised.
+
+    Returns:
+        2-tuple - logical and of logical results of all sections and list of their results
+    """
+    sections, max_workers, results, collect_errors = get_parallel_args(parallel, kwargs)
+    failed = threading.Event()
+    section_runner = _ParallelSectionRunner(runner, failed)
+    command_processors = ClHelper.get_command_processors()
+    ctxts = [fork_context(kwargs) for s in sections]
+
+    def run_one(i):
+        # None means the section was skipped because another one failed
+        if section_runner.stop_flag:
+            return None
+        ClHelper.set_thread_command_processors(dict(command_processors))
+        try:
+            return run_section(sections[i], ctxts[i], runner=section_runner), None
+        except (Exception, exceptions.ExecutionException) as e:
+            if not collect_errors:
+                failed.set()
+            return None, e
+        finally:
+            ClHelper.set_thread_command_processors(None)
+
+    pool = ThreadPool(min(max_workers, len(sections)) or 1)
+    try:
+        outcomes = pool.map(run_one, range(len(sections)))
+    finally:
+        pool.close()
+
+    for var in results:
+        for ctxt in ctxts:
+            if var in ctxt.local:
+                kwargs[var] = ctxt.local[var]
+
+    errors = [(i, o[1]) for i, o in enumerate(outcomes) if o is not None and o[1] is not None]
+    if errors:
+        if not collect_errors:
+            raise errors[0][1]
+        msg = ['{0} of {1} parallel sections failed:'.format(len(errors), len(sections))]
+        for i, e in errors:
+            msg.append('section {0}: {1}'.format(i + 1, utils.exc_as_decoded_string(e)))
+        raise exceptions.RunException('\n'.join(msg))
+
+    retvals = [o[0] for o in outcomes if o is not None]
+    return all(r[0] for r in retvals), [r[1] for r in retvals]
+
+
 def assign_variable(variable, log_res, res, kwargs):
     """Assigns given result (resp. logical result and result) to a variable
     (resp. to two variables). log_res and res are already computed result
@@ -412,6 +617,33 @@ def get_var_name(dollar_variable):
     return matched.group(1)
 
 
+# Matches "$" followed by the longest run of characters that can form a variable name;
+#  the name that actually gets substituted is the longest prefix of it found in names
+_names_matcher = re.compile(r'\$([^\s$]+)')
+
+
+def substitute_names(string, names):
+    """Substitutes all occurrences of known "$name"s in string for their values in one pass.
+    If more names match at one place, the longest one wins, e.g. "$foobar" is substituted by
+    value of "foobar" if it is in names, else by value of "fooba", ..., else by value of "f".
+
+    Only names that actually appear in string are looked up, so the cost doesn't grow
+    with the number of names.
+    """
+    def substitute(matchobj):
+        candidate = matchobj.group(1)
+        for end in range(len(candidate), 0, -1):
+            name = candidate[:end]
+            if name in names:
+                val = names[name]
+                if not six.PY3 and isinstance(val, str):
+                    val = val.decode(utils.defenc)
+                return six.text_type(val) + candidate[end:]
+        return matchobj.group(0)
+
+    return _names_matcher.sub(substitute, string)
+
+
 # Expression evaluation
 class Interpreter(object):
     """
@@ -420,16 +652,31 @@ class Interpreter(object):
     * mauke.hopto.org/stuff/papers/p41-pratt.pdf
     * http://javascript.crockford.com/tdop/tdop.html
     * http://effbot.org/zone/simple-top-down-parsing.htm
+
+    The grammar is defined only once per process (see the bottom of this module) and
+    every distinct expression is tokenized and parsed only once - the resulting syntax
+    tree is stored in parsed_expressions and then evaluated against given names
+    every time the expression is evaluated.
     """
 
+    # A dictionary of symbols in the form of
+    # {name of the symbol: its class}
+    # This is shared by all instances, since the grammar never changes
+    symbol_table = {}
+
+    # A dictionary of already parsed expressions in the form of
+    # {expression: syntax tree}
+    parsed_expressions = {}
+    # Number of lookups in parsed_expressions that did/didn't find a syntax tree
+    cache_hits = 0
+    cache_misses = 0
+    # guards the three above, expressions are evaluated by threads of "parallel" sections
+    _cache_lock = threading.Lock()
+
     def __init__(self, names):
         # A dictionary of variables in the form of {name: value, ...}
         self.names = names
 
-        # A dictionary of symbols in the form of
-        # {name of the symbol: its class}
-        self.symbol_table = {}
-
         # Holds the current token
         self.token = None
 
@@ -442,13 +689,17 @@ class Interpreter(object):
         value = None
         first = second = None
 
-        def nud(self):
+        def nud(self, interpr):
             raise SyntaxError("Syntax error ({0}).".format(self.id))
 
-        def led(self, left):
+        def led(self, interpr, left):
             raise SyntaxError("Unknown operator ({0}).".format(self.id))
 
-    def symbol(self, id, bp=0):
+        def evaluate(self, interpr):
+            raise SyntaxError("Syntax error ({0}).".format(self.id))
+
+    @classmethod
+    def symbol(cls, id, bp=0):
         """
         Adds symbol 'id' to symbol_table if it does not exist already,
         if it does it merely updates its binding power and returns it's
@@ -456,37 +707,54 @@ class Interpreter(object):
         """
 
         try:
-            s = self.symbol_table[id]
+            s = cls.symbol_table[id]
         except KeyError:
-            class s(self.symbol_base):
+            class s(cls.symbol_base):
                 pass
             s.id = id
             s.lbp = bp
-            self.symbol_table[id] = s
+            cls.symbol_table[id] = s
         else:
             s.lbp = max(bp, s.lbp)
         return s
 
-    def advance(self, id=None):
-        """
-        Advance to next token, optionally check that current token is 'id'
-        """
-
-        if id and self.token.id != id:
-            raise SyntaxError("Expected {0}".format(id))
-        self.token = self.next()
-
-    def method(self, symbol_name):
+    @classmethod
+    def method(cls, symbol_name):
         """
         A decorator - adds the decorated method to symbol 'symbol_name'
         """
 
-        s = self.symbol(symbol_name)
+        s = cls.symbol(symbol_name)
 
         def bind(fn):
             setattr(s, fn.__name__, fn)
         return bind
 
+    @classmethod
+    def cache_info(cls):
+        """Returns statistics of the parsed expressions cache as a dict with keys
+        "hits", "misses" and "size"."""
+        with cls._cache_lock:
+            return {'hits': cls.cache_hits,
+                    'misses': cls.cache_misses,
+                    'size': len(cls.parsed_expressions)}
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._cache_lock:
+            cls.parsed_expressions.clear()
+            cls.cache_hits = 0
+            cls.cache_misses = 0
+
+    def advance(self, id=None):
+        """
+        Advance to next token, optionally check that current token is 'id'
+        """
+
+        if id and self.token.id != id:
+            raise SyntaxError("Expected {0}".format(id))
+        self.token = self.next()
+
     def tokenize(self, program):
         self.in_shell = False
         lexer = shlex.shlex(program)
@@ -524,19 +792,17 @@ class Interpreter(object):
     def expression(self, rbp=0):
         t = self.token
         self.token = self.next()
-        left = t.nud()
+        left = t.nud(self)
         while rbp < self.token.lbp:
             t = self.token
             self.token = self.next()
-            left = t.led(left)
+            left = t.led(self, left)
         return left
 
     def parse(self, expression):
         """
-        Evaluates 'expression' and returns it's value(s)
+        Parses 'expression' and returns its syntax tree
         """
-        if isinstance(expression, (list, dict)):
-            return (True if expression else False, expression)
         if sys.version_info[0] > 2:
             self.next = self.tokenize(expression).__next__
         else:
@@ -544,49 +810,81 @@ class Interpreter(object):
         self.token = self.next()
         return self.expression()
 
+    def compile(self, expression):
+        """
+        Returns syntax tree of 'expression', parsing it only if it hasn't been parsed yet
+        """
+        cls = type(self)
+        with cls._cache_lock:
+            tree = cls.parsed_expressions.get(expression)
+            if tree is None:
+                cls.cache_misses += 1
+            else:
+                cls.cache_hits += 1
+        if tree is None:
+            # parse outside of the lock; if more threads parse the same expression at once,
+            #  they just store equal trees
+            tree = self.parse(expression)
+            with cls._cache_lock:
+                cls.parsed_expressions[expression] = tree
+        return tree
+
+    def evaluate(self, expression):
+        """
+        Evaluates 'expression' and returns it's value(s)
+        """
+        if isinstance(expression, (list, dict)):
+            return (True if expression else False, expression)
+        return self.compile(expression).evaluate(self)
 
-def evaluate_expression(expression, names):
-    interpr = Interpreter(names)
 
+def _define_grammar(interpr_cls):
+    """Defines grammar of the DSL on given Interpreter class. This is called only once,
+    when this module gets imported."""
     # Language definition
     # First, add all the symbols, along with their binding power
-    interpr.symbol("and", 10)
-    interpr.symbol("or", 10)
-    interpr.symbol("not", 10)
-    interpr.symbol("in", 10)
-    interpr.symbol("defined", 10)
-    interpr.symbol("$", 10)
-    interpr.symbol("as_root", 10)
-    interpr.symbol("(name)")
-    interpr.symbol("(literal)")
-    interpr.symbol("(end)")
-    interpr.symbol("(")
-    interpr.symbol(")")
+    interpr_cls.symbol("and", 10)
+    interpr_cls.symbol("or", 10)
+    interpr_cls.symbol("not", 10)
+    interpr_cls.symbol("in", 10)
+    interpr_cls.symbol("defined", 10)
+    interpr_cls.symbol("$", 10)
+    interpr_cls.symbol("as_root", 10)
+    interpr_cls.symbol("(name)")
+    interpr_cls.symbol("(literal)")
+    interpr_cls.symbol("(end)")
+    interpr_cls.symbol("(")
+    interpr_cls.symbol(")")
 
     # Specify the behaviour of each symbol
     # * nud stands for "null denotation" and is used when a token appears
     # at the beginning of a language construct (prefix)
     # * led stand for "left denotation" and is used when it appears inside
     # the construct (infix)
-    @interpr.method("(name)")
-    def nud(self):
+    # Both nud and led only build the syntax tree, the actual values are computed
+    # by evaluate, which gets called with interpreter holding the current names
+    @interpr_cls.method("(name)")
+    def nud(self, interpr):
+        return self
+
+    @interpr_cls.method("(name)")
+    def evaluate(self, interpr):
         if self.value in interpr.names:
             value = interpr.names[self.value]
             return bool(value), "" if isinstance(value, bool) else value
         else:
             return False, ""
 
-    @interpr.method("(literal)")
-    def nud(self):
+    @interpr_cls.method("(literal)")
+    def nud(self, interpr):
+        return self
+
+    @interpr_cls.method("(literal)")
+    def evaluate(self, interpr):
         # If there is a known variable in the literal, substitute it for its
         # value
-        for v in reversed(sorted(interpr.names.keys())):
-            val = interpr.names[v]
-            if not six.PY3 and isinstance(val, str):
-                val = val.decode(utils.defenc)
-            self.value = self.value.replace("$" + v, six.text_type(val))
-        # if self.value is in double/single quotes, strip them (but only the outer quotes)
-        ret = self.value
+        ret = substitute_names(self.value, interpr.names)
+        # if ret is in double/single quotes, strip them (but only the outer quotes)
         if ret.startswith('"'):
             ret = ret.strip('"')
         elif ret.startswith("'"):
@@ -594,54 +892,83 @@ def evaluate_expression(expression, names):
 
         return bool(ret), ret
 
-    @interpr.method("and")
-    def led(self, left):
-        right = interpr.expression(10)
+    @interpr_cls.method("and")
+    def led(self, interpr, left):
+        self.first = left
+        self.second = interpr.expression(10)
+        return self
+
+    @interpr_cls.method("and")
+    def evaluate(self, interpr):
+        left = self.first.evaluate(interpr)
+        right = self.second.evaluate(interpr)
 
         success = bool(left[0] and right[0])
         output = left[1] and right[1]
 
         return success, output
 
-    @interpr.method("or")
-    def led(self, left):
-        right = interpr.expression(10)
+    @interpr_cls.method("or")
+    def led(self, interpr, left):
+        self.first = left
+        self.second = interpr.expression(10)
+        return self
+
+    @interpr_cls.method("or")
+    def evaluate(self, interpr):
+        left = self.first.evaluate(interpr)
+        right = self.second.evaluate(interpr)
 
         success = bool(left[0] or right[0])
         output = left[1] or right[1]
 
         return success, output
 
-    @interpr.method("not")
-    def nud(self):
-        right = interpr.expression(10)
+    @interpr_cls.method("not")
+    def nud(self, interpr):
+        self.first = interpr.expression(10)
+        return self
+
+    @interpr_cls.method("not")
+    def evaluate(self, interpr):
+        right = self.first.evaluate(interpr)
 
         success = bool(not right[0])
         output = right[1]
 
         return success, output
 
-    @interpr.method("in")
-    def led(self, left):
-        success = left[1] in interpr.expression(10)[1]
+    @interpr_cls.method("in")
+    def led(self, interpr, left):
+        self.first = left
+        self.second = interpr.expression(10)
+        return self
+
+    @interpr_cls.method("in")
+    def evaluate(self, interpr):
+        left = self.first.evaluate(interpr)
+        success = left[1] in self.second.evaluate(interpr)[1]
         output = left[1]
 
         return success, output
 
-    @interpr.method("defined")
-    def nud(self):
+    @interpr_cls.method("defined")
+    def nud(self, interpr):
         if interpr.token.id != "(name)":
             raise SyntaxError("Expected a name")
-        name = interpr.token.value
+        self.value = interpr.token.value
         interpr.advance()
+        return self
 
-        success = name in interpr.names
-        output = interpr.names[name] if success else ""
+    @interpr_cls.method("defined")
+    def evaluate(self, interpr):
+        success = self.value in interpr.names
+        output = interpr.names[self.value] if success else ""
 
         return success, output
 
-    @interpr.method("$")
-    def nud(self):
+    @interpr_cls.method("$")
+    def nud(self, interpr):
         interpr.in_shell = True
         interpr.advance("(")
 
@@ -652,7 +979,7 @@ def evaluate_expression(expression, names):
                 if interpr.token.id == ")":
                     break
                 # if there is (name), tokenizer has already stripped
-                # the "$", but we need to keep it for below substitution
+                # the "$", but we need to keep it for substitution on evaluation
                 if interpr.token.id == "(name)":
                     interpr.token.value = "$" + interpr.token.value
                 cmd.append(interpr.token.value)
@@ -663,25 +990,36 @@ def evaluate_expression(expression, names):
         if (cmd.startswith('"') and cmd.endswith('"')) or \
                 (cmd.startswith("'") and cmd.endswith("'")):
             cmd = cmd[1:-1]
+        self.value = cmd
+
+        interpr.advance(")")
+        interpr.in_shell = False
+
+        return self
 
+    @interpr_cls.method("$")
+    def evaluate(self, interpr):
         success = True
         exec_mode = 'cl_r' if interpr.as_root else 'cl'
         try:
-            output = Command(exec_mode, cmd, interpr.names).run()[1]
+            output = Command(exec_mode, self.value, interpr.names).run()[1]
         except exceptions.RunException as ex:
             success = False
             output = ex.output
 
-        interpr.advance(")")
-        interpr.in_shell = False
         interpr.as_root = False
 
         return success, output
 
-    @interpr.method("as_root")
-    def nud(self):
+    @interpr_cls.method("as_root")
+    def nud(self, interpr):
+        self.first = interpr.expression(10)
+        return self
+
+    @interpr_cls.method("as_root")
+    def evaluate(self, interpr):
         interpr.as_root = True
-        right = interpr.expression(10)
+        right = self.first.evaluate(interpr)
         interpr.as_root = False
 
         success = bool(right[0])
@@ -689,8 +1027,8 @@ def evaluate_expression(expression, names):
 
         return success, output
 
-    @interpr.method("(")
-    def nud(self):
+    @interpr_cls.method("(")
+    def nud(self, interpr):
         self.first = []
         if interpr.token.id != ")":
             while 1:
@@ -699,10 +1037,20 @@ def evaluate_expression(expression, names):
                 self.first.append(interpr.expression())
         interpr.advance(")")
 
-        return bool(self.first[0][0]), self.first[0][1]
+        return self
+
+    @interpr_cls.method("(")
+    def evaluate(self, interpr):
+        values = [expr.evaluate(interpr) for expr in self.first]
 
-    # With the language defined, evaluate the expression
-    return interpr.parse(expression)
+        return bool(values[0][0]), values[0][1]
+
+
+_define_grammar(Interpreter)
+
+
+def evaluate_expression(expression, names):
+    return Interpreter(names).evaluate(expression)
 
 
 # spliting strings by _command_splitter.findall(str) preserves whitespace
@@ -721,21 +1069,46 @@ def _homedir_expand(matchobj):
         return matchobj.group(0)[:-1] + os.path.expanduser('~')
 
 
-def format_str(s, kwargs):
-    files_dir = kwargs.get('__files_dir__', [''])[-1]
-    files = kwargs.get('__files__', [{}])[-1]
-    # If command is false/true in yaml file, it gets converted to False/True
-    # which is bool object => convert
-    if isinstance(s, bool):
-        comm = str(s).lower()
-    else:
-        comm = s
+# placeholder for home directory in compiled strings, it's substituted on every use, so that
+#  changes of $HOME in the course of running an assistant are honoured
+_homedir = object()
 
-    new_comm = []
-    parts_list = _command_splitter.findall(comm)
 
+class _CompiledStr(object):
+    """A string preprocessed by _compile_str for repeated formatting by format_str.
+
+    self.segments is a list of (raw, name, expanded) triples - for static parts of the string,
+    name is None and expanded is a list of strings and _homedir placeholders; for "$name" and
+    "${name}" parts, name is the variable name and expanded is None. self.files references
+    the files mapping the string was compiled with, which keeps the mapping alive and thus makes
+    it safe to use its id() as part of the cache key.
+    """
+    __slots__ = ['files', 'segments']
+
+    def __init__(self, files, segments):
+        self.files = files
+        self.segments = segments
+
+
+def _split_homedirs(text):
+    expanded = []
+    pos = 0
+    for match in _homedir_matcher.finditer(text):
+        expanded.append(text[pos:match.start()])
+        tildes = match.group(0)
+        if len(tildes) % 2 == 0:
+            expanded.append(tildes[:-2] + '~')
+        else:
+            expanded.extend([tildes[:-1], _homedir])
+        pos = match.end()
+    expanded.append(text[pos:])
+    return expanded
+
+
+def _compile_str(comm, files_dir, files):
+    new_comm = []
     # replace parts that match something from _files
-    for c in parts_list:
+    for c in _command_splitter.findall(comm):
         if c.startswith('*'):
             c_file = c[1:].strip('{}')
             if c_file in files:
@@ -744,10 +1117,105 @@ def format_str(s, kwargs):
                 new_comm.append(c)
         else:
             new_comm.append(c)
-
     new_comm = ''.join(new_comm)
 
-    # substitute cli arguments for their values
-    substituted = string.Template(new_comm).safe_substitute(kwargs)
+    # split the command to static parts and variables the same way string.Template does
+    segments = []
+    pos = 0
+    for match in string.Template.pattern.finditer(new_comm):
+        if match.start() > pos:
+            static = new_comm[pos:match.start()]
+            segments.append((static, None, _split_homedirs(static)))
+        name = match.group('named') or match.group('braced')
+        if name is not None:
+            segments.append((match.group(0), name, None))
+        else:
+            # "$$" or a "$" not followed by a name
+            static = '$' if match.group('escaped') is not None else match.group(0)
+            segments.append((static, None, _split_homedirs(static)))
+        pos = match.end()
+    if pos < len(new_comm):
+        static = new_comm[pos:]
+        segments.append((static, None, _split_homedirs(static)))
+
+    return _CompiledStr(files, segments)
+
+
+# cache of compiled strings in the form of
+# {(string, files_dir, id of files mapping): _CompiledStr}; when it's full, the oldest
+# entries are evicted (collections.OrderedDict isn't available on Python 2.6, so keys are
+# kept in order of insertion in _compiled_strs_order)
+_compiled_strs = {}
+_compiled_strs_order = collections.deque()
+_compiled_strs_maxsize = 2048
+_compiled_strs_lock = threading.Lock()
+# used when kwargs don't contain '__files__', so that the cache key stays the same
+_no_files = {}
+
+
+def _get_compiled_str(comm, files_dir, files):
+    if '*' in comm:
+        key = (comm, files_dir, id(files))
+    else:
+        # files are irrelevant for strings that can't reference them
+        key = (comm, None, None)
+        files = None
+    with _compiled_strs_lock:
+        compiled = _compiled_strs.get(key)
+        if compiled is None or compiled.files is not files:
+            if compiled is None:
+                while len(_compiled_strs) >= _compiled_strs_maxsize:
+                    del _compiled_strs[_compiled_strs_order.popleft()]
+                _compiled_strs_order.append(key)
+            compiled = _compiled_strs[key] = _compile_str(comm, files_dir, files)
+    return compiled
+
+
+def format_str(s, kwargs):
+    """Substitutes "*file" references to files from kwargs['__files__'], "$name"s and
+    "${name}"s from kwargs and expands "~" in s. Every distinct s is preprocessed only once
+    (see _compile_str), so repeated formatting of the same string is cheap.
+    """
+    files_dir = kwargs.get('__files_dir__', [''])[-1]
+    files = kwargs.get('__files__', [_no_files])[-1]
+    # If command is false/true in yaml file, it gets converted to False/True
+    # which is bool object => convert
+    if isinstance(s, bool):
+        comm = str(s).lower()
+    else:
+        comm = s
+
+    segments = _get_compiled_str(comm, files_dir, files).segments
 
-    return _homedir_matcher.sub(_homedir_expand, substituted)
+    # substitute cli arguments for their values
+    values = []
+    expand_whole = False
+    for raw, name, expanded in segments:
+        if name is not None:
+            try:
+                raw = '%s' % (kwargs[name], )
+            except KeyError:
+                pass
+            # values containing "~", empty values and values with trailing backslash can
+            #  change the meaning of tildes and backslashes around them => in this case,
+            #  expand the whole substituted string the slow way
+            if not raw or '~' in raw or raw.endswith('\\'):
+                expand_whole = True
+        values.append(raw)
+
+    if expand_whole:
+        return _homedir_matcher.sub(_homedir_expand, ''.join(values))
+
+    homedir = None
+    res = []
+    for value, (raw, name, expanded) in zip(values, segments):
+        if name is not None:
+            res.append(value)
+            continue
+        for e in expanded:
+            if e is _homedir:
+                if homedir is None:
+                    homedir = os.path.expanduser('~')
+                e = homedir
+            res.append(e)
+    return ''.join(res)
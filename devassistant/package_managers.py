@@ -20,13 +20,19 @@ on other platforms, e.g. Zypper on OpenSuse. PackageManager subclasses should al
 represent these high-level tools like YUM or Zypper, not RPM itself.
 """
 from __future__ import print_function
+import glob
+import logging
 import math
 import os
-import platform
+import re
+import shutil
 import sys
 import tempfile
 import time
 import threading
+from multiprocessing.pool import ThreadPool
+
+import six
 
 from devassistant.command_helpers import ClHelper, DialogHelper
 from devassistant.logger import logger
@@ -82,6 +88,37 @@ class PackageManager(object):
         """Is a package managed by this manager installed?"""
         raise NotImplementedError()
 
+    @classmethod
+    def are_pkgs_installed(cls, pkgs):
+        """Which of given packages managed by this manager are installed?
+
+        Packages recorded as installed in InstalledSnapshot are not queried again, unless
+        the package database of this manager changed since they were recorded.
+        Args:
+            pkgs: list of packages to check
+        Returns:
+            dict {package: result of presence check}, where the result evaluates to True
+            iff the package is installed
+        """
+        return InstalledSnapshot.are_pkgs_installed(cls, pkgs)
+
+    @classmethod
+    def query_pkgs_installed(cls, pkgs):
+        """Actually query the system for presence of given packages, returns the same
+        as are_pkgs_installed.
+
+        Managers that are able to find this out for more packages at once should override
+        this, the default implementation just calls is_pkg_installed for every package.
+        """
+        return dict((pkg, cls.is_pkg_installed(pkg)) for pkg in pkgs)
+
+    @classmethod
+    def get_db_paths(cls):
+        """Return list of paths whose modification times change whenever a package
+        managed by this manager gets installed or removed. If empty, the presence of packages
+        is never remembered in InstalledSnapshot."""
+        return []
+
     @classmethod
     def resolve(cls, *args, **kwargs):
         """
@@ -108,11 +145,26 @@ class PackageManager(object):
     def _debug_doesnt_work(cls, msg, name=None):
         logger.debug('{0} not operational - {1}'.format(name or cls.__name__, msg))
 
+    @classmethod
+    def _log_pkg_check(cls, pkg, found):
+        """Log result of presence check of a package that was queried in a batch."""
+        logger.info('Checking for presence of {0}...'.format(pkg),
+                    extra={'event_type': 'dep_check'})
+        if found:
+            logger.info('Found {0}'.format(found), extra={'event_type': 'dep_found'})
+        else:
+            logger.info('Not found, will install', extra={'event_type': 'dep_not_found'})
+
 
 class RPMPackageManager(PackageManager):
 
     shortcut = 'rpm'
     c_rpm = 'rpm'
+    # rpmdb is either Berkeley DB (Packages) or sqlite (rpmdb.sqlite)
+    db_paths = ['/var/lib/rpm', '/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite']
+
+    # line that "rpm -q --whatprovides" prints for every name that nothing provides
+    _rpm_not_provided = re.compile(r'^no package provides (.+)$')
 
     @classmethod
     def rpm_q(cls, rpm_name):
@@ -138,6 +190,61 @@ class RPMPackageManager(PackageManager):
             logger.info('Not found, will install', extra={'event_type': 'dep_not_found'})
         return found_rpm
 
+    @classmethod
+    def rpms_q(cls, rpm_names):
+        """Query presence of all given rpms by a single "rpm -q --whatprovides" call.
+
+        Returns:
+            dict {rpm_name: True/False} or None if the output of rpm can't be reliably
+            matched to the given names (e.g. rpm failed for another reason or printed
+            a localized message)
+        """
+        rpm_names = [rpm_name.strip() for rpm_name in rpm_names]
+        cmd = [cls.c_rpm, '-q', '--whatprovides']
+        cmd.extend(['"' + rpm_name + '"' for rpm_name in rpm_names])
+        failed = False
+        try:
+            output = ClHelper.run_command(' '.join(cmd))
+        except exceptions.ClException as e:
+            output = e.output or ''
+            failed = True
+
+        missing = set()
+        for line in output.splitlines():
+            match = cls._rpm_not_provided.match(line.strip())
+            if match:
+                missing.add(match.group(1))
+        if (failed and not missing) or not missing.issubset(rpm_names):
+            return None
+        return dict((rpm_name, rpm_name not in missing) for rpm_name in rpm_names)
+
+    @classmethod
+    def are_rpms_installed(cls, rpm_names):
+        """Batch variant of is_rpm_installed, falls back to querying rpms one by one
+        if the batch query can't be interpreted."""
+        if len(rpm_names) < 2:
+            return dict((rpm_name, cls.is_rpm_installed(rpm_name)) for rpm_name in rpm_names)
+        found = cls.rpms_q(rpm_names)
+        if found is None:
+            logger.debug('Can\'t interpret batch rpm query, querying rpms one by one.')
+            return dict((rpm_name, cls.is_rpm_installed(rpm_name)) for rpm_name in rpm_names)
+        ret = {}
+        for rpm_name in rpm_names:
+            ret[rpm_name] = rpm_name if found[rpm_name.strip()] else False
+            cls._log_pkg_check(rpm_name, ret[rpm_name])
+        return ret
+
+    @classmethod
+    def get_db_paths(cls):
+        return cls.db_paths
+
+    @classmethod
+    def query_pkgs_installed(cls, pkgs):
+        # groups can't be queried by rpm, so they're checked one by one
+        ret = dict((pkg, cls.is_group_installed(pkg)) for pkg in pkgs if pkg.startswith('@'))
+        ret.update(cls.are_rpms_installed([pkg for pkg in pkgs if not pkg.startswith('@')]))
+        return ret
+
 
 @register_manager
 class YUMPackageManager(RPMPackageManager):
@@ -227,10 +334,80 @@ class DNFPackageManager(RPMPackageManager):
 
     c_dnf = 'dnf'
 
+    # dnf.Base with filled sack, shared by presence checks and resolution, so that rpmdb
+    #  and repository metadata are only read once per process (see _get_base)
+    _base = None
+    _base_has_available_repos = False
+    # temporary cachedir of _base, removed by forget_base
+    _base_cachedir = None
+    _base_cleanup_registered = False
+
+    @classmethod
+    def _get_base(cls, load_available_repos=False):
+        """Return the shared dnf.Base. Its sack contains only installed packages, unless
+        load_available_repos is True (then available repositories are loaded into
+        the sack, if they weren't already)."""
+        import dnf
+        if cls._base is None:
+            if not cls._base_cleanup_registered:
+                utils.atexit(cls.forget_base)
+                cls._base_cleanup_registered = True
+            base = dnf.Base()
+            cls._base_cachedir = base.conf.cachedir = tempfile.mkdtemp()
+            base.conf.substitutions['releasever'] = utils.get_system_facts().distro_version
+            if load_available_repos:
+                base.read_all_repos()
+            base.fill_sack(load_system_repo=True, load_available_repos=load_available_repos)
+            cls._base = base
+            cls._base_has_available_repos = load_available_repos
+        elif load_available_repos and not cls._base_has_available_repos:
+            cls._base.read_all_repos()
+            cls._base.fill_sack(load_system_repo=True, load_available_repos=True)
+            cls._base_has_available_repos = True
+        return cls._base
+
+    @classmethod
+    def _try_get_base(cls, load_available_repos=False):
+        """Same as _get_base, but returns None if dnf.Base can't be used (in which case
+        callers should fall back to command line tools)."""
+        try:
+            return cls._get_base(load_available_repos)
+        except Exception as e:
+            logger.debug('Can\'t use DNF bindings, falling back to command line: {0}'.
+                         format(utils.exc_as_decoded_string(e)))
+            return None
+
+    @classmethod
+    def forget_base(cls):
+        """Forget the shared dnf.Base, e.g. because its sack got outdated by installation,
+        and remove its temporary cachedir."""
+        cls._base = None
+        if cls._base_cachedir is not None:
+            shutil.rmtree(cls._base_cachedir, ignore_errors=True)
+            cls._base_cachedir = None
+
+    @classmethod
+    def _query_installed(cls, base, pkg):
+        """Look for installed package providing pkg (or file pkg, if it's absolute path)
+        in sack of given base. Returns name of the package, False if there is none
+        or None if the sack can't be queried for pkg."""
+        import hawkey
+        try:
+            query = base.sack.query().installed()
+            if pkg.startswith('/'):
+                res = query.filter(file=pkg).run()
+            else:
+                res = query.filter(provides=pkg).run()
+        except (hawkey.QueryException, hawkey.ValueException):
+            return None
+        return str(res[0]) if res else False
+
     @classmethod
     def is_group_installed(cls, group):
         logger.info('Checking for presence of group {0}...'.format(group))
 
+        # groups are checked by dnf itself - finding them out by comps of the shared base
+        #  would need to download metadata of all available repositories
         output = ClHelper.run_command(' '.join(
             [cls.c_dnf, 'groups', 'list', '"{0}"'.format(group)]))
         if 'installed groups' in output.lower():
@@ -240,6 +417,24 @@ class DNFPackageManager(RPMPackageManager):
             logger.info('Not found, will install', extra={'event_type': 'dep_not_found'})
         return False
 
+    @classmethod
+    def query_pkgs_installed(cls, pkgs):
+        base = cls._try_get_base()
+        if base is None:
+            return super(DNFPackageManager, cls).query_pkgs_installed(pkgs)
+        ret = {}
+        for pkg in pkgs:
+            if pkg.startswith('@'):
+                ret[pkg] = cls.is_group_installed(pkg)
+                continue
+            found = cls._query_installed(base, pkg)
+            if found is None:
+                ret[pkg] = cls.is_rpm_installed(pkg)
+            else:
+                ret[pkg] = found
+                cls._log_pkg_check(pkg, found)
+        return ret
+
     @classmethod
     def install(cls, *args):
         cmd = [cls.c_dnf, '-y', 'install']
@@ -250,6 +445,8 @@ class DNFPackageManager(RPMPackageManager):
             return args
         except exceptions.ClException:
             return False
+        finally:
+            cls.forget_base()
 
     @classmethod
     def works(cls):
@@ -270,11 +467,9 @@ class DNFPackageManager(RPMPackageManager):
         logger.info('Resolving RPM dependencies with DNF...')
         import dnf
         import hawkey
-        base = dnf.Base()
-        base.conf.cachedir = tempfile.mkdtemp()
-        base.conf.substitutions['releasever'] = platform.linux_distribution()[1]
-        base.read_all_repos()
-        base.fill_sack(load_system_repo=True, load_available_repos=True)
+        base = cls._get_base(load_available_repos=True)
+        # the base is shared, throw away whatever was marked for installation previously
+        base.reset(goal=True)
         for pkg in (str(arg) for arg in args):
             if pkg.startswith('@'):
                 base.group_install(pkg[1:])
@@ -310,6 +505,8 @@ class PacmanPackageManager(PackageManager):
     shortcut = 'pacman'
 
     c_pacman = 'pacman'
+    # every installed package has its own directory here
+    db_path = '/var/lib/pacman/local'
 
     @classmethod
     def install(cls, *args):
@@ -361,6 +558,40 @@ class PacmanPackageManager(PackageManager):
     def is_pkg_installed(cls, pkg):
         return cls.is_pacmanpkg_installed(pkg) or cls.is_group_installed(pkg)
 
+    @classmethod
+    def _query_names(cls, query, names):
+        """Run "pacman <query>" for all names at once and return the set of names that
+        pacman found. pacman prints "name ..." for found names and an error for the rest."""
+        cmd = [cls.c_pacman, query]
+        cmd.extend(['"{0}"'.format(name) for name in names])
+        try:
+            output = ClHelper.run_command(' '.join(cmd))
+        except exceptions.ClException as e:
+            output = e.output or ''
+        found = set()
+        for line in output.splitlines():
+            line = line.strip()
+            if line and not line.startswith('error:'):
+                found.add(line.split()[0])
+        return found
+
+    @classmethod
+    def query_pkgs_installed(cls, pkgs):
+        if len(pkgs) < 2:
+            return dict((pkg, cls.is_pkg_installed(pkg)) for pkg in pkgs)
+        found_pkgs = cls._query_names('-Q', pkgs)
+        not_pkgs = [pkg for pkg in pkgs if pkg not in found_pkgs]
+        found_groups = cls._query_names('-Qg', not_pkgs) if not_pkgs else set()
+        ret = {}
+        for pkg in pkgs:
+            ret[pkg] = pkg if pkg in found_pkgs or pkg in found_groups else False
+            cls._log_pkg_check(pkg, ret[pkg])
+        return ret
+
+    @classmethod
+    def get_db_paths(cls):
+        return [cls.db_path]
+
     @classmethod
     def resolve(cls, *args):
         # TODO: I currently see no way how to just resolve dependencies by pacman
@@ -583,6 +814,31 @@ class GemPackageManager(PackageManager):
             logger.info('Not found, will install', extra={'event_type': 'dep_not_found'})
             return False
 
+    @classmethod
+    def get_db_paths(cls):
+        # gems installed system-wide and by "gem install --user"
+        return ['/usr/share/gems/specifications', '/usr/local/share/gems/specifications'] + \
+            sorted(glob.glob(os.path.expanduser('~/.gem/ruby/*/specifications')))
+
+    @classmethod
+    def query_pkgs_installed(cls, pkgs):
+        if len(pkgs) < 2:
+            return dict((pkg, cls.is_pkg_installed(pkg)) for pkg in pkgs)
+        # "gem list --local" prints lines like "name (version, ...)"
+        try:
+            query = ClHelper.run_command(' '.join([cls.c_gem, 'list', '--local']))
+        except exceptions.ClException:
+            return dict((pkg, cls.is_pkg_installed(pkg)) for pkg in pkgs)
+        installed = {}
+        for line in query.splitlines():
+            if line.strip():
+                installed[line.split()[0]] = line.strip()
+        ret = {}
+        for pkg in pkgs:
+            ret[pkg] = installed.get(pkg, False)
+            cls._log_pkg_check(pkg, ret[pkg])
+        return ret
+
     @classmethod
     def resolve(cls, *dep):
         logger.info('Resolving gem dependencies...')
@@ -606,7 +862,7 @@ class GentooPackageManager(PackageManager):
     @classmethod
     def _try_get_current_manager(cls):
         """ Try to detect a package manager used in a current Gentoo system. """
-        if utils.get_distro_name().find('gentoo') == -1:
+        if utils.get_system_facts().distro_name.find('gentoo') == -1:
             return None
         if 'PACKAGE_MANAGER' in os.environ:
             pm = os.environ['PACKAGE_MANAGER']
@@ -797,6 +1053,128 @@ class PaludisPackageManager(GentooPackageManager):
         cls.throw_package_list(list(to_install))
 
 
+class _ThreadLogBuffer(logging.Filter):
+    """Logger filter that holds back records logged from threads running a function
+    through call, so that the caller can log them later in an order of its choice."""
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self._local = threading.local()
+
+    def call(self, func, *args):
+        """Returns tuple (result of func(*args), list of log records held back)."""
+        self._local.records = []
+        try:
+            return func(*args), self._local.records
+        finally:
+            self._local.records = None
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+class InstalledSnapshot(object):
+    """On-disk record of packages that package managers found installed, so that repeated
+    runs of DevAssistant don't need to query the package managers again. Packages of every
+    manager are recorded along with modification times of the manager's package database
+    (see PackageManager.get_db_paths) and are forgotten as soon as the database changes.
+
+    Only installed packages are recorded - missing packages are always queried again.
+    The snapshot is stored in settings.DEPS_CACHE_FILE, setting it to None disables it.
+    """
+    # {manager name: {'fingerprint': ..., 'installed': {package: result of presence check}}}
+    _snapshot = None
+    _snapshot_file = None
+    # presence of packages of different managers may be checked from more threads
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_fingerprint(cls, manager):
+        """Return [[path, mtime or None], ...] for package database paths of given manager
+        or None if none of these paths exist (i.e. the database state can't be watched)."""
+        fingerprint = []
+        for path in manager.get_db_paths():
+            try:
+                fingerprint.append([path, os.stat(path).st_mtime])
+            except OSError:
+                fingerprint.append([path, None])
+        if all(mtime is None for path, mtime in fingerprint):
+            return None
+        return fingerprint
+
+    @classmethod
+    def load(cls):
+        """Return the snapshot, loading it from settings.DEPS_CACHE_FILE on first call."""
+        if cls._snapshot is None or cls._snapshot_file != settings.DEPS_CACHE_FILE:
+            from devassistant import cache
+            cls._snapshot_file = settings.DEPS_CACHE_FILE
+            try:
+                cls._snapshot = cache.load_cache_file(cls._snapshot_file)
+            except Exception as e:  # missing file, garbage, ...
+                if os.path.exists(cls._snapshot_file):
+                    logger.debug('Ignoring unusable installed packages snapshot {0}: {1}'.
+                                 format(cls._snapshot_file, utils.exc_as_decoded_string(e)))
+                cls._snapshot = {}
+            if not isinstance(cls._snapshot, dict):
+                cls._snapshot = {}
+        return cls._snapshot
+
+    @classmethod
+    def save(cls):
+        from devassistant import cache
+        try:
+            if not os.path.exists(os.path.dirname(cls._snapshot_file)):
+                os.makedirs(os.path.dirname(cls._snapshot_file))
+            cache.dump_cache_file(cls._snapshot_file, cls._snapshot)
+        except (IOError, OSError) as e:
+            logger.debug('Failed to save installed packages snapshot {0}: {1}'.
+                         format(cls._snapshot_file, utils.exc_as_decoded_string(e)))
+
+    @classmethod
+    def are_pkgs_installed(cls, manager, pkgs):
+        """Return the same as manager.query_pkgs_installed(pkgs), but only query packages
+        that are not recorded as installed in the snapshot."""
+        fingerprint = None
+        if settings.DEPS_CACHE_FILE:
+            fingerprint = cls.get_fingerprint(manager)
+        if fingerprint is None:
+            return manager.query_pkgs_installed(pkgs)
+
+        with cls._lock:
+            snapshot = cls.load()
+            entry = snapshot.get(manager.__name__)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            entry = {'fingerprint': fingerprint, 'installed': {}}
+        known = dict(entry['installed'])
+
+        ret = {}
+        for pkg in pkgs:
+            if pkg in known:
+                ret[pkg] = known[pkg]
+                # non-string results are stored as True, log the package name for these
+                manager._log_pkg_check(pkg, known[pkg] if
+                                       isinstance(known[pkg], six.string_types) else pkg)
+        to_query = [pkg for pkg in pkgs if pkg not in ret]
+        if to_query:
+            found = manager.query_pkgs_installed(to_query)
+            ret.update(found)
+            for pkg, res in found.items():
+                if res:
+                    # the result may be anything that evaluates to True, store just
+                    #  strings (for logging) and True otherwise
+                    known[pkg] = res if isinstance(res, six.string_types) else True
+            with cls._lock:
+                snapshot[manager.__name__] = {'fingerprint': fingerprint, 'installed': known}
+                cls.save()
+        else:
+            logger.debug('All {0} dependencies found in installed packages snapshot.'.
+                         format(manager.__name__))
+        return ret
+
+
 class DependencyInstaller(object):
     """Installs all dependencies given to install() like this:
     - Calls _process_dependency for each dependency type, system dependencies always go first
@@ -806,14 +1184,36 @@ class DependencyInstaller(object):
       - For non-system dependency type (e.g. 'gem', 'pip'), it also adds a system dependency
         that has the ability to install these (e.g. rubygems, python-pip)
     - Calls _install_dependencies
-      - For each dependency type
+      - For all dependency types at once (in threads)
         - Gets proper manager to install it
+        - Finds out which dependencies are missing (by one query per manager, if possible)
+      - For each dependency type
         - Resolves dependencies of those dependencies :)
         - Installs the dependencies
     """
     # True if devassistant is installing dependencies and we can't interrupt the process
     install_lock = False
 
+    # finding out whether a manager works may mean running a subprocess or importing
+    #  heavy modules, so the results are remembered for the whole process in form of
+    #  {manager: result of works()} and {dep_t: chosen manager};
+    #  call invalidate_package_managers() if the results may have changed
+    _works_results = {}
+    _chosen_managers = {}
+
+    @classmethod
+    def invalidate_package_managers(cls):
+        """Forget which package managers work, e.g. after installing packages, which may
+        have made another manager operational (e.g. pip after installing python-pip)."""
+        cls._works_results.clear()
+        cls._chosen_managers.clear()
+
+    @classmethod
+    def _manager_works(cls, manager):
+        if manager not in cls._works_results:
+            cls._works_results[manager] = manager.works()
+        return cls._works_results[manager]
+
     """Class for installing dependencies """
     def __init__(self):
         # self.dependencies has form [(package_manager_shorcut, ['list', 'of', 'dependencies'])]
@@ -836,9 +1236,18 @@ class DependencyInstaller(object):
     def get_package_manager(self, dep_t):
         """Choose proper package manager and return it."""
         mgrs = managers.get(dep_t, [])
+        chosen = self._chosen_managers.get(dep_t)
+        if chosen in mgrs:
+            return chosen
+        start = time.time()
         for manager in mgrs:
-            if manager.works():
+            if self._manager_works(manager):
+                logger.debug('Choosing package manager for "{0}" took {1:.3f}s.'.
+                             format(dep_t, time.time() - start))
+                self._chosen_managers[dep_t] = manager
                 return manager
+        logger.debug('Looking for package manager for "{0}" took {1:.3f}s.'.
+                     format(dep_t, time.time() - start))
         if not mgrs:
             err = 'No package manager for dependency type "{dep_t}"'.format(dep_t=dep_t)
             raise exceptions.NoPackageManagerException(err)
@@ -868,7 +1277,7 @@ class DependencyInstaller(object):
             self._process_dependency(sysdep_t,
                                      managers[dep_t][0].get_distro_dependencies(sysdep_t))
         else:
-            local_distro = utils.get_distro_name()
+            local_distro = utils.get_system_facts().distro_name
             found = False
             for distro in distros:
                 if distro in local_distro:
@@ -886,17 +1295,65 @@ class DependencyInstaller(object):
         )
         return bool(ret)
 
+    def _probe_dependencies(self, dep_t, dep_l):
+        """Find working package manager for dep_t and find out which of dep_l are missing.
+
+        Returns:
+            tuple (package manager, list of missing dependencies)
+        """
+        pkg_mgr = self.get_package_manager(dep_t)
+        installed = pkg_mgr.are_pkgs_installed(dep_l)
+        return pkg_mgr, [dep for dep in dep_l if not installed[dep]]
+
+    def _try_probe_dependencies(self, dep_t_l):
+        """Same as _probe_dependencies, but returns None instead of raising."""
+        try:
+            return self._probe_dependencies(*dep_t_l)
+        except (Exception, exceptions.ExecutionException) as e:
+            logger.debug('Probing "{0}" dependencies failed: {1}'.
+                         format(dep_t_l[0], utils.exc_as_decoded_string(e)))
+            return None
+
+    def _probe_all_dependencies(self, to_probe):
+        """Run _probe_dependencies for all given (dep_t, dep_l) pairs concurrently, since
+        finding working managers and checking presence of packages mostly means waiting
+        for subprocesses and is independent for different dependency types. Messages
+        logged by the probes are held back and logged in order of to_probe once all probes
+        finish, so that they don't get interleaved.
+
+        Returns:
+            list of results of _probe_dependencies in order of to_probe, None for those
+            that failed
+        """
+        if len(to_probe) < 2:
+            return [self._try_probe_dependencies(p) for p in to_probe]
+        log_buffer = _ThreadLogBuffer()
+        pool = ThreadPool(len(to_probe))
+        logger.addFilter(log_buffer)
+        try:
+            results = pool.map(lambda p: log_buffer.call(self._try_probe_dependencies, p),
+                               to_probe)
+        finally:
+            logger.removeFilter(log_buffer)
+            pool.close()
+        for probe, records in results:
+            for record in records:
+                logger.handle(record)
+        return [probe for probe, records in results]
+
     def _install_dependencies(self, ui, debug):
         """Install missing dependencies"""
-        for dep_t, dep_l in self.dependencies:
-            if not dep_l:
-                continue
-            pkg_mgr = self.get_package_manager(dep_t)
-            pkg_mgr.works()
-            to_resolve = []
-            for dep in dep_l:
-                if not pkg_mgr.is_pkg_installed(dep):
-                    to_resolve.append(dep)
+        to_probe = [(dep_t, dep_l) for dep_t, dep_l in self.dependencies if dep_l]
+        probed = self._probe_all_dependencies(to_probe)
+        installed_by = set()
+        for (dep_t, dep_l), probe in zip(to_probe, probed):
+            # packages installed by a manager change its results for following dependency
+            #  types, so these are probed again; failed probes are repeated, because
+            #  installing may have made the manager work (e.g. "pip" works only after
+            #  python-pip was installed) and to raise the error in proper order otherwise
+            if probe is None or probe[0] in installed_by:
+                probe = self._probe_dependencies(dep_t, dep_l)
+            pkg_mgr, to_resolve = probe
             if not to_resolve:
                 # nothing to install, let's move on
                 continue
@@ -915,6 +1372,7 @@ class DependencyInstaller(object):
                 t = EndlessProgressThread(event)
                 t.start()
             installed = pkg_mgr.install(*to_install)
+            self.invalidate_package_managers()
             if ui == 'cli' and not debug:
                 event.set()
                 t.join()
@@ -930,6 +1388,7 @@ class DependencyInstaller(object):
                 logger.error(msg, extra=log_extra)
                 raise exceptions.DependencyException(msg)
             else:
+                installed_by.add(pkg_mgr)
                 logger.info('Successfully installed dependencies!', extra=log_extra)
 
     def install(self, struct, ui, debug=False):
@@ -949,7 +1408,7 @@ class DependencyInstaller(object):
             self._install_dependencies(ui, debug)
 
     def get_system_deptype_shortcut(self):
-        local_distro = utils.get_distro_name()
+        local_distro = utils.get_system_facts().distro_name
         for dep_t, distros in settings.SYSTEM_DEPTYPES_SHORTCUTS.items():
             for distro in distros:
                 if distro in local_distro:
@@ -71,6 +71,9 @@ class PathRunner(object):
         except exceptions.ExecutionException as e:
             error = self._log_if_not_logged(e)
 
+        logger.debug('Expression cache: {hits} hits, {misses} misses, {size} parsed '
+                     'expressions.'.format(**lang.Interpreter.cache_info()))
+
         if error:
             raise error
 
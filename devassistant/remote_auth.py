@@ -19,13 +19,9 @@ class GitHubAuth(object):
     """
     _user = None
     _token = None
-    try:
-        _gh_module = utils.import_module('github')
-        _gh_exceptions = utils.import_module('github.GithubException')
-
-    except:
-        _gh_module = None
-        _gh_exceptions = None
+    # PyGithub is optional and slow to import, it's only imported when needed
+    _gh_module = utils.LazyModule('github')
+    _gh_exceptions = utils.LazyModule('github.GithubException')
 
     @classmethod
     def _github_token(cls, login):
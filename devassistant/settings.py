@@ -87,6 +87,25 @@ else:
 
 USE_CACHE = True
 CACHE_FILE = os.path.join(DEVASSISTANT_HOME, '.cache.yaml')
+# "binary" (faster to load and store) or "yaml" (human readable); when "binary" is used,
+#  the cache is stored in ".cache.bin" next to CACHE_FILE
+CACHE_FORMAT = 'binary'
+# number of processes to parse yaml files with when loading assistants without (or with
+#  cold) cache; 0 or 1 means parsing them serially in DevAssistant process
+YAML_LOADING_PROCESSES = int(os.environ.get('DEVASSISTANT_YAML_LOADING_PROCESSES', 0))
+# packages that package managers found installed are remembered here until the package
+#  database changes (see package_managers.InstalledSnapshot); None disables this
+DEPS_CACHE_FILE = os.path.join(DEVASSISTANT_HOME, '.deps_cache.bin')
+# maximum number of characters of output of a single command held in memory while it runs;
+#  longer output is spooled to a temporary file (None means no limit)
+CL_OUTPUT_MEMORY_LIMIT = 4 * 1024 * 1024
+# number of last characters of output kept in result of "cl_t" commands
+CL_OUTPUT_TAIL_SIZE = 64 * 1024
+# default number of sections that "parallel" command runs at the same time
+PARALLEL_MAX_WORKERS = 4
+# everything bash completion needs to know about assistants and actions is stored here
+#  (see devassistant.completion); None disables this
+COMPLETION_INDEX_FILE = os.path.join(DEVASSISTANT_HOME, '.completion_index.json')
 CONFIG_FILE = os.path.join(DEVASSISTANT_HOME, '.config')
 LOG_FILE = os.path.join(DEVASSISTANT_HOME, 'lastrun.log')
 
@@ -1,24 +1,36 @@
 import copy
 
 from devassistant import loaded_yaml
+from devassistant import utils
 
 
 class Snippet(loaded_yaml.LoadedYaml):
+    """A loaded snippet. Since snippets are shared during one DevAssistant invocation (see
+    YamlSnippetLoader), the sections are returned as frozen structures (see utils.freeze)
+    instead of copies; callers that need to modify them must copy.deepcopy() them."""
     def __init__(self, dotted_name, parsed_yaml, path):
         self.name = dotted_name.split('.')[-1]
         self.dotted_name = dotted_name
         self.parsed_yaml = parsed_yaml
         self.path = path
+        # frozen sections in the form of {section name: frozen section}
+        self._frozen = {}
+
+    def _get_frozen(self, key, default=None):
+        if key not in self._frozen:
+            self._frozen[key] = utils.freeze(self.parsed_yaml.get(key) or default)
+        return self._frozen[key]
 
     @property
     def args(self):
-        return copy.deepcopy(self.parsed_yaml.get('args') or {})
+        return self._get_frozen('args', {})
 
     def get_arg_by_name(self, name):
-        return self.args.get(name) or {}
+        """Returns a mutable copy of given argument."""
+        return copy.deepcopy(self.args.get(name)) or {}
 
     def get_run_section(self, section_name='run'):
-        return copy.deepcopy(self.parsed_yaml.get(section_name))
+        return self._get_frozen(section_name)
 
     def get_files_dir(self):
         return self.parsed_yaml.get('files_dir') or self.default_files_dir_for('snippets')
@@ -27,10 +39,13 @@ class Snippet(loaded_yaml.LoadedYaml):
         if section_name not in self.parsed_yaml:
             return None
         # we also want to include the basic "dependencies" section
-        deps = copy.deepcopy(self.parsed_yaml.get('dependencies', []))
-        if section_name != 'dependencies':
-            deps.extend(copy.deepcopy(self.parsed_yaml.get(section_name, [])))
-        return deps
+        key = ('dependencies', section_name)
+        if key not in self._frozen:
+            deps = list(self.parsed_yaml.get('dependencies') or [])
+            if section_name != 'dependencies':
+                deps.extend(self.parsed_yaml.get(section_name) or [])
+            self._frozen[key] = utils.freeze(deps)
+        return self._frozen[key]
 
     def get_files_section(self):
-        return copy.deepcopy(self.parsed_yaml.get('files') or {})
+        return self._get_frozen('files', {})
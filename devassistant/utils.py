@@ -1,5 +1,7 @@
 from __future__ import print_function
 
+import collections
+import copy
 import locale
 import os
 import platform
@@ -47,18 +49,100 @@ def import_by_path(modname, path):
         return importlib.load_source(modname, path)
 
 
+class LazyModule(object):
+    """Stands in for an optional module that is expensive to import - the module is only
+    imported on first attribute access or truth test. The object evaluates to False if
+    the module can't be imported."""
+    _failed = object()
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                self._module = import_module(self._name)
+            except Exception:
+                self._module = self._failed
+        return None if self._module is self._failed else self._module
+
+    def __bool__(self):
+        return self._load() is not None
+    __nonzero__ = __bool__
+
+    def __getattr__(self, attr):
+        module = self._load()
+        if module is None:
+            raise AttributeError(attr)
+        return getattr(module, attr)
+
+
+# Facts about the system DevAssistant runs on; these can't change while DevAssistant runs,
+#  so they're detected only once (see get_system_facts)
+SystemFacts = collections.namedtuple('SystemFacts',
+                                     ['system_name', 'system_version',
+                                      'distro_name', 'distro_version'])
+_system_facts = None
+
+
+def get_system_facts():
+    """Returns SystemFacts of this system, detecting them on first call. If detection of any
+    of the facts fails, it is set to empty string."""
+    global _system_facts
+    if _system_facts is None:
+        facts = []
+        for fact in SystemFacts._fields:
+            try:
+                facts.append(globals()['_detect_' + fact]())
+            except Exception:
+                facts.append('')
+        _system_facts = SystemFacts(*facts)
+    return _system_facts
+
+
+def set_system_facts(facts):
+    """Makes get_system_facts return given SystemFacts (e.g. in tests); if facts is None,
+    the real facts get detected again on next call of get_system_facts."""
+    global _system_facts
+    _system_facts = facts
+
+
 def get_system_name():
-    return platform.system().lower()
+    return get_system_facts().system_name
 
 
 def get_system_version():
-    return platform.release().lower()
+    return get_system_facts().system_version
 
 
 def get_distro_name():
-    system = get_system_name()
+    return get_system_facts().distro_name
+
+
+def get_distro_version():
+    return get_system_facts().distro_version
+
+
+def _linux_distribution(**kwargs):
+    # platform.linux_distribution was removed in Python 3.8
+    if hasattr(platform, 'linux_distribution'):
+        return platform.linux_distribution(**kwargs)
+    return ('', '', '')
+
+
+def _detect_system_name():
+    return platform.system().lower()
+
+
+def _detect_system_version():
+    return platform.release().lower()
+
+
+def _detect_distro_name():
+    system = _detect_system_name()
     if system == 'linux':
-        return platform.linux_distribution(full_distribution_name=False)[0].lower() \
+        return _linux_distribution(full_distribution_name=False)[0].lower() \
             or _get_os_release_content('ID')
     elif system == 'darwin':
         return 'darwin'
@@ -66,8 +150,8 @@ def get_distro_name():
         return ''
 
 
-def get_distro_version():
-    return platform.linux_distribution()[1].lower() or _get_os_release_content('VERSION_ID')
+def _detect_distro_version():
+    return _linux_distribution()[1].lower() or _get_os_release_content('VERSION_ID')
 
 
 def _get_os_release_content(line_start):
@@ -75,10 +159,11 @@ def _get_os_release_content(line_start):
     if not os.path.exists(os_release):
         return ''
 
+    found = ''
     with open(os_release) as osrel:
         for l in osrel.readlines():
-            if l.startswith(line_start):
-                found = l.split('=')[-1].strip()
+            if l.startswith(line_start + '='):
+                found = l.split('=')[-1].strip().strip('"\'')
     return found.lower()
 
 
@@ -228,3 +313,60 @@ def _strip(string, pattern):
     else:
         return string
 
+
+def _raise_frozen(self, *args, **kwargs):
+    raise TypeError('{0} object is immutable, use copy.deepcopy() to get a mutable copy'.
+                    format(type(self).__name__))
+
+
+class FrozenDict(dict):
+    """An immutable dict, see freeze. Copies (both shallow and deep) are plain mutable dicts."""
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _raise_frozen
+    __ior__ = _raise_frozen
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((copy.deepcopy(k, memo), copy.deepcopy(v, memo)) for k, v in self.items())
+
+    def __reduce__(self):
+        return (type(self), (dict(self), ))
+
+
+class FrozenList(list):
+    """An immutable list, see freeze. Copies (both shallow and deep) are plain mutable lists."""
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _raise_frozen
+    append = extend = insert = pop = remove = reverse = sort = _raise_frozen
+    # Python 2 only
+    __setslice__ = __delslice__ = _raise_frozen
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(i, memo) for i in self]
+
+    def __reduce__(self):
+        return (type(self), (list(self), ))
+
+
+# dump frozen structures the same way as plain dicts and lists
+for representer in [yaml.representer.SafeRepresenter, yaml.representer.Representer]:
+    representer.add_representer(FrozenDict, yaml.representer.SafeRepresenter.represent_dict)
+    representer.add_representer(FrozenList, yaml.representer.SafeRepresenter.represent_list)
+
+
+def freeze(struct):
+    """Returns an immutable version of given structure loaded from yaml (dicts and lists are
+    recursively converted to FrozenDicts and FrozenLists, other values are returned as they are).
+
+    This allows sharing the structure without copying it every time it's requested - code
+    that only reads it can use it directly and code that needs to modify it must
+    copy.deepcopy() it first (and gets a TypeError if it forgets to).
+    """
+    if isinstance(struct, dict):
+        return FrozenDict((k, freeze(v)) for k, v in struct.items())
+    elif isinstance(struct, list):
+        return FrozenList(freeze(i) for i in struct)
+    return struct
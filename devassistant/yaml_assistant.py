@@ -149,13 +149,9 @@ class YamlAssistant(assistant_base.AssistantBase, loaded_yaml.LoadedYaml):
         kwargs['__files__'] = [self._files]
         kwargs['__files_dir__'] = [self.files_dir]
         kwargs['__sourcefiles__'] = [self.path]
-        # if any of the following fails, DA should keep running
-        for i in ['system_name', 'system_version', 'distro_name', 'distro_version']:
-            try:
-                val = getattr(utils, 'get_' + i)()
-            except:
-                val = ''
-            kwargs['__' + i + '__'] = val
+        facts = utils.get_system_facts()
+        for i in facts._fields:
+            kwargs['__' + i + '__'] = getattr(facts, i)
 
     @needs_fully_loaded
     def logging(self, kwargs):
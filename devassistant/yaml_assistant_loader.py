@@ -1,5 +1,7 @@
 import os
 
+from devassistant import argument
+from devassistant import assistant_base
 from devassistant import cache
 from devassistant import exceptions
 from devassistant.logger import logger
@@ -51,7 +53,7 @@ class YamlAssistantLoader(object):
             load_all = not settings.USE_CACHE
             if settings.USE_CACHE:
                 try:
-                    cch = cache.Cache()
+                    cch = cache.Cache.get_instance()
                     cch.refresh_role(tl, file_hierarchy)
                     _assistants[tl] = cls.get_assistants_from_cache_hierarchy(cch.cache[tl],
                                                                                   superas_dict[tl],
@@ -66,6 +68,30 @@ class YamlAssistantLoader(object):
                                                                              role=tl)
         return _assistants
 
+    @classmethod
+    def get_cli_schema_assistants(cls, superassistant):
+        """Returns list of CliSchemaAssistant instances representing subassistants of given
+        superassistant, constructed from CLI schema stored in cache (refreshed if needed).
+
+        Args:
+            superassistant: superassistant (role) to get subassistants of
+        Returns:
+            list of CliSchemaAssistant instances or None if cache can't be used
+        """
+        if not settings.USE_CACHE:
+            return None
+        role = superassistant.name
+        dirs = [os.path.join(d, role) for d in cls.assistants_dirs]
+        try:
+            cch = cache.Cache.get_instance()
+            cch.refresh_role(role, cls.get_assistants_file_hierarchy(dirs))
+            schema = cch.get_cli_schema(role)
+        except BaseException as e:
+            logger.debug('Failed to use DevAssistant cachefile {0}: {1}'.format(
+                settings.CACHE_FILE, e))
+            return None
+        return [CliSchemaAssistant(name, s) for name, s in schema.items()]
+
     @classmethod
     def get_assistants_from_cache_hierarchy(cls, cache_hierarchy, superassistant,
                                             role=settings.DEFAULT_ASSISTANT_ROLE):
@@ -98,7 +124,8 @@ class YamlAssistantLoader(object):
 
     @classmethod
     def get_assistants_from_file_hierarchy(cls, file_hierarchy, superassistant,
-                                           role=settings.DEFAULT_ASSISTANT_ROLE):
+                                           role=settings.DEFAULT_ASSISTANT_ROLE,
+                                           loaded_yamls=None):
         """Accepts file_hierarch as returned by cls.get_assistant_file_hierarchy and returns
         instances of YamlAssistant for loaded files
 
@@ -106,15 +133,26 @@ class YamlAssistantLoader(object):
             file_hierarchy: structure as described in cls.get_assistants_file_hierarchy
             role: role of all assistants in this hierarchy (we could find
                   this out dynamically but it's not worth the pain)
+            loaded_yamls: {path: loaded yaml} of already loaded assistant files; if not
+                  given and settings.YAML_LOADING_PROCESSES > 1, all files in the hierarchy
+                  are loaded in parallel first
         Returns:
             list of top level assistants from given hierarchy; these assistants contain
             references to instances of their subassistants (and their subassistants, ...)
         """
         result = []
         warn_msg = 'Failed to load assistant {source}, skipping subassistants.'
+        if loaded_yamls is None:
+            loaded_yamls = {}
+            if settings.YAML_LOADING_PROCESSES > 1:
+                loaded_yamls = yaml_loader.YamlLoader.load_yamls_by_paths(
+                    cls.get_file_hierarchy_sources(file_hierarchy))
 
         for name, attrs in file_hierarchy.items():
-            loaded_yaml = yaml_loader.YamlLoader.load_yaml_by_path(attrs['source'])
+            if attrs['source'] in loaded_yamls:
+                loaded_yaml = loaded_yamls[attrs['source']]
+            else:
+                loaded_yaml = yaml_loader.YamlLoader.load_yaml_by_path(attrs['source'])
             if loaded_yaml is None:  # there was an error parsing yaml
                 logger.warning(warn_msg.format(source=attrs['source']))
                 continue
@@ -128,11 +166,22 @@ class YamlAssistantLoader(object):
                 continue
             ass._subassistants = cls.get_assistants_from_file_hierarchy(attrs['subhierarchy'],
                                                                         ass,
-                                                                        role=role)
+                                                                        role=role,
+                                                                        loaded_yamls=loaded_yamls)
             result.append(ass)
 
         return result
 
+    @classmethod
+    def get_file_hierarchy_sources(cls, file_hierarchy):
+        """Returns list of source files of all assistants in given file hierarchy
+        (as returned by cls.get_assistants_file_hierarchy), including subassistants."""
+        sources = []
+        for attrs in file_hierarchy.values():
+            sources.append(attrs['source'])
+            sources.extend(cls.get_file_hierarchy_sources(attrs['subhierarchy']))
+        return sources
+
     @classmethod
     def get_assistants_file_hierarchy(cls, dirs):
         """Returns assistants file hierarchy structure (see below) representing assistant
@@ -193,3 +242,32 @@ class YamlAssistantLoader(object):
             fully_loaded=fully_loaded, role=role)
 
         return assistant
+
+
+class CliSchemaAssistant(assistant_base.AssistantBase):
+    """Assistant constructed from CLI schema stored in cache (see devassistant.cache.cli_schema).
+    It only has the attributes needed to construct commandline interface; the actual
+    YamlAssistant is only loaded once an assistant is selected on commandline."""
+    def __init__(self, name, schema):
+        self.name = name
+        self.description = schema['description']
+        self._schema = schema
+
+    @property
+    def args(self):
+        if not hasattr(self, '_args'):
+            self._args = []
+            for arg_name, arg_params in self._schema['args']:
+                try:
+                    self._args.append(argument.Argument.construct_arg(arg_name,
+                                                                      dict(arg_params)))
+                except exceptions.ExecutionException:
+                    # the problem gets logged when the assistant is actually loaded
+                    pass
+        return self._args
+
+    def get_subassistants(self):
+        if not hasattr(self, '_subassistants'):
+            self._subassistants = [CliSchemaAssistant(name, s)
+                                   for name, s in self._schema['subassistants'].items()]
+        return self._subassistants
@@ -188,11 +188,27 @@ class YamlChecker(object):
                 if command_type.startswith('if ') or command_type.startswith('else ') or \
                    command_type.startswith('for ') or command_type.endswith('~'):
                     self._check_execution_section(path, command_type, command_input)
+                elif command_type == 'parallel':
+                    self._check_parallel_section(path, command_type, command_input)
                 else:
                     self._check_literal_section(path, command_type, command_input)
         else:  # expression
             pass  # TODO: check expression syntax here or leave it up for the actual run?
 
+    def _check_parallel_section(self, path, sectname, struct):
+        extra_info = '"parallel" command takes a list of execution sections or a mapping ' +\
+            'with such list under "sections" key.'
+        self._assert_struct_type(struct, sectname, (list, dict), path, extra_info)
+        if isinstance(struct, dict):
+            self._assert_key_in('sections', struct, sectname, path, extra_info)
+            path = path + [sectname]
+            sectname = 'sections'
+            struct = struct['sections']
+            self._assert_list(struct, sectname, path, extra_info)
+        path = path + [sectname]
+        for i, sect in enumerate(struct):
+            self._check_execution_section(path, 'section {0}'.format(i + 1), sect)
+
     def _check_literal_section(self, path, sectname, struct):
         # input section can be pretty much anything; we just want to check that when there's
         # a dict somewhere in the structure  and one of its members ends with execution flag,
@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 import os
 import six
 
@@ -10,6 +11,35 @@ except:
     from yaml import Loader
 
 from devassistant.logger import logger
+from devassistant import settings
+
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    scandir = None
+
+
+def _parse_yaml_file(path):
+    """Parses yaml file at given path; used by worker processes of YamlLoader.load_yamls_by_paths
+    (must be a module-level function, so that it can be pickled).
+
+    Returns:
+        tuple (path, loaded yaml or None, None or (line, column, problem) if there's an error)
+    """
+    try:
+        with open(path, 'r') as f:
+            return path, yaml.load(f, Loader=Loader) or {}, None
+    except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
+        return path, None, (e.problem_mark.line, e.problem_mark.column, e.problem)
+
+
+def stat_fingerprint(st):
+    """Returns fingerprint of a file with given stat result as [mtime_ns, size, inode].
+    If any of these change, the file has most likely been changed."""
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [mtime_ns, st.st_size, st.st_ino]
 
 
 class YamlLoader(object):
@@ -32,11 +62,78 @@ class YamlLoader(object):
                 yaml_files.extend(map(lambda x: os.path.join(dirname, x),
                                       filter(lambda x: x.endswith('.yaml'), files)))
 
-        for f in yaml_files:
-            loaded_yamls[f] = cls.load_yaml_by_path(f)
+        return cls.load_yamls_by_paths(yaml_files)
+
+    @classmethod
+    def load_yamls_by_paths(cls, paths, log_debug=False):
+        """Loads yaml files from given paths. If settings.YAML_LOADING_PROCESSES is greater
+        than 1 and there are enough files, they are parsed in parallel by a pool of processes.
+
+        Args:
+            paths: list of paths to load
+            log_debug: log all messages as debug
+        Returns:
+            dict of {path: loaded_yaml_structure}, the structure is None if there was
+            an error parsing the file
+        """
+        processes = settings.YAML_LOADING_PROCESSES
+        results = None
+        if processes > 1 and len(paths) > processes:
+            try:
+                pool = multiprocessing.Pool(processes)
+                try:
+                    results = pool.map(_parse_yaml_file, paths,
+                                       chunksize=max(1, len(paths) // (processes * 4)))
+                finally:
+                    pool.terminate()
+            except (OSError, ImportError) as e:
+                # e.g. no /dev/shm or no _multiprocessing module
+                logger.debug('Failed to load yaml files in parallel, loading serially: ' +
+                             str(e))
+        if results is None:
+            results = map(_parse_yaml_file, paths)
 
+        loaded_yamls = {}
+        for path, loaded, err in results:
+            if err is not None:
+                cls._log_yaml_error(path, err, log_debug)
+            loaded_yamls[path] = loaded
         return loaded_yamls
 
+    @classmethod
+    def get_yaml_fingerprints(cls, directory, recursive=False):
+        """Returns fingerprints (see stat_fingerprint) of all yaml files in given directory,
+        using just one directory scan (and one stat per file) without reading the files.
+
+        Args:
+            directory: directory to scan; nonexistent directory is treated as empty
+            recursive: whether to scan subdirectories, too
+        Returns:
+            dict of {fullpath: fingerprint}
+        """
+        fingerprints = {}
+        subdirs = []
+        try:
+            if scandir is not None:
+                for entry in scandir(directory):
+                    if entry.name.endswith('.yaml') and entry.is_file():
+                        fingerprints[entry.path] = stat_fingerprint(entry.stat())
+                    elif recursive and entry.is_dir():
+                        subdirs.append(entry.path)
+            else:
+                for name in os.listdir(directory):
+                    path = os.path.join(directory, name)
+                    if name.endswith('.yaml') and os.path.isfile(path):
+                        fingerprints[path] = stat_fingerprint(os.stat(path))
+                    elif recursive and os.path.isdir(path):
+                        subdirs.append(path)
+        except OSError:  # the directory doesn't exist or isn't readable
+            pass
+        for d in subdirs:
+            fingerprints.update(cls.get_yaml_fingerprints(d, recursive=True))
+
+        return fingerprints
+
     @classmethod
     def load_yaml_by_relpath(cls, directories, rel_path, log_debug=False):
         """Load a yaml file with path that is relative to one of given directories.
@@ -55,7 +152,7 @@ class YamlLoader(object):
             if os.path.exists(possible_path):
                 loaded = cls.load_yaml_by_path(possible_path, log_debug=log_debug)
                 if loaded is not None:
-                    return (possible_path, cls.load_yaml_by_path(possible_path))
+                    return (possible_path, loaded)
 
         return None
 
@@ -69,10 +166,12 @@ class YamlLoader(object):
             else:
                 return yaml.load(path, Loader=Loader) or {}
         except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
-            log_level = logging.DEBUG if log_debug else logging.WARNING
-            logger.log(log_level, 'Yaml error in {path} (line {ln}, column {col}): {err}'.
-                       format(path=path,
-                              ln=e.problem_mark.line,
-                              col=e.problem_mark.column,
-                              err=e.problem))
+            cls._log_yaml_error(path, (e.problem_mark.line, e.problem_mark.column, e.problem),
+                                log_debug)
             return None
+
+    @classmethod
+    def _log_yaml_error(cls, path, err, log_debug=False):
+        log_level = logging.DEBUG if log_debug else logging.WARNING
+        logger.log(log_level, 'Yaml error in {path} (line {ln}, column {col}): {err}'.
+                   format(path=path, ln=err[0], col=err[1], err=err[2]))
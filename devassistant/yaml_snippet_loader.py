@@ -1,4 +1,5 @@
 import os
+import threading
 
 from devassistant import exceptions
 from devassistant import yaml_loader
@@ -9,6 +10,18 @@ from devassistant import yaml_checker
 
 class YamlSnippetLoader(object):
     snippets_dirs = list(map(lambda x: os.path.join(x, 'snippets'), settings.DATA_DIRECTORIES))
+    # Snippets loaded during this DevAssistant invocation in the form of
+    # {(dotted name, tuple(snippets_dirs)):
+    #     (path, fingerprint of the file when it was loaded, Snippet object)}
+    # Every snippet file is therefore parsed only once, unless it changes. snippets_dirs
+    # are part of the key, since changing them may change which file the name refers to.
+    _snippets = {}
+    # guards _snippets, snippets are used by threads of "parallel" sections
+    _snippets_lock = threading.Lock()
+
+    @classmethod
+    def _key(cls, name):
+        return (name, tuple(cls.snippets_dirs))
 
     @classmethod
     def _create_snippet(cls, name, path, parsed_yaml):
@@ -19,18 +32,82 @@ class YamlSnippetLoader(object):
 
         return snip
 
+    @classmethod
+    def _fingerprint(cls, path):
+        try:
+            return yaml_loader.stat_fingerprint(os.stat(path))
+        except OSError:
+            return None
+
     @classmethod
     def get_snippet_by_name(cls, name):
-        """name is in dotted format, e.g. topsnippet.something.wantedsnippet"""
+        """name is in dotted format, e.g. topsnippet.something.wantedsnippet
+
+        The snippet is only loaded if it hasn't been loaded yet or if its file has changed
+        since it was loaded (which costs one stat call).
+        """
+        key = cls._key(name)
+        with cls._snippets_lock:
+            loaded = cls._snippets.get(key)
+        if loaded is not None:
+            path, fingerprint, snip = loaded
+            if cls._fingerprint(path) == fingerprint:
+                return snip
+            with cls._snippets_lock:
+                cls._snippets.pop(key, None)
+
         name_with_dir_separators = name.replace('.', os.path.sep)
-        loaded = yaml_loader.YamlLoader.load_yaml_by_relpath(cls.snippets_dirs,
-                                                             name_with_dir_separators + '.yaml')
-        if loaded:
-            return cls._create_snippet(name, *loaded)
+        for d in cls.snippets_dirs:
+            if d.startswith(os.path.expanduser('~')) and not os.path.exists(d):
+                os.makedirs(d)
+            path = os.path.join(d, name_with_dir_separators + '.yaml')
+            # get the fingerprint before parsing, so that we notice changes done meanwhile
+            fingerprint = cls._fingerprint(path)
+            if fingerprint is not None:
+                parsed_yaml = yaml_loader.YamlLoader.load_yaml_by_path(path)
+                if parsed_yaml is not None:
+                    snip = cls._create_snippet(name, path, parsed_yaml)
+                    with cls._snippets_lock:
+                        cls._snippets[key] = (path, fingerprint, snip)
+                    return snip
 
         raise exceptions.SnippetNotFoundException('no such snippet: {name}'.
                                                   format(name=name_with_dir_separators))
 
+    @classmethod
+    def preload(cls):
+        """Loads all snippets from all snippets dirs at once (in parallel, if
+        settings.YAML_LOADING_PROCESSES > 1), so that get_snippet_by_name doesn't need to
+        parse anything later. Malformed snippets are skipped here; get_snippet_by_name
+        reports the error when they're actually used.
+        """
+        found = []
+        seen_names = set()
+        for d in cls.snippets_dirs:
+            for path, fingerprint in sorted(
+                    yaml_loader.YamlLoader.get_yaml_fingerprints(d, recursive=True).items()):
+                name = os.path.splitext(path[len(d):].strip(os.path.sep))[0].\
+                    replace(os.path.sep, '.')
+                # the same snippet in more dirs => first dir wins, as in get_snippet_by_name
+                if name not in seen_names and \
+                        cls._snippets.get(cls._key(name), (None, None))[:2] != \
+                        (path, fingerprint):
+                    found.append((name, path, fingerprint))
+                seen_names.add(name)
+
+        loaded = yaml_loader.YamlLoader.load_yamls_by_paths([f[1] for f in found],
+                                                            log_debug=True)
+        for name, path, fingerprint in found:
+            if loaded[path] is None:
+                continue
+            try:
+                snip = cls._create_snippet(name, path, loaded[path])
+                with cls._snippets_lock:
+                    cls._snippets[cls._key(name)] = (path, fingerprint, snip)
+            except exceptions.YamlError:
+                with cls._snippets_lock:
+                    cls._snippets.pop(cls._key(name), None)
+
     @classmethod
     def get_all_snippets(cls):
         # maps dotted snippet names to Snippet objects, e.g. {'foo.bar': <Snippet object>, ...}
@@ -5,4 +5,6 @@ from devassistant import settings
 fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
 
 settings.CACHE_FILE = os.path.join(fixtures_dir, '.cache.yaml')
+settings.DEPS_CACHE_FILE = None
+settings.COMPLETION_INDEX_FILE = None
 settings.DATA_DIRECTORIES = [fixtures_dir]
@@ -23,3 +23,12 @@ class TestArgparseGenerator(object):
         assert parser.parse_args(['python', 'django'])
         assert parser.parse_args(['ruby', 'rails', 'crazy'])
         # can't test something that doesn't get parsed, because argparse would sys.exit :(
+
+    def test_generate_argument_parser_from_partial_tree(self):
+        full = self.ag.generate_argument_parser(self.chain)
+        partial = self.ag.generate_argument_parser(
+            MainA().get_partial_subassistant_tree(set(['python'])))
+        assert partial.parse_args(['python', 'django'])
+        # subparsers of selected assistants are complete, so is their help
+        get_python = lambda p: p._subparsers._group_actions[0].choices['python']
+        assert get_python(partial).format_help() == get_python(full).format_help()
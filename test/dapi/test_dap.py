@@ -15,6 +15,7 @@ except:
     except:
         from io import StringIO
 from devassistant.dapi import *
+from devassistant.dapi import dapicli
 from test import fixtures_dir
 from devassistant import utils
 
@@ -49,6 +49,15 @@ class TestAssistantBase(object):
         assert len(rails[1]) == 1
         assert self.get_sa_from_tuple_list('crazy', rails[1])
 
+    def test_get_partial_subassistant_tree_loads_only_named_assistants(self):
+        main, subas = MainA().get_partial_subassistant_tree(set(['ruby', 'crazy', 'django']))
+        assert main.name == MainA.name
+        assert self.get_sa_from_tuple_list('python', subas)[1] is None
+
+        ruby = self.get_sa_from_tuple_list('ruby', subas)
+        rails = self.get_sa_from_tuple_list('rails', ruby[1])
+        assert rails[1] is None
+
     def test_get_selected_subassistant_path_for_leaf(self):
         path_names = ['ruby', 'rails', 'crazy']
         args_dict = self.args_dict_from_names(path_names)
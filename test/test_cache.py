@@ -1,3 +1,4 @@
+import glob
 import os
 import platform
 import shutil
@@ -5,14 +6,19 @@ import time
 
 import pytest
 import yaml
+from flexmock import flexmock
 
 import devassistant
 
+from devassistant import cache
 from devassistant.cache import Cache
 from devassistant.exceptions import YamlTypeError
 from devassistant import settings
+from devassistant import yaml_loader
 from devassistant.yaml_assistant_loader import YamlAssistantLoader
+from devassistant.yaml_snippet_loader import YamlSnippetLoader
 
+from test import fixtures_dir
 from test.logger import LoggingHandler
 
 # the paths in this dicts are truncated to make tests pass in any location
@@ -24,7 +30,7 @@ correct_cache = \
                              'description': 'C Language Tool description...',
                              'fullname': 'C Language Tool'},
                    'snippets': {},
-                   'ctime': 'dontcheck',
+                   'fingerprint': 'dontcheck',
                    'source': 'test/fixtures/assistants/crt/c.yaml',
                    'subhierarchy': {'d': {'attrs': {'args': {'name': {'flags': ['-n',
                                                                                 '--name'],
@@ -36,7 +42,7 @@ correct_cache = \
                                                                           'gui_hints': {'default': '$(whoami)'}}},
                                                     'fullname': 'D Language Tool'},
                                           'snippets': {'snippet1': 'dontcheck'},
-                                          'ctime': 'dontcheck',
+                                          'fingerprint': 'dontcheck',
                                           'source': 'test/fixtures/assistants/crt/c/d.yaml',
                                           'subhierarchy': {}},
                                     'e': {'attrs': {'args': {'name': {'flags': ['-n',
@@ -44,14 +50,14 @@ correct_cache = \
                                                                       'help': 'Name of project to create'}},
                                                     'fullname': 'E Language Tool'},
                                           'snippets': {},
-                                          'ctime': 'dontcheck',
+                                          'fingerprint': 'dontcheck',
                                           'source': 'test/fixtures/assistants/crt/c/e.yaml',
                                           'subhierarchy': {}}}},
              'f': {'attrs': {'args': {'name': {'flags': ['-n', '--name'],
                                                'help': 'Name of project to create'}},
                              'fullname': 'F Language Tool'},
                    'snippets': {},
-                   'ctime': 'dontcheck',
+                   'fingerprint': 'dontcheck',
                    'source': 'test/fixtures/assistants/crt/f.yaml',
                    'subhierarchy': {'g': {'attrs': {'args': {'name': {'flags': ['-n',
                                                                                 '--name'],
@@ -59,7 +65,7 @@ correct_cache = \
                                                     'icon_path': '/foo/bar',
                                                     'fullname': 'G Language Tool'},
                                           'snippets': {},
-                                          'ctime': 'dontcheck',
+                                          'fingerprint': 'dontcheck',
                                           'source': 'test/fixtures/assistants/crt/f/g.yaml',
                                           'subhierarchy': {}}}}},
  'twk': {},
@@ -74,8 +80,13 @@ class TestCache(object):
     wait = 1 if platform.system() == 'Darwin' else 0.1
 
     def setup_method(self, method):
-        if os.path.exists(self.cf):
-            os.unlink(self.cf)
+        for f in glob.glob(os.path.splitext(self.cf)[0] + '*'):
+            os.unlink(f)
+        # snippets_dirs are computed when yaml_snippet_loader is first imported, which may
+        #  happen before test/__init__ sets DATA_DIRECTORIES (depending on test order)
+        YamlSnippetLoader.snippets_dirs = [os.path.join(fixtures_dir, 'snippets')]
+        YamlSnippetLoader._snippets = {}
+        Cache._instances = {}
         self.cch = Cache()
         self.tlh = LoggingHandler.create_fresh_handler()
 
@@ -107,8 +118,13 @@ class TestCache(object):
     def touch_file(self, path):
         os.utime(self.datafile_path(path), None)
 
-    def assert_cache_newer(self, path):
-        assert os.path.getctime(self.cch.cache_file) >= os.path.getctime(self.datafile_path(path))
+    def assert_cache_newer(self, path, role='crt'):
+        assert os.path.getctime(self.cch.segment_file(role)) >= \
+            os.path.getctime(self.datafile_path(path))
+
+    def cache_files_ctimes(self):
+        files = [self.cch.cache_file] + [self.cch.segment_file(r) for r in settings.ASSISTANT_ROLES]
+        return [os.path.getctime(f) for f in files]
 
     def assert_cache_content(self, expected, actual):
         assert len(expected) == len(actual)
@@ -128,6 +144,11 @@ class TestCache(object):
         self.create_or_refresh_cache()
         self.assert_cache_content(correct_cache, self.cch.cache)
 
+    def test_cold_cache_loaded_in_parallel(self, monkeypatch):
+        monkeypatch.setattr(settings, 'YAML_LOADING_PROCESSES', 2)
+        self.create_or_refresh_cache()
+        self.assert_cache_content(correct_cache, self.cch.cache)
+
     def test_cache_refreshes_if_assistant_touched(self):
         self.create_or_refresh_cache()
         time.sleep(self.wait)
@@ -141,7 +162,6 @@ class TestCache(object):
         self.create_or_refresh_cache()
         time.sleep(self.wait)
 
-        self.cch.snip_ctimes = {}
         p = 'snippets/snippet1.yaml'
         self.touch_file(p)
         self.create_or_refresh_cache()
@@ -149,10 +169,62 @@ class TestCache(object):
 
     def test_cache_doesnt_refresh_if_not_needed(self):
         self.create_or_refresh_cache()
-        created = os.path.getctime(self.cch.cache_file)
+        created = self.cache_files_ctimes()
+        time.sleep(self.wait)
+        self.create_or_refresh_cache()
+        assert created == self.cache_files_ctimes()
+
+    def test_cache_validation_doesnt_load_yamls(self):
+        self.create_or_refresh_cache()
+        self.cch = Cache()
+        flexmock(yaml_loader.YamlLoader).should_receive('load_yaml_by_path').never()
+        flexmock(yaml_loader.YamlLoader).should_receive('load_yaml_by_relpath').never()
+        self.create_or_refresh_cache()
+        self.assert_cache_content(correct_cache, self.cch.cache)
+
+    def test_cache_only_rewrites_changed_role(self):
+        self.create_or_refresh_cache()
+        created = os.path.getctime(self.cch.segment_file('twk'))
         time.sleep(self.wait)
+        self.touch_file('assistants/crt/c.yaml')
+        self.create_or_refresh_cache()
+        self.assert_cache_newer('assistants/crt/c.yaml')
+        assert created == os.path.getctime(self.cch.segment_file('twk'))
+
+    def test_cache_roles_loaded_from_segments(self):
+        self.create_or_refresh_cache()
+        self.cch = Cache()
+        assert set(self.cch.cache.keys()) == set(['version'])
+        self.create_or_refresh_cache()
+        self.assert_cache_content(correct_cache, self.cch.cache)
+
+    def test_cli_schema_stored_in_segment(self):
+        self.create_or_refresh_cache()
+        segment = cache.load_cache_file(self.cch.segment_file('crt'))
+        assert segment['cli'] == cache.cli_schema(self.cch.cache['crt'])
+        assert sorted(segment['cli']) == ['c', 'f']
+        assert segment['cli']['c']['description'] == 'C Language Tool description...'
+        assert segment['cli']['c']['args'] == \
+            [['foo', {'flags': ['-f', '--foo'], 'help': 'Help for foo parameter.'}]]
+        assert sorted(segment['cli']['c']['subassistants']) == ['d', 'e']
+
+    def test_cli_schema_refreshed_with_cache(self):
+        self.create_or_refresh_cache()
+        self.addme_copy('addme.yaml', 'assistants/crt/addme.yaml')
+        self.addme_copy('addme_snippet.yaml', 'snippets/addme_snippet.yaml')
+        self.create_or_refresh_cache()
+        args = self.cch.get_cli_schema('crt')['addme']['args']
+        assert args[0][1]['flags'] == ['-x']
+        self.cch = Cache()
         self.create_or_refresh_cache()
-        assert created == os.path.getctime(self.cch.cache_file)
+        assert self.cch.get_cli_schema('crt')['addme']['args'] == args
+
+    def test_cache_instance_shared(self):
+        assert Cache.get_instance() is Cache.get_instance()
+        os.unlink(Cache.get_instance().cache_file)
+        cch = Cache.get_instance()
+        assert cch is Cache.get_instance()
+        assert os.path.exists(cch.cache_file)
 
     def test_cache_reacts_to_new_changed_removed_assistants(self):
         self.create_or_refresh_cache()
@@ -175,12 +247,8 @@ class TestCache(object):
         assert addme['attrs']['fullname'] == 'Fullname changed!'
 
         # change current snippet (will change argument flag)
-        # snippets are cached during one startup => reset snippet cache manually
-        # TODO: fix this ^^
         time.sleep(self.wait)
         self.addme_copy('addme_snippet_changed.yaml', 'snippets/addme_snippet.yaml')
-        from devassistant import yaml_snippet_loader; yaml_snippet_loader.YamlSnippetLoader._snippets = {}
-        self.cch.snip_ctimes = {}
         self.create_or_refresh_cache()
         addme = self.cch.cache['crt']['addme']
         assert addme['attrs']['args']['some_arg']['flags'] == ['-z']
@@ -218,3 +286,84 @@ class TestCache(object):
         # make sure that there are only DEBUG messages logged
         for msg in self.tlh.msgs:
             assert msg[0] == 'DEBUG'
+
+
+class TestCacheFormats(object):
+    def big_cache(self, n=400):
+        ass = {'attrs': {'args': {'name': {'flags': ['-n', '--name'],
+                                           'help': 'Name of project to create'},
+                                  'github': {'flags': ['-g', '--github'],
+                                             'help': 'Create Github repo', 'action': 'store_true'}},
+                         'description': 'Some assistant description ' * 5,
+                         'fullname': 'Some Assistant'},
+               'snippets': {'common_args': [1400000000000000000, 2048, 123456]},
+               'fingerprint': [1400000000000000000, 1024, 123457],
+               'source': '/usr/share/devassistant/assistants/crt/some/assistant.yaml',
+               'subhierarchy': {}}
+        c = {'version': devassistant.__version__}
+        for role in settings.ASSISTANT_ROLES:
+            c[role] = dict(('a{0}'.format(i), dict(ass, subhierarchy={'sub': dict(ass)}))
+                           for i in range(n // len(settings.ASSISTANT_ROLES)))
+        return c
+
+    @pytest.mark.parametrize('binary', [True, False])
+    def test_dump_and_load(self, tmpdir, binary):
+        path = str(tmpdir.join('cache'))
+        c = self.big_cache(n=8)
+        cache.dump_cache_file(path, c, binary=binary)
+        assert cache.load_cache_file(path) == c
+        # no temporary files are left behind
+        assert os.listdir(str(tmpdir)) == ['cache']
+
+    def test_binary_cache_with_different_header_is_ignored(self, tmpdir):
+        path = tmpdir.join('cache')
+        path.write_binary(b'DACACHE 0 2.7 0.0.0\n' + b'garbage')
+        assert cache.load_cache_file(str(path)) == {}
+
+    def test_yaml_cache_converted_to_binary(self, tmpdir):
+        yaml_path = str(tmpdir.join('.cache.yaml'))
+        c = self.big_cache(n=4)
+        cache.dump_cache_file(yaml_path, c, binary=False)
+        cch = Cache(cache_file=yaml_path, cache_format='binary')
+        assert cch.cache_file == str(tmpdir.join('.cache.bin'))
+        assert cch.cache == c
+        with open(cch.cache_file, 'rb') as f:
+            assert f.readline() == cache.BINARY_CACHE_HEADER
+
+    @pytest.mark.parametrize('content', [
+        b'',
+        b'\x80\x02}q\x00(X',
+        b'garbage',
+        # references to missing globals raise AttributeError/ImportError
+        b'\x80\x02cdevassistant.cache\nNoSuchThing\nq\x00.',
+        b'\x80\x02cdevassistant_no_such_module\nfoo\nq\x00.',
+        # unknown memo key (KeyError on Python 2)
+        b'\x80\x02h\x05.',
+    ])
+    def test_broken_binary_cache_is_stale(self, tmpdir, content):
+        path = tmpdir.join('cache')
+        path.write_binary(cache.BINARY_CACHE_HEADER + content)
+        assert cache.load_cache_file(str(path)) == {}
+
+    @pytest.mark.skipif(not os.environ.get('DEVASSISTANT_BENCHMARK'),
+                        reason='Benchmark, set DEVASSISTANT_BENCHMARK=1 to run it')
+    def test_startup_benchmark(self, tmpdir):
+        """Compares time of loading a cache with 400 assistants in both formats. Only
+        prints the times (run with "-s" to see them), since they depend on the machine."""
+        c = self.big_cache()
+        times = {}
+        for fmt in ['binary', 'yaml']:
+            path = str(tmpdir.join('cache.' + fmt))
+            cache.dump_cache_file(path, c, binary=fmt == 'binary')
+            start = time.time()
+            for i in range(3):
+                assert cache.load_cache_file(path) == c
+            times[fmt] = (time.time() - start) / 3
+        print('Cache load times: binary {binary:.4f}s, yaml {yaml:.4f}s'.format(**times))
+
+    def test_broken_binary_cache_rebuilt(self, tmpdir):
+        path = tmpdir.join('.cache.bin')
+        path.write_binary(cache.BINARY_CACHE_HEADER + b'\x80\x02}q')
+        cch = Cache(cache_file=str(path), cache_format='binary')
+        assert cch.cache == {'version': devassistant.__version__}
+        assert cache.load_cache_file(str(path)) == {'version': devassistant.__version__}
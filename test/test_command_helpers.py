@@ -3,11 +3,13 @@ import logging
 import os
 import sys
 import tempfile
+import time
 
 from flexmock import flexmock
 import pytest
 
-from devassistant.command_helpers import ClHelper, CliDialogHelper
+from devassistant import settings
+from devassistant.command_helpers import ClHelper, CliDialogHelper, OutputCapture
 from devassistant.exceptions import ClException
 
 from test.logger import LoggingHandler
@@ -24,6 +26,22 @@ class TestClHelper(object):
         ClHelper.command_processors.pop('foo')
         assert out == 'bar'
 
+    def test_thread_command_processors(self):
+        ClHelper.set_thread_command_processors({'foo': lambda c: 'FOO=bar && ' + c})
+        try:
+            out = ClHelper.run_command('echo $FOO')
+        finally:
+            ClHelper.set_thread_command_processors(None)
+        assert out == 'bar'
+        assert ClHelper.get_command_processors() is ClHelper.command_processors
+
+    def test_reap_background_commands(self):
+        handle = ClHelper.run_command_async('sleep 100')
+        start = time.time()
+        ClHelper.reap_background_commands()
+        assert time.time() - start < 10
+        assert handle not in ClHelper.background_commands
+
     def test_output_from_process_with_closed_stdout(self):
         """Previously, DevAssistant occasionally failed in Travis because of race condition in
         ClHelper.run_command. The cause of this was that on very slow machines the subprocess
@@ -85,6 +103,56 @@ class TestClHelper(object):
         assert ('DEBUG', '0') in self.tlh.msgs
 
 
+    def test_multibyte_chars_split_between_chunks(self):
+        flexmock(ClHelper, read_chunk_size=1)
+        assert ClHelper.run_command(u'echo "\u00e1\u00e9"') == u'\u00e1\u00e9'
+
+    def test_output_callback_gets_all_lines(self):
+        lines = []
+        out = ClHelper.run_command('printf "foo\\n\\nbar"', output_callback=lines.append)
+        assert out == 'foo\n\nbar'
+        assert lines == ['foo', '', 'bar']
+
+    def test_long_output_is_spooled(self):
+        flexmock(settings, CL_OUTPUT_MEMORY_LIMIT=100)
+        out = ClHelper.run_command('seq 1 1000')
+        assert out == '\n'.join([str(i) for i in range(1, 1001)])
+        assert not [m for m in self.tlh.msgs if 'truncated' in m[1]]
+
+    def test_output_tail_size(self):
+        out = ClHelper.run_command('seq 1 1000', output_tail_size=8)
+        assert out == '999\n1000'
+        assert ('DEBUG', 'Output truncated to last 8 characters.') in self.tlh.msgs
+
+
+class TestOutputCapture(object):
+    def test_not_spooled_under_limit(self):
+        capture = OutputCapture(max_size=10)
+        capture.add_lines(['foo', 'bar'])
+        assert not capture.is_spooled()
+        assert capture.getvalue() == capture.tail() == 'foo\nbar'
+
+    def test_spooled_over_limit(self):
+        capture = OutputCapture(max_size=10)
+        capture.add_lines(['foo', 'bar'])
+        capture.add_lines(['baz', 'spam'])
+        capture.add_lines(['eggs'])
+        assert capture.is_spooled()
+        assert capture.tail() == 'spam\neggs'
+        assert capture.getvalue() == 'foo\nbar\nbaz\nspam\neggs'
+        assert not capture.truncated
+        capture.close()
+        assert not capture.is_spooled()
+
+    def test_truncated_without_spool(self):
+        capture = OutputCapture(max_size=10, spool=False)
+        capture.add_lines(['foo', 'bar', 'baz', 'spam'])
+        capture.add_lines(['abcdefghijklmnop'])
+        assert not capture.is_spooled()
+        assert capture.tail() == 'ghijklmnop'
+        assert capture.truncated
+
+
 class TestCliDialogHelper(object):
     def setup_method(self, method):
         self.tlh = LoggingHandler()
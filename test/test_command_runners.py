@@ -16,7 +16,7 @@ from devassistant.command_runners import AskCommandRunner, ClCommandRunner, \
     EnvCommandRunner, DockerCommandRunner, DotDevassistantCommandRunner, \
     GitHubCommandRunner
 # also import just command_runners to have access to command_runners.command_runners
-from devassistant import command_runners, lang, utils
+from devassistant import command_runners, lang, settings, utils
 from devassistant.exceptions import CommandException, RunException
 from devassistant.lang import Command
 from devassistant.yaml_assistant import YamlAssistant
@@ -26,6 +26,50 @@ from test.logger import LoggingHandler
 class CreatorAssistant(AssistantBase):
     name = 'crt'
 
+class TestGetCommandRunners(object):
+
+    def setup_method(self, method):
+        self.old_command_runners = command_runners.command_runners
+        command_runners.command_runners = copy.deepcopy(self.old_command_runners)
+
+    def teardown_method(self, method):
+        command_runners.command_runners = self.old_command_runners
+
+    def test_only_possible_runners(self):
+        assert command_runners.get_command_runners('', 'cl_i') == [ClCommandRunner]
+        assert command_runners.get_command_runners('', 'ask_input') == [AskCommandRunner]
+        assert command_runners.get_command_runners('', 'nonexistent') == []
+        assert command_runners.get_command_runners('nonexistent', 'cl') == []
+
+    def test_later_registered_runner_overrides(self):
+        class MyClCommandRunner(ClCommandRunner):
+            @classmethod
+            def matches(cls, c):
+                return c.comm_type == 'cl' and c.comm == 'mine'
+
+            def run(self):
+                return (True, 'mine')
+
+        class MyLogCommandRunner(command_runners.CommandRunner):
+            comm_types = ['log_i']
+
+            def run(self):
+                return (True, 'log')
+
+        assert command_runners.get_command_runners('', 'cl') == [ClCommandRunner]
+        command_runners.register_command_runner(MyClCommandRunner)
+        command_runners.register_command_runner(MyLogCommandRunner)
+
+        # runner that only implements matches() is asked about every command
+        assert command_runners.get_command_runners('', 'cl') == \
+            [MyClCommandRunner, ClCommandRunner]
+        assert command_runners.get_command_runners('', 'log_i') == \
+            [MyLogCommandRunner, MyClCommandRunner, LogCommandRunner]
+        assert Command('cl', 'mine').run() == (True, 'mine')
+        assert Command('cl', 'echo theirs').run() == (True, 'theirs')
+        assert Command('log_i', 'foo').run() == (True, 'log')
+
+
 class TestAskCommandRunner(object):
     # There is mocking code duplication, because (at least) with flexmock 0.9.6
     # and pytest 2.4.2, the mocking in setup_method isn't applied in test
@@ -177,6 +221,29 @@ class TestUseCommandRunner(object):
         flexmock(lang).should_receive('run_section').with_args(list, Matcher())
         com.run()
 
+    def test_run_doesnt_change_callers_context(self):
+        kwargs = {'foo': 'bar',
+                  '__env__': {'FOO': 'bar'},
+                  '__files__': [{}],
+                  '__files_dir__': [''],
+                  '__sourcefiles__': [''],
+                  '__assistant__': self.ass['leaf']}
+
+        def run_section(section, ctxt, runner=None):
+            assert ctxt['foo'] == 'bar'
+            ctxt['foo'] = 'baz'
+            ctxt['spam'] = 'eggs'
+            ctxt['__env__']['FOO'] = 'baz'
+            return (True, '')
+
+        flexmock(lang).should_receive('run_section').replace_with(run_section)
+        Command('use', 'snippet1.run', kwargs).run()
+        assert kwargs['foo'] == 'bar'
+        assert 'spam' not in kwargs
+        assert kwargs['__env__'] == {'FOO': 'bar'}
+        assert kwargs['__files__'] == [{}]
+        assert len(kwargs['__sourcefiles__']) == 1
+
 
 class TestClCommandRunner(object):
     def setup_method(self, method):
@@ -209,6 +276,48 @@ class TestClCommandRunner(object):
             kwargs={'__env__': {'DEVASSISTANTTESTFOO': 'foo'}})).run()
         assert ('INFO', 'foo') in self.tlh.msgs
 
+    def test_t_flag_keeps_only_tail_of_output(self):
+        flexmock(settings, CL_OUTPUT_TAIL_SIZE=10)
+        res = self.cl(Command('cl_it', 'seq 1 100')).run()
+        assert res == (True, '98\n99\n100')
+        # the whole output is still logged
+        assert ('INFO', '1') in self.tlh.msgs
+
+    def test_a_flag_runs_in_background(self):
+        res = self.cl(Command('cl_a', 'echo foo')).run()
+        assert res[0] is True
+        assert res[1] in ClHelper.background_commands
+        assert Command('wait', '$h', kwargs={'h': res[1]}).run() == (True, 'foo')
+        assert res[1] not in ClHelper.background_commands
+
+
+class TestWaitCommandRunner(object):
+    def setup_method(self, method):
+        self.tlh = LoggingHandler.create_fresh_handler()
+
+    def start(self, cmd):
+        return ClCommandRunner(Command('cl_a', cmd)).run()[1]
+
+    def test_wait_for_more_commands(self):
+        handles = [self.start('echo foo'), self.start('echo bar')]
+        assert Command('wait', handles).run() == (True, ['foo', 'bar'])
+
+    def test_wait_raises_when_command_fails(self):
+        handles = [self.start('echo foo; false'), self.start('echo bar')]
+        with pytest.raises(RunException) as e:
+            Command('wait', handles).run()
+        assert e.value.output == 'foo'
+        # commands are waited for even after one of them failed
+        assert not set(handles) & set(ClHelper.background_commands)
+
+    def test_wait_p_passes_even_if_command_fails(self):
+        h = self.start('echo foo; false')
+        assert Command('wait_p', h).run() == (False, 'foo')
+
+    def test_wait_for_unknown_handle(self):
+        with pytest.raises(CommandException):
+            Command('wait', 'foo').run()
+
 
 class TestDependenciesCommandRunner(object):
     pass
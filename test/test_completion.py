@@ -0,0 +1,100 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+from flexmock import flexmock
+
+from devassistant import actions
+from devassistant import completion
+from devassistant import settings
+from devassistant.cli.cli_runner import CliRunner
+
+
+class TestCompletion(object):
+
+    def setup_method(self, method):
+        self.datadir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(os.path.dirname(__file__), 'fixtures', 'assistants'),
+                        os.path.join(self.datadir, 'assistants'))
+        self.old_data_directories = settings.DATA_DIRECTORIES
+        settings.DATA_DIRECTORIES = [self.datadir]
+        settings.COMPLETION_INDEX_FILE = os.path.join(self.datadir, 'index.json')
+        self.index = {'root': ['create', '--help'],
+                      'elems': [actions.AutoCompleteAction._get_index_node(
+                          actions.HelpAction)]}
+
+    def teardown_method(self, method):
+        settings.DATA_DIRECTORIES = self.old_data_directories
+        settings.COMPLETION_INDEX_FILE = None
+        shutil.rmtree(self.datadir)
+
+    def test_index_roundtrip(self):
+        completion.write_index(self.index)
+        loaded = completion.load_index()
+        assert loaded['root'] == self.index['root']
+        assert loaded['elems'] == self.index['elems']
+
+    def test_index_stale_when_assistant_added(self):
+        completion.write_index(self.index)
+        crt = os.path.join(self.datadir, 'assistants', 'crt')
+        open(os.path.join(crt, 'newassistant.yaml'), 'w').close()
+        assert completion.load_index() is None
+
+    def test_index_stale_when_assistant_replaced(self):
+        completion.write_index(self.index)
+        # editors usually save files by writing a new file and renaming it
+        path = os.path.join(self.datadir, 'assistants', 'crt', 'c.yaml')
+        with open(path + '.new', 'w') as f:
+            f.write('description: changed\n')
+        os.rename(path + '.new', path)
+        assert completion.load_index() is None
+
+    def test_index_stale_when_subdirectory_added(self):
+        completion.write_index(self.index)
+        os.mkdir(os.path.join(self.datadir, 'snippets'))
+        assert completion.load_index() is None
+
+    def test_index_written_atomically(self):
+        completion.write_index(self.index)
+        flexmock(completion.json).should_receive('dump').and_raise(IOError)
+        completion.write_index(dict(self.index, root=[]))
+        # the old index is untouched and no temporary file is left behind
+        assert completion.load_index()['root'] == self.index['root']
+        assert sorted(os.listdir(self.datadir)) == ['assistants', 'index.json']
+
+    def test_index_stale_with_other_version(self):
+        completion.write_index(self.index)
+        flexmock(completion, __version__='0.0.0')
+        assert completion.load_index() is None
+
+    def test_index_removed(self):
+        completion.write_index(self.index)
+        completion.remove_index()
+        assert completion.load_index() is None
+
+    def test_complete_same_as_action(self, capsys):
+        aca = actions.AutoCompleteAction(path='crt python')
+        aca.run()
+        stdout, _ = capsys.readouterr()
+        index = completion.load_index()
+        assert index is not None
+        assert ' '.join(completion.complete(index, ['crt', 'python'])) == stdout.strip()
+
+    @pytest.mark.parametrize('path', ['', '--debug', 'crt', 'help', 'foo bar'])
+    def test_cli_runner_answers_from_index(self, path, capsys):
+        actions.AutoCompleteAction(path=path).run()
+        expected, _ = capsys.readouterr()
+        flexmock(sys, argv=['da', 'autocomplete', path])
+        # loading assistants again would mean that the index wasn't used
+        flexmock(actions.AutoCompleteAction).should_receive('__init__').never()
+        CliRunner.run()
+        stdout, _ = capsys.readouterr()
+        assert stdout == expected
+
+    def test_only_completion_answered_from_index(self):
+        completion.write_index(self.index)
+        assert not completion.answer_from_index([])
+        assert not completion.answer_from_index(['help'])
+        assert not completion.answer_from_index(['autocomplete', 'crt', 'python'])
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# modules that are slow to import and are only needed by some commands/actions, so they
+#  must not be imported on DevAssistant startup
+heavy_modules = ['requests', 'jinja2', 'dapp', 'github', 'docker', 'devassistant.dapi',
+                 'devassistant.dapi.dapicli']
+
+
+def imported_modules(statement):
+    """Runs given statement in a new interpreter with "-X importtime" and returns dict
+    {module name: cumulative import time in microseconds}"""
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    assert proc.returncode == 0, err
+    modules = {}
+    for line in err.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime needs Python >= 3.7')
+class TestImportTime(object):
+
+    @pytest.mark.parametrize('module', ['devassistant.cli.cli_runner',
+                                        'devassistant.actions',
+                                        'devassistant.command_runners'])
+    def test_heavy_modules_not_imported(self, module):
+        modules = imported_modules('import {0}'.format(module))
+        assert module in modules
+        assert not [m for m in heavy_modules if m in modules]
+
+    @pytest.mark.parametrize('module', ['devassistant.completion',
+                                        'devassistant.cli.cli_runner'])
+    def test_completion_imports_nothing_heavy(self, module):
+        modules = imported_modules('import {0}'.format(module))
+        # answering completion must not even need to load assistants
+        assert not [m for m in modules if m in heavy_modules + ['yaml', 'devassistant.cache']]
@@ -1,11 +1,17 @@
+import copy
 import pytest
 import os
 import re
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
 
+from devassistant import lang
+from devassistant import settings
 from devassistant.exceptions import YamlSyntaxError
-from devassistant.lang import Command, evaluate_expression, exceptions, \
+from devassistant.lang import ChainedContext, Command, Interpreter, evaluate_expression, exceptions, \
     dependencies_section, format_str, get_var_name,is_var, run_section, parse_for, \
-    get_catch_vars
+    get_catch_vars, get_parallel_args
 
 from test.logger import LoggingHandler
 # TODO: some of the test methods may need splitting into separate classes according to methods
@@ -24,6 +30,48 @@ class TestCommand(object):
         assert Command('log_i', 'foo').input_res == 'foo'
 
 
+class TestChainedContext(object):
+    def setup_method(self, method):
+        self.parent = {'foo': 'bar', 'spam': 'eggs'}
+        self.ctxt = ChainedContext(self.parent, {'local': 'val'})
+
+    def test_reads_fall_through(self):
+        assert self.ctxt['foo'] == 'bar'
+        assert self.ctxt['local'] == 'val'
+        assert self.ctxt.get('nonexistent') is None
+        assert sorted(self.ctxt.keys()) == ['foo', 'local', 'spam']
+        assert len(self.ctxt) == 3
+
+    def test_writes_and_deletes_are_local(self):
+        self.ctxt['foo'] = 'baz'
+        del self.ctxt['spam']
+        assert self.ctxt['foo'] == 'baz'
+        assert 'spam' not in self.ctxt
+        with pytest.raises(KeyError):
+            self.ctxt['spam']
+        assert dict(self.ctxt.items()) == {'foo': 'baz', 'local': 'val'}
+        assert self.parent == {'foo': 'bar', 'spam': 'eggs'}
+        self.ctxt['spam'] = 'ham'
+        assert self.ctxt['spam'] == 'ham'
+
+    def test_nested(self):
+        child = ChainedContext(self.ctxt)
+        child['x'] = 'y'
+        assert child['foo'] == 'bar'
+        assert 'x' not in self.ctxt
+
+    def test_deepcopy(self):
+        self.parent['list'] = [1]
+        c = copy.deepcopy(self.ctxt)
+        assert type(c) == dict
+        c['list'].append(2)
+        assert self.parent['list'] == [1]
+
+    def test_format_str_and_evaluate(self):
+        assert format_str('$foo $local', self.ctxt) == 'bar val'
+        assert evaluate_expression('"$foo"', self.ctxt) == (True, 'bar')
+
+
 class TestDependenciesSection(object):
     @pytest.mark.parametrize('deps, kwargs, result', [
         # simple case
@@ -146,6 +194,11 @@ class TestEvaluate(object):
         assert evaluate_expression('"$empty"', self.names) == (False, "")
         assert evaluate_expression('"$true"', self.names) == (True, "True")
 
+    def test_variable_substitution_longest_name_wins(self):
+        names = {'foo': 'a', 'foobar': 'b', 'f': 'c'}
+        assert evaluate_expression('"$foobar $foob $foo$f $fx $x"', names) == \
+            (True, 'b ab ac cx $x')
+
     def test_complex_expression(self):
         assert evaluate_expression('defined $empty or $empty and \
                                     $(echo -e foo bar "and also baz") or "else $nonempty"',
@@ -177,6 +230,31 @@ class TestEvaluate(object):
         res = evaluate_expression('$(echo $DEVASSISTANTTESTFOO)', {'DEVASSISTANTTESTFOO': 'foo'})
         assert res == (True, 'foo')
 
+    def test_expression_parsed_only_once(self):
+        Interpreter.clear_cache()
+        assert evaluate_expression('$nonempty and "$nonempty2"', self.names) == (True, 'bar')
+        assert evaluate_expression('$nonempty and "$nonempty2"', {'nonempty2': 'x'}) == \
+            (False, '')
+        assert Interpreter.cache_info() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    def test_expression_cache_from_more_threads(self):
+        Interpreter.clear_cache()
+        exprs = ['$nonempty and "{0}"'.format(i) for i in range(20)]
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda e: evaluate_expression(e, self.names), exprs * 10)
+        finally:
+            pool.close()
+            pool.join()
+        assert results == [(True, str(i)) for i in range(20)] * 10
+        info = Interpreter.cache_info()
+        assert info['hits'] + info['misses'] == 200
+        assert info['size'] == 20
+
+    def test_shell_in_parsed_expression_runs_on_every_evaluation(self):
+        assert evaluate_expression('$(echo $foo)', {'foo': 'spam'}) == (True, 'spam')
+        assert evaluate_expression('$(echo $foo)', {'foo': 'eggs'}) == (True, 'eggs')
+
 
 class TestRunSection(object):
     def setup_method(self, method):
@@ -433,6 +511,86 @@ class TestRunSection(object):
         assert res[1] == ''
 
 
+class TestParallelSection(object):
+    def setup_method(self, method):
+        self.tlh = LoggingHandler.create_fresh_handler()
+
+    @pytest.mark.parametrize('input, output', [
+        ([[{'log_i': 'a'}]], ([[{'log_i': 'a'}]], settings.PARALLEL_MAX_WORKERS, [], False)),
+        ({'sections': [], 'max_workers': 2, 'results': ['$a', '${b}'], 'collect_errors': True},
+            ([], 2, ['a', 'b'], True)),
+        ({'sections': [], 'max_workers': '$n'}, ([], 3, [], False)),
+    ])
+    def test_get_parallel_args_ok(self, input, output):
+        assert get_parallel_args(input, {'n': 3}) == output
+
+    @pytest.mark.parametrize('input', [
+        'foo',
+        {'max_workers': 2},
+        {'sections': [], 'max_workers': 0},
+        {'sections': [], 'max_workers': 'foo'},
+    ])
+    def test_get_parallel_args_malformed(self, input):
+        with pytest.raises(YamlSyntaxError):
+            get_parallel_args(input, {})
+
+    def test_parallel_runs_sections_concurrently(self):
+        # each section waits for the other one, so this would deadlock if run serially
+        fifo_dir = tempfile.mkdtemp()
+        try:
+            fifo = os.path.join(fifo_dir, 'fifo')
+            os.mkfifo(fifo)
+            kwargs = {'fifo': fifo}
+            res = run_section([{'parallel': [[{'$a~': '$(echo foo > $fifo)'}],
+                                             [{'$b~': '$(cat $fifo)'}]]}],
+                              kwargs)
+        finally:
+            shutil.rmtree(fifo_dir)
+        assert list(res) == [True, ['', 'foo']]
+
+    def test_parallel_merges_only_results(self):
+        kwargs = {'a': 'orig', 'c': 'orig'}
+        run_section([{'parallel': {'sections': [[{'$a': 'first'}, {'$c': 'changed'}],
+                                                [{'$b': 'second'}],
+                                                [{'log_i': 'no change'}]],
+                                   'results': ['$a', '$b']}}],
+                    kwargs)
+        assert kwargs['a'] == 'first'
+        assert kwargs['b'] == 'second'
+        assert kwargs['c'] == 'orig'
+
+    def test_parallel_sections_dont_share_special_values(self):
+        kwargs = {'__files__': [{}]}
+        run_section([{'parallel': [[{'$__files__': ['changed']}]]}], kwargs)
+        assert kwargs['__files__'] == [{}]
+
+    def test_parallel_fails_fast(self):
+        with pytest.raises(exceptions.ClException):
+            run_section([{'parallel': {'sections': [[{'cl': 'false'}],
+                                                    [{'cl': 'false'}, {'$a': 'foo'}]],
+                                       'results': ['$a'],
+                                       'max_workers': 1}}],
+                        {})
+
+    def test_parallel_collect_errors(self):
+        kwargs = {}
+        with pytest.raises(exceptions.RunException) as e:
+            run_section([{'parallel': {'sections': [[{'cl': 'false'}],
+                                                    [{'$a': 'foo'}],
+                                                    [{'cl': 'false'}]],
+                                       'results': ['$a'],
+                                       'collect_errors': True,
+                                       'max_workers': 1}}],
+                        kwargs)
+        assert '2 of 3 parallel sections failed' in str(e.value)
+        assert kwargs['a'] == 'foo'
+
+    def test_parallel_with_catch(self):
+        kwargs = {}
+        run_section([{'catch $was_exc, $exc': [{'parallel': [[{'cl': 'false'}]]}]}], kwargs)
+        assert kwargs['was_exc'] is True
+
+
 class TestIsVar(object):
     @pytest.mark.parametrize(('tested', 'expected'), [
         ('$normal', True),
@@ -491,6 +649,40 @@ class TestFormatStr(object):
         c = "  eggs   spam    beans  "
         assert format_str(c, {}) == c
 
+    def test_compiled_strs_oldest_evicted(self):
+        old_maxsize = lang._compiled_strs_maxsize
+        lang._compiled_strs_maxsize = 3
+        try:
+            for i in range(10):
+                assert format_str('evicted $foo {0}'.format(i), {'foo': 'x'}) == \
+                    'evicted x {0}'.format(i)
+            assert len(lang._compiled_strs) <= 3
+            assert len(lang._compiled_strs_order) == len(lang._compiled_strs)
+            keys = [k[0] for k in lang._compiled_strs]
+            assert 'evicted $foo 0' not in keys
+            assert 'evicted $foo 9' in keys
+        finally:
+            lang._compiled_strs_maxsize = old_maxsize
+
     def test_format_str_with_homedir(self):
         c = "~/foo"
         assert format_str(c, {}) == os.path.expanduser('~/foo')
+
+    @pytest.mark.parametrize(('comm', 'arg_dict', 'result'), [
+        ('\\~ \\\\~/$foo', {'foo': 'a'}, '~ \\\\' + os.path.expanduser('~') + '/a'),
+        ('$foo~', {'foo': 'x\\'}, 'x~'),
+        ('\\$foo~', {'foo': ''}, '~'),
+        ('$foo/x', {'foo': '~'}, os.path.expanduser('~') + '/x'),
+    ])
+    def test_format_str_homedir_around_variables(self, comm, arg_dict, result):
+        # run twice to make sure that the compiled string gives the same result
+        assert format_str(comm, arg_dict) == result
+        assert format_str(comm, arg_dict) == result
+
+    def test_format_str_compiled_per_files_mapping(self):
+        kwargs = {'__files__': [self.files], '__files_dir__': [self.files_dir]}
+        assert format_str('cp *first', kwargs) == 'cp /a/b/c/f/g'
+        kwargs['__files__'].append({'first': {'source': 'x/y'}})
+        assert format_str('cp *first', kwargs) == 'cp /a/b/c/x/y'
+        kwargs['__files__'].pop()
+        assert format_str('cp *first', kwargs) == 'cp /a/b/c/f/g'
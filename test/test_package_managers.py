@@ -1,6 +1,9 @@
 import os
 import pytest
+import shutil
 import six
+import tempfile
+import threading
 
 from flexmock import flexmock
 
@@ -9,6 +12,8 @@ from devassistant.exceptions import ClException, DependencyException,\
                                     NoPackageManagerOperationalException,\
                                     NoPackageManagerException
 from devassistant.command_helpers import ClHelper, DialogHelper
+from devassistant.logger import logger
+from test.logger import LoggingHandler
 
 def module_not_available(module):
     try:
@@ -31,6 +36,24 @@ class TestRPMPackageManager(object):
     def test_was_rpm_installed(self):
         pass
 
+    def test_are_rpms_installed(self):
+        flexmock(ClHelper).should_receive('run_command')\
+                .with_args('rpm -q --whatprovides "foo" "bar" "baz"')\
+                .and_raise(ClException(None, 1, 'foo-1.0-1.x86_64\nno package provides bar\n'
+                                                'baz-2.0-1.noarch\nbaz-compat-2.0-1.noarch'))\
+                .once()
+        res = self.rpm.are_rpms_installed(['foo', 'bar', 'baz'])
+        assert res == {'foo': 'foo', 'bar': False, 'baz': 'baz'}
+
+    def test_are_rpms_installed_fallback(self):
+        # e.g. localized output, can't tell which rpms are missing
+        flexmock(ClHelper).should_receive('run_command')\
+                .with_args('rpm -q --whatprovides "foo" "bar"')\
+                .and_raise(ClException(None, 1, 'zadny balicek neposkytuje bar'))
+        flexmock(self.rpm).should_receive('rpm_q').with_args('foo').and_return('foo-1.0')
+        flexmock(self.rpm).should_receive('rpm_q').with_args('bar').and_return(False)
+        assert self.rpm.are_rpms_installed(['foo', 'bar']) == {'foo': 'foo-1.0', 'bar': False}
+
 
 class TestYUMPackageManager(object):
 
@@ -100,6 +123,7 @@ class TestDNFPackageManager(object):
 
     def setup_method(self, method):
         self.dpm = package_managers.DNFPackageManager
+        self.dpm.forget_base()
 
     @pytest.mark.parametrize(('group', 'output', 'result'), [
         ('foo', 'Installed Groups', 'foo'),
@@ -111,6 +135,34 @@ class TestDNFPackageManager(object):
         cmd_result = self.dpm.is_group_installed(group)
         assert cmd_result == result
 
+    def test_forget_base_removes_cachedir(self):
+        self.dpm._base_cachedir = tempfile.mkdtemp()
+        cachedir = self.dpm._base_cachedir
+        self.dpm.forget_base()
+        assert not os.path.exists(cachedir)
+        assert self.dpm._base_cachedir is None
+
+    def test_query_pkgs_installed_without_bindings(self):
+        flexmock(self.dpm).should_receive('_try_get_base').and_return(None)
+        flexmock(self.dpm).should_receive('are_rpms_installed').with_args(['foo'])\
+                          .and_return({'foo': 'foo-1.0'}).once()
+        flexmock(self.dpm).should_receive('is_group_installed').with_args('@bar')\
+                          .and_return(False).once()
+        assert self.dpm.query_pkgs_installed(['foo', '@bar']) == {'foo': 'foo-1.0', '@bar': False}
+
+    @pytest.mark.skipif(module_not_available('hawkey'), reason='Requires hawkey module')
+    def test_query_pkgs_installed_by_base(self):
+        fake_query = flexmock()
+        fake_query.should_receive('filter').with_args(provides='foo')\
+                  .and_return(flexmock(run=lambda: ['foo-1.0-1.x86_64']))
+        fake_query.should_receive('filter').with_args(file='/usr/bin/bar')\
+                  .and_return(flexmock(run=lambda: []))
+        fake_base = flexmock(sack=flexmock(query=lambda: flexmock(installed=lambda: fake_query)))
+        flexmock(self.dpm).should_receive('_try_get_base').and_return(fake_base)
+        flexmock(ClHelper).should_receive('run_command').never()
+        assert self.dpm.query_pkgs_installed(['foo', '/usr/bin/bar']) == \
+            {'foo': 'foo-1.0-1.x86_64', '/usr/bin/bar': False}
+
     def test_install(self):
         pkgs = ('foo', 'bar', 'baz')
 
@@ -153,6 +205,7 @@ class TestDNFPackageManager(object):
                                 sack=fake_sack,
                                 fill_sack=lambda *args, **kwargs: None,
                                 read_all_repos=lambda: None,
+                                reset=lambda goal: None,
                                 install=lambda x: True,
                                 resolve=lambda: None,
                                 transaction=flexmock(install_set=expected))
@@ -220,6 +273,21 @@ class TestPacmanPackageManager(object):
         self.ppm.should_receive('is_group_installed').and_return(False)
         assert not self.ppm.is_pkg_installed('foo')
 
+    def test_are_pkgs_installed(self):
+        flexmock(ClHelper).should_receive('run_command')\
+                          .with_args('pacman -Q "foo" "bar" "base-devel"')\
+                          .and_raise(ClException(None, 1, 'foo 1.0-1\n'
+                                                 'error: package \'bar\' was not found\n'
+                                                 'error: package \'base-devel\' was not found'))\
+                          .once()
+        flexmock(ClHelper).should_receive('run_command')\
+                          .with_args('pacman -Qg "bar" "base-devel"')\
+                          .and_raise(ClException(None, 1, 'base-devel gcc\nbase-devel make\n'
+                                                 'error: group \'bar\' was not found'))\
+                          .once()
+        assert self.ppm.are_pkgs_installed(['foo', 'bar', 'base-devel']) == \
+            {'foo': 'foo', 'bar': False, 'base-devel': 'base-devel'}
+
     def test_resolve(self):
         pass
 
@@ -400,6 +468,13 @@ class TestGemPackageManager(object):
                           .and_raise(ClException(None, None, None))
         assert not self.gpm.is_pkg_installed('baz')
 
+    def test_are_pkgs_installed(self):
+        flexmock(ClHelper).should_receive('run_command')\
+                          .with_args('gem list --local')\
+                          .and_return('foo (1.0, 0.9)\nbar (2.0)').once()
+        assert self.gpm.are_pkgs_installed(['foo', 'baz', 'bar']) == \
+            {'foo': 'foo (1.0, 0.9)', 'baz': False, 'bar': 'bar (2.0)'}
+
     def test_resolve(self):
         pkgs = ('foo', 'bar', 'baz')
         assert self.gpm.resolve(*pkgs) == tuple(pkgs)
@@ -414,6 +489,7 @@ class TestGentooPackageManager(object):
         self.gpm = package_managers.GentooPackageManager
 
     def teardown_method(self, method):
+        utils.set_system_facts(None)
         try:
             delattr(self.gpm, 'works_result')
         except:
@@ -424,10 +500,10 @@ class TestGentooPackageManager(object):
         assert self.gpm.PALUDIS == 1
 
     def test_try_get_current_manager_fails(self):
-        flexmock(utils).should_receive('get_distro_name.find').with_args('gentoo').and_return(-1)
+        utils.set_system_facts(utils.SystemFacts('linux', '', 'fedora', ''))
         assert self.gpm._try_get_current_manager() is None
 
-        flexmock(utils).should_receive('get_distro_name.find').with_args('gentoo').and_return(0)
+        utils.set_system_facts(utils.SystemFacts('linux', '', 'gentoo', ''))
         flexmock(os).should_receive('environ').and_return({'PACKAGE_MANAGER': 'foo'})
         assert self.gpm._try_get_current_manager() is None
 
@@ -436,7 +512,7 @@ class TestGentooPackageManager(object):
         ('portage', package_managers.GentooPackageManager.PORTAGE),
     ])
     def test_try_get_current_manager(self, manager, man_val):
-        flexmock(utils).should_receive('get_distro_name.find').with_args('gentoo').and_return(0)
+        utils.set_system_facts(utils.SystemFacts('linux', '', 'gentoo', ''))
         mock = flexmock(six.moves.builtins)
 
         flexmock(os).should_receive('environ').and_return({'PACKAGE_MANAGER': manager})
@@ -580,10 +656,85 @@ class TestPaludisPackageManager(object):
         pass
 
 
+class TestInstalledSnapshot(object):
+
+    def setup_method(self, method):
+        self.snap = package_managers.InstalledSnapshot
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmpdir, 'db')
+        os.mkdir(self.db)
+        settings.DEPS_CACHE_FILE = os.path.join(self.tmpdir, '.deps_cache.bin')
+        self.snap._snapshot = None
+
+        db = self.db
+        class FooManager(package_managers.PackageManager):
+            @classmethod
+            def get_db_paths(cls):
+                return [db]
+
+        self.mgr = FooManager
+
+    def teardown_method(self, method):
+        settings.DEPS_CACHE_FILE = None
+        self.snap._snapshot = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_installed_pkgs_are_not_queried_again(self):
+        flexmock(self.mgr).should_receive('query_pkgs_installed').with_args(['foo', 'bar'])\
+                          .and_return({'foo': 'foo-1.0', 'bar': False}).once()
+        flexmock(self.mgr).should_receive('query_pkgs_installed').with_args(['bar'])\
+                          .and_return({'bar': False}).once()
+        assert self.mgr.are_pkgs_installed(['foo', 'bar']) == {'foo': 'foo-1.0', 'bar': False}
+        # simulate a new DevAssistant run, the snapshot must be loaded from disk
+        self.snap._snapshot = None
+        assert self.mgr.are_pkgs_installed(['foo', 'bar']) == {'foo': 'foo-1.0', 'bar': False}
+
+    def test_snapshot_hit_logs_package_name(self):
+        flexmock(self.mgr).should_receive('query_pkgs_installed').with_args(['foo'])\
+                          .and_return({'foo': True}).once()
+        assert self.mgr.are_pkgs_installed(['foo']) == {'foo': True}
+        tlh = LoggingHandler.create_fresh_handler()
+        try:
+            assert self.mgr.are_pkgs_installed(['foo']) == {'foo': True}
+        finally:
+            logger.removeHandler(tlh)
+        assert ('INFO', 'Found foo') in tlh.msgs
+
+    def test_db_change_invalidates_snapshot(self):
+        flexmock(self.mgr).should_receive('query_pkgs_installed').with_args(['foo'])\
+                          .and_return({'foo': True}).twice()
+        assert self.mgr.are_pkgs_installed(['foo']) == {'foo': True}
+        mtime = os.stat(self.db).st_mtime
+        os.utime(self.db, (mtime + 10, mtime + 10))
+        assert self.mgr.are_pkgs_installed(['foo']) == {'foo': True}
+
+    def test_no_db_paths_no_snapshot(self):
+        shutil.rmtree(self.db)
+        flexmock(self.mgr).should_receive('query_pkgs_installed').and_return({'foo': True})\
+                          .twice()
+        self.mgr.are_pkgs_installed(['foo'])
+        self.mgr.are_pkgs_installed(['foo'])
+        assert not os.path.exists(settings.DEPS_CACHE_FILE)
+
+    @pytest.mark.parametrize('mgr', [package_managers.PIPPackageManager,
+                                     package_managers.NPMPackageManager])
+    def test_pip_and_npm_not_remembered(self, mgr):
+        # their databases depend on the pip/npm executable and directory they are run in
+        flexmock(mgr).should_receive('query_pkgs_installed').and_return({'foo': True})\
+                     .twice()
+        mgr.are_pkgs_installed(['foo'])
+        mgr.are_pkgs_installed(['foo'])
+        assert not os.path.exists(settings.DEPS_CACHE_FILE)
+
+
 class TestDependencyInstaller(object):
 
     def setup_method(self, method):
         self.di = package_managers.DependencyInstaller()
+        self.di.invalidate_package_managers()
+
+    def teardown_method(self, method):
+        utils.set_system_facts(None)
 
     def test_get_package_manager(self):
         # also mock __name__ for package managers, since they're supposed to be classes
@@ -602,6 +753,26 @@ class TestDependencyInstaller(object):
         with pytest.raises(NoPackageManagerException):
             self.di.get_package_manager('foobar')
 
+    def test_get_package_manager_remembered(self):
+        mgr = flexmock(__name__='mgr')
+        mgr.should_receive('works').and_return(True).once()
+        flexmock(package_managers).should_receive('managers').and_return({'foo': [mgr]})
+
+        assert self.di.get_package_manager('foo') == mgr
+        assert package_managers.DependencyInstaller().get_package_manager('foo') == mgr
+
+    def test_get_package_manager_invalidated(self):
+        mgr = flexmock(__name__='mgr')
+        mgr.should_receive('works').and_return(False).and_return(True).twice()
+        flexmock(package_managers).should_receive('managers').and_return({'foo': [mgr]})
+
+        with pytest.raises(NoPackageManagerOperationalException):
+            self.di.get_package_manager('foo')
+        with pytest.raises(NoPackageManagerOperationalException):
+            self.di.get_package_manager('foo')
+        self.di.invalidate_package_managers()
+        assert self.di.get_package_manager('foo') == mgr
+
     def test_process_dependency_fails(self):
         flexmock(package_managers).should_receive('managers')\
                                   .and_return({'foomgr': []})
@@ -614,7 +785,7 @@ class TestDependencyInstaller(object):
                                   .and_return({'foomgr': []})
         flexmock(settings, SYSTEM_DEPTYPES_SHORTCUTS={'foomgr': ['foodistro'],
                                                       'barmgr': ['bardistro']})
-        flexmock(utils, get_distro_name=lambda: 'foodistro')
+        utils.set_system_facts(utils.SystemFacts('linux', '', 'foodistro', ''))
 
         self.di._process_dependency('foomgr', ['bar'])
         assert self.di.dependencies == [('foomgr', ['bar'])]
@@ -624,7 +795,7 @@ class TestDependencyInstaller(object):
         flexmock(package_managers).should_receive('managers')\
                                   .and_return({'foomgr': [foomgr], 'barmgr': []})
         flexmock(settings, SYSTEM_DEPTYPES_SHORTCUTS={'barmgr': ['foodistro']})
-        flexmock(utils, get_distro_name=lambda: 'foodistro')
+        utils.set_system_facts(utils.SystemFacts('linux', '', 'foodistro', ''))
         flexmock(self.di, get_system_deptype_shortcut=lambda: 'barmgr')
 
         self.di._process_dependency('foomgr', ['bar', 'baz'])
@@ -640,6 +811,14 @@ class TestDependencyInstaller(object):
 
         assert self.di._ask_to_confirm('cli', fake_mgr, *pkg_list) is val
 
+    def test_are_pkgs_installed_default(self):
+        class FooManager(package_managers.PackageManager):
+            @classmethod
+            def is_pkg_installed(cls, pkg):
+                return pkg == 'foo'
+
+        assert FooManager.are_pkgs_installed(['foo', 'bar']) == {'foo': True, 'bar': False}
+
     def test_install_dependencies_empty(self):
         self.di.dependencies = [('foomgr', [])]
         flexmock(self.di).should_call('get_package_manager').never()
@@ -648,7 +827,8 @@ class TestDependencyInstaller(object):
 
     def test_install_dependencies_already_installed(self):
         self.di.dependencies = [('foomgr', ['foo', 'bar'])]
-        pkg_mgr = flexmock(works=lambda: True, is_pkg_installed=lambda x: True,
+        pkg_mgr = flexmock(works=lambda: True,
+                           are_pkgs_installed=lambda x: dict((p, True) for p in x),
                            resolve=lambda x: None)
         flexmock(package_managers).should_receive('managers')\
                                   .and_return({'foomgr': [pkg_mgr]})
@@ -658,7 +838,8 @@ class TestDependencyInstaller(object):
 
     def test_install_dependencies_denied(self):
         self.di.dependencies = [('foomgr', ['foo', 'bar'])]
-        pkg_mgr = flexmock(works=lambda: True, is_pkg_installed=lambda x: False)
+        pkg_mgr = flexmock(works=lambda: True,
+                           are_pkgs_installed=lambda x: dict((p, False) for p in x))
         pkg_mgr.should_receive('resolve').and_return(['foo', 'bar', 'baz'])
         flexmock(package_managers).should_receive('managers')\
                                   .and_return({'foomgr': [pkg_mgr]})
@@ -670,7 +851,8 @@ class TestDependencyInstaller(object):
     @pytest.mark.parametrize('ui', ['cli', 'foo'])
     def test_install_dependencies(self, ui):
         self.di.dependencies = [('foomgr', ['foo', 'bar'])]
-        pkg_mgr = flexmock(works=lambda: True, is_pkg_installed=lambda x: False)
+        pkg_mgr = flexmock(works=lambda: True,
+                           are_pkgs_installed=lambda x: dict((p, False) for p in x))
         pkg_mgr.should_receive('resolve').and_return(['foo', 'bar', 'baz'])
         flexmock(package_managers).should_receive('managers')\
                                   .and_return({'foomgr': [pkg_mgr]})
@@ -688,13 +870,90 @@ class TestDependencyInstaller(object):
         with pytest.raises(DependencyException):
             self.di._install_dependencies(ui=ui, debug=False)
 
+    def test_install_dependencies_probes_all_types_first(self):
+        self.di.dependencies = [('foomgr', ['foo']), ('barmgr', ['bar'])]
+        probed = []
+        foo_mgr = flexmock(works=lambda: True,
+                           are_pkgs_installed=lambda x: probed.append(x) or {'foo': True})
+        bar_mgr = flexmock(works=lambda: True,
+                           are_pkgs_installed=lambda x: probed.append(x) or {'bar': True})
+        flexmock(package_managers).should_receive('managers')\
+                                  .and_return({'foomgr': [foo_mgr], 'barmgr': [bar_mgr]})
+
+        self.di._install_dependencies(ui='foo', debug=False)
+        assert sorted(probed) == [['bar'], ['foo']]
+
+    def test_install_dependencies_reprobes_after_installation(self):
+        # e.g. pip doesn't work before python-pip gets installed by system manager
+        self.di.dependencies = [('foomgr', ['pip']), ('barmgr', ['bar'])]
+        foo_mgr = flexmock(works=lambda: True, are_pkgs_installed=lambda x: {'pip': False},
+                           resolve=lambda *x: x, install=lambda *x: x)
+        bar_mgr = flexmock(are_pkgs_installed=lambda x: {'bar': True})
+        bar_mgr.should_receive('works').and_return(False).and_return(True).and_return(True)
+        flexmock(package_managers).should_receive('managers')\
+                                  .and_return({'foomgr': [foo_mgr], 'barmgr': [bar_mgr]})
+        flexmock(self.di).should_receive('_ask_to_confirm').and_return(True)
+
+        self.di._install_dependencies(ui='foo', debug=False)
+
+    def test_install_dependencies_reprobes_only_managers_that_installed(self):
+        self.di.dependencies = [('foomgr', ['foo']), ('barmgr', ['bar']), ('bazmgr', ['baz'])]
+        probed = []
+        foo_mgr = flexmock(works=lambda: True, resolve=lambda *x: x, install=lambda *x: x,
+                           are_pkgs_installed=lambda x: probed.append(x) or
+                               dict((p, p != 'foo') for p in x))
+        bar_mgr = flexmock(works=lambda: True,
+                           are_pkgs_installed=lambda x: probed.append(x) or {'bar': True})
+        flexmock(package_managers).should_receive('managers')\
+                                  .and_return({'foomgr': [foo_mgr], 'barmgr': [bar_mgr],
+                                               'bazmgr': [foo_mgr]})
+        flexmock(self.di).should_receive('_ask_to_confirm').and_return(True)
+
+        self.di._install_dependencies(ui='foo', debug=False)
+        assert sorted(probed) == [['bar'], ['baz'], ['baz'], ['foo']]
+
+    def test_probe_messages_logged_in_order(self):
+        self.di.dependencies = [('foomgr', ['foo']), ('barmgr', ['bar'])]
+        bar_logged = threading.Event()
+        def foo_installed(pkgs):
+            # make sure that "bar" gets logged first
+            bar_logged.wait(5)
+            logger.info('Checking foo')
+            return {'foo': True}
+        def bar_installed(pkgs):
+            logger.info('Checking bar')
+            bar_logged.set()
+            return {'bar': True}
+        foo_mgr = flexmock(works=lambda: True, are_pkgs_installed=foo_installed)
+        bar_mgr = flexmock(works=lambda: True, are_pkgs_installed=bar_installed)
+        flexmock(package_managers).should_receive('managers')\
+                                  .and_return({'foomgr': [foo_mgr], 'barmgr': [bar_mgr]})
+        tlh = LoggingHandler.create_fresh_handler()
+        try:
+            self.di._install_dependencies(ui='foo', debug=False)
+        finally:
+            logger.removeHandler(tlh)
+        assert bar_logged.is_set()
+        assert [m for m in tlh.msgs if m[1].startswith('Checking')] == \
+            [('INFO', 'Checking foo'), ('INFO', 'Checking bar')]
+
+    def test_install_dependencies_failed_probe_raises(self):
+        self.di.dependencies = [('foomgr', ['foo']), ('barmgr', ['bar'])]
+        foo_mgr = flexmock(works=lambda: True, are_pkgs_installed=lambda x: {'foo': True})
+        bar_mgr = flexmock(works=lambda: False, __name__='bar_mgr')
+        flexmock(package_managers).should_receive('managers')\
+                                  .and_return({'foomgr': [foo_mgr], 'barmgr': [bar_mgr]})
+
+        with pytest.raises(NoPackageManagerOperationalException):
+            self.di._install_dependencies(ui='foo', debug=False)
+
     @pytest.mark.parametrize(('distro', 'dep_t'), [
         ('foodistro', 'foomgr'),
         ('bardistro', 'barmgr'),
         ('bazdistro', 'rpm')
     ])
     def test_get_system_deptype_shortcut(self, distro, dep_t):
-        flexmock(utils).should_receive('get_distro_name').and_return(distro)
+        utils.set_system_facts(utils.SystemFacts('linux', '', distro, ''))
         flexmock(settings, SYSTEM_DEPTYPES_SHORTCUTS={'foomgr': ['foodistro'],
                                                       'barmgr': ['bardistro']})
         assert self.di.get_system_deptype_shortcut() == dep_t
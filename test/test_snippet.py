@@ -1,3 +1,4 @@
+import copy
 import os
 import pytest
 
@@ -58,3 +59,20 @@ class TestSnippet(object):
         assert snip.get_files_section() == expected
 
 
+
+    def test_sections_are_shared_and_immutable(self):
+        snip = Snippet('', {'run': [{'cl': 'ls'}], 'files': {'f': {'source': 'f'}}}, '')
+        assert snip.get_run_section() is snip.get_run_section()
+        assert snip.get_files_section() is snip.get_files_section()
+        with pytest.raises(TypeError):
+            snip.get_run_section().append({'cl': 'foo'})
+        with pytest.raises(TypeError):
+            snip.get_run_section()[0]['cl'] = 'foo'
+        mutable = copy.deepcopy(snip.get_run_section())
+        mutable[0]['cl'] = 'foo'
+        assert snip.get_run_section() == [{'cl': 'ls'}]
+
+    def test_get_arg_by_name_returns_mutable_copy(self):
+        snip = Snippet('', {'args': {'foo': {'flags': ['-f']}}}, '')
+        snip.get_arg_by_name('foo')['flags'].append('--foo')
+        assert snip.args == {'foo': {'flags': ['-f']}}
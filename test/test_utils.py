@@ -1,5 +1,10 @@
+import copy
+import pickle
+
 import pytest
 import os
+import yaml
+from flexmock import flexmock
 
 from devassistant import utils
 
@@ -14,6 +19,22 @@ class TestFindFileInLoadDirs(object):
         assert utils.find_file_in_load_dirs('files/does_not_exist') is None
 
 
+class TestLazyModule(object):
+
+    def test_imported_on_attribute_access(self):
+        flexmock(utils).should_receive('import_module').with_args('json').once().\
+            and_return(flexmock(dumps=lambda x: 'foo'))
+        module = utils.LazyModule('json')
+        assert module.dumps([]) == 'foo'
+        assert module
+
+    def test_missing_module(self):
+        module = utils.LazyModule('devassistant_no_such_module')
+        assert not module
+        with pytest.raises(AttributeError):
+            module.foo
+
+
 class TestStripPrefix(object):
 
     @pytest.mark.parametrize(('inp', 'prefix', 'out'), [
@@ -84,3 +105,64 @@ class TestStripSuffix(object):
     def test_fails(self, inp, suffix):
         with pytest.raises(TypeError) as e:
             utils.strip_suffix(inp, suffix)
+
+
+class TestFreeze(object):
+    struct = {'a': [1, {'b': 'c'}], 'd': 'e'}
+
+    def test_freeze(self):
+        frozen = utils.freeze(self.struct)
+        assert frozen == self.struct
+        assert isinstance(frozen, dict)
+        assert isinstance(frozen['a'], list)
+
+    @pytest.mark.parametrize('mutate', [
+        lambda f: f.update({'x': 'y'}),
+        lambda f: f.pop('a'),
+        lambda f: f.setdefault('x', 'y'),
+        lambda f: f['a'].append(2),
+        lambda f: f['a'].extend([2]),
+        lambda f: f['a'][1].clear(),
+    ])
+    def test_frozen_is_immutable(self, mutate):
+        frozen = utils.freeze(self.struct)
+        with pytest.raises(TypeError):
+            mutate(frozen)
+        assert frozen == self.struct
+
+    def test_copies_are_mutable(self):
+        frozen = utils.freeze(self.struct)
+        deep = copy.deepcopy(frozen)
+        deep['a'][1]['b'] = 'x'
+        shallow = copy.copy(frozen)
+        shallow['x'] = 'y'
+        assert type(deep['a']) == list
+        assert frozen == self.struct
+
+    def test_frozen_can_be_pickled_and_dumped(self):
+        frozen = utils.freeze(self.struct)
+        assert pickle.loads(pickle.dumps(frozen)) == self.struct
+        assert yaml.dump(frozen, Dumper=utils.Dumper) == \
+            yaml.dump(self.struct, Dumper=utils.Dumper)
+
+
+class TestSystemFacts(object):
+    def teardown_method(self, method):
+        utils.set_system_facts(None)
+
+    def test_detected_once(self):
+        flexmock(utils).should_receive('_detect_system_name').and_return('linux').once()
+        flexmock(utils).should_receive('_detect_distro_name').and_raise(IOError)
+        utils.set_system_facts(None)
+        facts = utils.get_system_facts()
+        assert facts.system_name == 'linux'
+        assert facts.distro_name == ''
+        assert utils.get_system_facts() is facts
+        assert utils.get_system_name() == 'linux'
+
+    def test_override(self):
+        utils.set_system_facts(utils.SystemFacts('linux', '4.0', 'foodistro', '1'))
+        assert utils.get_distro_name() == 'foodistro'
+        assert utils.get_distro_version() == '1'
+        with pytest.raises(AttributeError):
+            utils.get_system_facts().distro_name = 'bardistro'
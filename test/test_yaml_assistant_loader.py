@@ -6,8 +6,11 @@ import yaml
 from devassistant.assistant_base import AssistantBase
 from devassistant import exceptions
 from devassistant import settings
+from devassistant.cache import Cache
 from devassistant.yaml_assistant_loader import YamlAssistantLoader
+from devassistant.yaml_snippet_loader import YamlSnippetLoader
 
+from test import fixtures_dir
 from test.logger import LoggingHandler
 
 class CreatorAssistant(AssistantBase):
@@ -18,6 +21,11 @@ class TestYamlAssistantLoader(object):
         self.yl = YamlAssistantLoader
         self.reset_yl_assistants_dirs()
         self.yl._assistants = {}
+        # snippets_dirs are computed when yaml_snippet_loader is first imported, which may
+        #  happen before test/__init__ sets DATA_DIRECTORIES (depending on test order)
+        YamlSnippetLoader.snippets_dirs = [os.path.join(fixtures_dir, 'snippets')]
+        YamlSnippetLoader._snippets = {}
+        Cache._instances = {}
         self.tlh = LoggingHandler.create_fresh_handler()
 
     def teardown_method(self, method):
@@ -104,6 +112,35 @@ class TestYamlAssistantLoader(object):
         assert set(['c', 'f']) == set(map(lambda x: x.name, ass))
         self.yl.get_assistants_from_cache_hierarchy = oldm
 
+    def test_get_cli_schema_assistants(self):
+        ass = self.yl.get_cli_schema_assistants(CreatorAssistant())
+        assert set(['c', 'f']) == set(map(lambda x: x.name, ass))
+        c = [a for a in ass if a.name == 'c'][0]
+        assert c.description == 'C Language Tool description...'
+        assert [a.flags for a in c.args] == [('-f', '--foo')]
+        assert set(['d', 'e']) == set(map(lambda x: x.name, c.get_subassistants()))
+
+    def test_get_cli_schema_assistants_no_cache(self):
+        settings.USE_CACHE = False
+        assert self.yl.get_cli_schema_assistants(CreatorAssistant()) is None
+
+    def test_get_assistants_from_file_hierarchy_in_parallel(self, monkeypatch):
+        dirs = [os.path.join(d, 'crt') for d in self.yl.assistants_dirs]
+        fh = self.yl.get_assistants_file_hierarchy(dirs)
+        serial = self.yl.get_assistants_from_file_hierarchy(fh, CreatorAssistant())
+        monkeypatch.setattr(settings, 'YAML_LOADING_PROCESSES', 2)
+        parallel = self.yl.get_assistants_from_file_hierarchy(fh, CreatorAssistant())
+
+        def names(assistants):
+            return sorted([(a.name, a.path, names(a._subassistants)) for a in assistants])
+        assert names(serial) == names(parallel)
+
+    def test_get_file_hierarchy_sources(self):
+        fh = {'a': {'source': 'a.yaml',
+                    'subhierarchy': {'b': {'source': 'a/b.yaml', 'subhierarchy': {}}}},
+              'c': {'source': 'c.yaml', 'subhierarchy': {}}}
+        assert sorted(self.yl.get_file_hierarchy_sources(fh)) == ['a.yaml', 'a/b.yaml', 'c.yaml']
+
     def test_get_assistants_from_file_hierarchy_with_empty_assistant(self):
         empty = os.path.join(os.path.dirname(__file__),
                              'fixtures',
@@ -3,6 +3,7 @@ import re
 
 import pytest
 
+from devassistant import settings
 from devassistant.yaml_loader import YamlLoader
 
 from test.logger import LoggingHandler
@@ -30,3 +31,29 @@ class TestYamlLoader(object):
         assert YamlLoader.load_yaml_by_path(path) == None
         assert 'WARNING' == self.tlh.msgs[0][0]
         assert re.match(e, self.tlh.msgs[0][1])
+
+    @pytest.mark.parametrize('recursive', [True, False])
+    def test_get_yaml_fingerprints(self, tmpdir, recursive):
+        tmpdir.join('a.yaml').write('a: b')
+        tmpdir.join('b.txt').write('')
+        tmpdir.mkdir('sub').join('c.yaml').write('c: d')
+        fingerprints = YamlLoader.get_yaml_fingerprints(str(tmpdir), recursive=recursive)
+        expected = [str(tmpdir.join('a.yaml'))]
+        if recursive:
+            expected.append(str(tmpdir.join('sub', 'c.yaml')))
+        assert sorted(fingerprints.keys()) == expected
+        st = os.stat(expected[0])
+        assert fingerprints[expected[0]][1:] == [st.st_size, st.st_ino]
+
+    def test_get_yaml_fingerprints_nonexistent_dir(self):
+        assert YamlLoader.get_yaml_fingerprints('/thoushaltnotexist') == {}
+
+    def test_load_yamls_by_paths_in_parallel(self, monkeypatch):
+        paths = [os.path.join(self.bad_syntax, f) for f in sorted(os.listdir(self.bad_syntax))]
+        serial = YamlLoader.load_yamls_by_paths(paths)
+        serial_msgs = self.tlh.msgs
+        self.tlh.msgs = []
+        monkeypatch.setattr(settings, 'YAML_LOADING_PROCESSES', 2)
+        assert YamlLoader.load_yamls_by_paths(paths * 2) == serial
+        # errors are logged by the main process
+        assert sorted(self.tlh.msgs) == sorted(serial_msgs * 2)
@@ -1,7 +1,11 @@
 import os
+from multiprocessing.pool import ThreadPool
+
 import pytest
+from flexmock import flexmock
 
 from devassistant import exceptions
+from devassistant import yaml_loader
 from devassistant.yaml_snippet_loader import YamlSnippetLoader
 
 class TestYamlSnippetLoader(object):
@@ -49,3 +53,53 @@ class TestYamlSnippetLoader(object):
             self.yl.get_snippet_by_name(snippet)
         assert err_str in str(excinfo.value)
 
+
+    def test_get_snippet_by_name_parses_snippet_only_once(self):
+        flexmock(yaml_loader.YamlLoader).should_call('load_yaml_by_path').once()
+        s = self.yl.get_snippet_by_name('snippet2')
+        assert self.yl.get_snippet_by_name('snippet2') is s
+
+    def test_get_snippet_by_name_reloads_changed_snippet(self, tmpdir):
+        self.yl.snippets_dirs = [str(tmpdir)]
+        tmpdir.join('snip.yaml').write('run:\n- log_i: foo\n')
+        assert self.yl.get_snippet_by_name('snip').get_run_section() == [{'log_i': 'foo'}]
+        tmpdir.join('snip.yaml').write('run:\n- log_i: barbaz\n')
+        assert self.yl.get_snippet_by_name('snip').get_run_section() == [{'log_i': 'barbaz'}]
+        tmpdir.join('snip.yaml').remove()
+        with pytest.raises(exceptions.SnippetNotFoundException):
+            self.yl.get_snippet_by_name('snip')
+
+    def test_get_changed_snippet_from_more_threads(self, tmpdir):
+        self.yl.snippets_dirs = [str(tmpdir)]
+        tmpdir.join('snip.yaml').write('run:\n- log_i: foo\n')
+        self.yl.get_snippet_by_name('snip')
+        tmpdir.join('snip.yaml').write('run:\n- log_i: barbaz\n')
+        # all threads see the changed fingerprint and try to throw the old snippet away
+        pool = ThreadPool(8)
+        try:
+            snips = pool.map(lambda x: self.yl.get_snippet_by_name('snip'), range(32))
+        finally:
+            pool.close()
+            pool.join()
+        assert [s.get_run_section() for s in snips] == [[{'log_i': 'barbaz'}]] * 32
+
+    def test_preload(self):
+        self.yl.preload()
+        assert sorted(k[0] for k in self.yl._snippets.keys()) == \
+            ['snippet1', 'snippet2', 'snippetd.subdir.snippet1']
+        flexmock(yaml_loader.YamlLoader).should_receive('load_yaml_by_path').never()
+        assert self.yl.get_snippet_by_name('snippetd.subdir.snippet1').name == 'snippet1'
+
+    def test_preload_skips_malformed_snippets(self):
+        self.reset_yl_snippets_dirs('snippets_malformed')
+        self.yl.preload()
+        assert self.yl._key('snippet1') not in self.yl._snippets
+
+    def test_get_snippet_by_name_after_snippets_dirs_change(self, tmpdir):
+        assert self.yl.get_snippet_by_name('snippet1').get_run_section() == \
+            [{'log_i': 'this is snippet1!'}]
+        tmpdir.join('snippet1.yaml').write('run:\n- log_i: overriden\n')
+        # e.g. user added a snippet to a directory with higher priority
+        self.yl.snippets_dirs = [str(tmpdir)] + self.yl.snippets_dirs
+        assert self.yl.get_snippet_by_name('snippet1').get_run_section() == \
+            [{'log_i': 'overriden'}]